@@ -1,14 +1,26 @@
 from flask import Flask
-from flask_script import Manager
 from flask_bootstrap import Bootstrap
-from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_mail import Mail
 
-from celery import Celery
 from config import config, Config
+from .rbac import RbacCache
+from .token_cache import TokenCache
+from .passwords import PasswordHasher
+from .response_cache import ResponseCache
+from .query_stats import QueryCounter
+from .metrics import Metrics
+from .logs import StructuredLogging
+from .mail_pool import MailPool
+from .lazy_celery import LazyCelery
+from .outbox import Outbox
+from .template_cache import TemplateCache
+from .db_routing import RoutingSQLAlchemy, ReadReplicas, ReadOnlyRequests
+from .claims_tokens import ClaimsTokens
 
 mail = Mail()
+mail_pool = MailPool()
+outbox = Outbox()
 
 login_manager = LoginManager()
 login_manager.session_protection = 'strong'
@@ -16,10 +28,19 @@ login_manager.login_view = 'auth_bp.login'
 
 bootstrap = Bootstrap()
 
-manager = Manager()
-
-db = SQLAlchemy()
-celery = Celery(__name__, broker=Config.CELERY_BROKER_URL)
+db = RoutingSQLAlchemy()
+read_replicas = ReadReplicas()
+read_only_requests = ReadOnlyRequests()
+rbac_cache = RbacCache()
+token_cache = TokenCache()
+claims_tokens = ClaimsTokens()
+password_hasher = PasswordHasher()
+response_cache = ResponseCache()
+query_counter = QueryCounter()
+metrics = Metrics()
+structured_logging = StructuredLogging()
+template_cache = TemplateCache()
+celery = LazyCelery(__name__, broker=Config.CELERY_BROKER_URL)
 
 def create_app(config_name):
     # create app instance
@@ -28,12 +49,25 @@ def create_app(config_name):
 
     # initialize all extensions - extension specific to any BP should be initialized in BP itself(e.g HTTPAuth)
     config[config_name].init_app(app)
+    structured_logging.init_app(app)
+    template_cache.init_app(app)  # before extensions that use jinja_env
     bootstrap.init_app(app)
     db.init_app(app)
+    read_replicas.init_app(app)
+    read_only_requests.init_app(app)
     login_manager.init_app(app)
     # moment.init_app(app)
     mail.init_app(app)
-    celery.conf.update(app.config)
+    mail_pool.init_app(app)
+    outbox.init_app(app)
+    rbac_cache.init_app(app)
+    token_cache.init_app(app)
+    claims_tokens.init_app(app)
+    password_hasher.init_app(app)
+    response_cache.init_app(app)
+    query_counter.init_app(app)
+    metrics.init_app(app)
+    celery.init_app(app)
 
     # Attach routes and custom errors here
     from main_bp import main_bp
@@ -7,6 +7,17 @@ class RestApiErrors(object):
     This class implements all the helper functions for API errors
     """
 
+    @staticmethod
+    def bad_request_400(message):
+        """
+        400 Bad request - The request is invalid or inconsistent.
+
+        :param message:  Message to return to client
+        """
+        response = jsonify({'error': 'bad request', 'message': message})
+        response.status_code = 400
+        return response
+
     @staticmethod
     def forbidden_403(message):
         """
@@ -1,13 +1,23 @@
-from flask import g, jsonify, current_app
+import logging
+from flask import g, jsonify, current_app, request
 from flask_httpauth import HTTPBasicAuth
-from ..models import AnonymousUser, User, Role
+from ..models import AnonymousUser, User, Role, ValidationError
 from sqlalchemy.orm.exc import NoResultFound
 from errors import RestApiErrors
 from . import api_bp
 from ..decorators import permissions_required
+from .. import db, read_replicas, claims_tokens
+from ..db_routing import use_primary, read_write
+from ..refresh_tokens import issue_refresh_token, rotate_refresh_token, revoke_refresh_tokens
 
 auth = HTTPBasicAuth()
 
+# child of the application logger - can be sampled separately (LOG_SAMPLING_RATES)
+logger = logging.getLogger(__name__)
+
+# endpoints authenticated by refresh token in the body instead of credentials
+AUTH_EXEMPT_ENDPOINTS = frozenset(['api_bp.refresh_token', 'api_bp.revoke_token'])
+
 
 @auth.verify_password
 def verify_password(email_or_token, password):
@@ -45,37 +55,34 @@ def verify_password(email_or_token, password):
     '''
 
     # No authentication method selected
-    current_app.logger.debug('Params are -  email_or_token:{}, password:{}'.format(email_or_token, password))
     if email_or_token == '':
         g.current_user = AnonymousUser()
-        current_app.logger.debug('g.current_user is anonymous - password verification failed')
+        logger.debug('Anonymous request - password verification failed')
         return False
 
-    # Token authentication
+    # Token authentication - claims tokens are verified without queries
     if password == '':
-        current_app.logger.debug('Password is empty - setting g.token_used to True')
         g.token_used = True
-        current_app.logger.debug('Trying to verify token..')
-        g.current_user = User.verify_auth_token(email_or_token)
-        current_app.logger.debug('Current user loaded after token verification is {} , '
-                                 'should not be None or Anonymous'.format(g.current_user))
+        if claims_tokens.is_claims_token(email_or_token):
+            g.current_user = claims_tokens.verify(email_or_token)
+        else:
+            g.current_user = User.verify_auth_token(email_or_token)
+        logger.debug('Token verification status: %s', g.current_user is not None)
         return g.current_user is not None
 
-    # Email/password authentication
-    current_app.logger.debug('Trying email authentication')
+    # Email/password authentication - credentials are read from the primary (replica may lag behind)
     try:
-        user = User.query.filter_by(email=email_or_token).one()
+        with read_replicas.primary():
+            user = User.query.filter_by(email=email_or_token).one()
     except NoResultFound:
-        current_app.logger.debug('Could not fetch user with email {}, '
-                                 'password verification failed'.format(email_or_token))
+        logger.debug('Could not fetch user with email %s, password verification failed', email_or_token)
         g.current_user = AnonymousUser()
         return False
-    current_app.logger.debug('Loaded user {}'.format(user))
     g.current_user = user
     g.token_used = False
-    current_app.logger.debug(
-        'Password verification status: {}'.format(user.password_is_correct(password)))
-    return user.password_is_correct(password)
+    is_correct = user.password_is_correct(password)
+    logger.debug('Password verification of user %s status: %s', user.id, is_correct)
+    return is_correct
 
 
 @auth.error_handler
@@ -91,31 +98,55 @@ def auth_error():
     return RestApiErrors.unauthorized_401('invalid credentials')
 
 
-@api_bp.before_request
 @auth.login_required
+def _authenticate():
+    if not g.current_user.is_anonymous and not g.current_user.confirmed:
+        return RestApiErrors.forbidden_403('Unconfirmed account')
+
+
+@api_bp.before_request
 def before_request():
     """
     since all the routes in the blueprint need to be protected in the same way,
     the login_required decorator can be included once in a before_request handler for the blueprint
+    (except of AUTH_EXEMPT_ENDPOINTS)
     :return:
     """
-    if not g.current_user.is_anonymous and not g.current_user.confirmed:
-        return RestApiErrors.forbidden_403('Unconfirmed account')
+    if request.endpoint not in AUTH_EXEMPT_ENDPOINTS:
+        return _authenticate()
+
+
+def _tokens_response(user, refresh_token, refresh_expiration):
+    expiration = current_app.config['API_TOKEN_EXPIRATION_SECONDS']
+    return jsonify(
+        {
+            'token': claims_tokens.issue(user, expiration),
+            'expiration': expiration,
+            'refresh_token': refresh_token,
+            'refresh_expiration': refresh_expiration
+        }
+    )
+
+
+def _refresh_token_arg():
+    token = (request.get_json(silent=True) or {}).get('refresh_token')
+    if not token or not isinstance(token, basestring):
+        raise ValidationError('refresh_token is required')
+    return token
 
 
 @api_bp.route('/get_token')
+@use_primary
+@read_write
 def get_token():
     '''
-    Generate token for users authenticated with Username/password,
+    Generate access token and refresh token for users authenticated with Username/password,
+    access token is renewed by /refresh_token afterwards (no password sent again)
 
     :return:
     '''
 
-    current_app.logger.debug(
-        "g.current_user.is_anonymous: {}."
-        " g.token_used:{}".format(
-            g.current_user.is_anonymous,
-            g.token_used))
+    logger.debug('Token requested - anonymous: %s, token used: %s', g.current_user.is_anonymous, g.token_used)
 
     # reject users that are trying to get token with no credentials or existing old token
     if g.current_user.is_anonymous \
@@ -123,12 +154,38 @@ def get_token():
         return RestApiErrors.unauthorized_401('Invalid credentials')
 
     # generate tokens
-    return jsonify(
-        {
-            'token': g.current_user.generate_auth_token(
-                expiration=current_app.config['API_TOKEN_EXPIRATION_SECONDS']),
-            'expiration': current_app.config['API_TOKEN_EXPIRATION_SECONDS']
-        }
-    )
+    refresh_token, refresh_expiration = issue_refresh_token(g.current_user)
+    db.session.commit()
+    return _tokens_response(g.current_user, refresh_token, refresh_expiration)
+
+
+@api_bp.route('/refresh_token', methods=['POST'])
+def refresh_token():
+    '''
+    Exchange refresh token ({"refresh_token": ...}) for new access token and new refresh token,
+    the refresh token sent is not valid any more (second use of it revokes all tokens rotated from it)
+
+    :return: same as get_token
+    '''
+    rotated = rotate_refresh_token(_refresh_token_arg())
+    if rotated is None:
+        logger.debug('Invalid refresh token')
+        return RestApiErrors.unauthorized_401('Invalid refresh token')
+    user, refresh_token, refresh_expiration = rotated
+    if refresh_token is None:
+        return RestApiErrors.forbidden_403('Unconfirmed account')
+    return _tokens_response(user, refresh_token, refresh_expiration)
+
+
+@api_bp.route('/revoke_token', methods=['POST'])
+def revoke_token():
+    '''
+    Revoke refresh token ({"refresh_token": ...}) and all tokens rotated from it - e.g on logout
+
+    :return: empty response, also for unknown tokens
+    '''
+    revoke_refresh_tokens(token=_refresh_token_arg())
+    db.session.commit()
+    return jsonify({}), 204
 
 
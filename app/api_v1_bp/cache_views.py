@@ -0,0 +1,16 @@
+from flask import jsonify
+from . import api_bp
+from ..decorators import permissions_required
+from .. import response_cache
+
+
+@api_bp.route('/cache/stats')
+@permissions_required(['admin'])
+def get_cache_stats():
+    '''
+    Response cache statistics of this process - per endpoint hits, stale hits, misses,
+    hit ratio and seconds of view time saved by hits
+
+    :return:
+    '''
+    return jsonify({'endpoints': response_cache.stats()})
@@ -1,9 +1,19 @@
 from ..api_errors import RestApiErrors
+from ..models import ValidationError
 from . import api_bp
 from flask import current_app
 
 # You can costumize you errors here by subclassing RestApiErrors class or creating your own
 
+@api_bp.errorhandler(ValidationError)
+def validation_error(e):
+    """
+    Invalid request data (body, arguments, cursors...) raised as ValidationError
+
+    :param e: app.models.ValidationError
+    """
+    return RestApiErrors.bad_request_400(e.args[0])
+
 @api_bp.errorhandler(401)
 def auth_error(e):
     """
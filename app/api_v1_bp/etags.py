@@ -0,0 +1,47 @@
+import hashlib
+from flask import request, make_response
+
+
+def resource_etag(resource, *parts):
+    '''
+    Strong ETag of resource representation, derived from row versions (and other parts of representation)
+
+    :param resource: resource name, e.g 'user'
+    :param parts: values the representation depends on, e.g id and version
+    :return: ETag value (without quotes)
+    '''
+    return '{}-{}'.format(resource, '-'.join(str(part) for part in parts))
+
+
+def collection_etag(resource, page):
+    '''
+    Strong ETag of page of collection
+
+    Besides the rows, the representation depends on the page size and on next/prev links,
+    e.g the last page gets "next" link when rows are appended after it
+
+    :param resource: resource name, e.g 'users'
+    :param page: KeysetPage, rows of the page have id and version attributes
+    :return: ETag value (without quotes)
+    '''
+    parts = ['{}:{}'.format(row.id, row.version) for row in page.items]
+    parts.extend([str(page.limit), page.next_cursor or '', page.prev_cursor or ''])
+    digest = hashlib.sha1(','.join(parts).encode('ascii'))
+    return '{}-{}'.format(resource, digest.hexdigest())
+
+
+def conditional(etag, build_response):
+    '''
+    Answer 304 Not Modified when client already has the representation (If-None-Match),
+    otherwise build the response and add ETag to it
+
+    :param etag: ETag of current representation
+    :param build_response: function that returns the response (called only if needed)
+    :return: response
+    '''
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(build_response())
+    response.set_etag(etag)
+    return response
@@ -0,0 +1,121 @@
+from flask import current_app, request, url_for, jsonify
+from itsdangerous import URLSafeSerializer, BadSignature
+from ..models import ValidationError
+
+
+def _serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt='api-pagination-cursor')
+
+
+def encode_cursor(direction, key):
+    '''
+    Opaque (signed) cursor pointing after or before key
+
+    :param direction: 'after' or 'before'
+    :param key: value of pagination column
+    '''
+    return _serializer().dumps([direction, key])
+
+
+def decode_cursor(cursor):
+    '''
+    :return: (direction, key)
+    Raises ValidationError for invalid or tampered cursor
+    '''
+    try:
+        direction, key = _serializer().loads(cursor)
+    except (BadSignature, ValueError, TypeError):
+        raise ValidationError('Invalid cursor: {}'.format(cursor))
+    if direction not in ('after', 'before'):
+        raise ValidationError('Invalid cursor: {}'.format(cursor))
+    return direction, key
+
+
+def get_limit():
+    '''
+    Page size requested by client in "limit" argument, defaults to API_USERS_PER_PAGE
+    and limited by API_MAX_PER_PAGE
+    '''
+    limit = request.args.get('limit', current_app.config['API_USERS_PER_PAGE'], type=int)
+    if limit < 1:
+        raise ValidationError('Invalid limit: {}'.format(request.args.get('limit')))
+    return min(limit, current_app.config['API_MAX_PER_PAGE'])
+
+
+class KeysetPage(object):
+    '''
+    Single page of keyset (cursor) pagination
+
+    Each page is a single index range scan on pagination column (which should be unique and indexed),
+    so cost of the page doesn't depend on how deep the client paginated.
+
+    :param query: query that returns rows with column attribute
+    :param column: mapped column to paginate on, e.g models.User.id
+    :param limit: page size
+    :param cursor: cursor sent by client or None for the first page
+    '''
+
+    def __init__(self, query, column, limit, cursor=None):
+        self.limit = limit
+        direction, key = decode_cursor(cursor) if cursor else ('after', None)
+
+        if direction == 'after':
+            if key is not None:
+                query = query.filter(column > key)
+            rows = query.order_by(column.asc()).limit(limit + 1).all()
+        else:
+            rows = query.filter(column < key).order_by(column.desc()).limit(limit + 1).all()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if direction == 'before':
+            rows.reverse()
+        self.items = rows
+
+        keys = [getattr(row, column.key) for row in rows]
+        self.next_cursor = None
+        self.prev_cursor = None
+        if keys:
+            if direction == 'before' or has_more:
+                self.next_cursor = encode_cursor('after', keys[-1])
+            if key is not None and (direction == 'after' or has_more):
+                self.prev_cursor = encode_cursor('before', keys[0])
+
+    def url(self, endpoint, cursor, **kwargs):
+        if cursor is None:
+            return None
+        return url_for(endpoint, cursor=cursor, limit=self.limit, _external=True, **kwargs)
+
+    def links(self, endpoint, **kwargs):
+        '''
+        :return: dict {'next': url, 'prev': url}, url is None when there is no such page
+        '''
+        return {
+            'next': self.url(endpoint, self.next_cursor, **kwargs),
+            'prev': self.url(endpoint, self.prev_cursor, **kwargs)
+        }
+
+    def link_header(self, endpoint, **kwargs):
+        '''
+        :return: value of Link header (RFC 5988)
+        '''
+        return ', '.join('<{}>; rel="{}"'.format(url, rel)
+                         for rel, url in sorted(self.links(endpoint, **kwargs).items()) if url)
+
+
+def paginated_response(page, key, items, endpoint, **kwargs):
+    '''
+    JSON response with page items and next/prev links (in body and Link header)
+
+    :param page: KeysetPage
+    :param key: key of items in response body
+    :param items: serialized items of the page
+    :param endpoint: endpoint of the paginated collection
+    :param kwargs: url arguments of the collection endpoint
+    '''
+    links = page.links(endpoint, **kwargs)
+    response = jsonify({key: items, 'next': links['next'], 'prev': links['prev']})
+    link_header = page.link_header(endpoint, **kwargs)
+    if link_header:
+        response.headers['Link'] = link_header
+    return response
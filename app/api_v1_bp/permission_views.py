@@ -2,17 +2,21 @@ from flask import jsonify
 from authentication_views import auth
 from . import api_bp
 from ..decorators import permissions_required
-from .. import models
+from .. import models, response_cache
 from sqlalchemy.orm.exc import NoResultFound
+from .etags import conditional, resource_etag
 
 
 from errors import RestApiErrors
 
-@permissions_required(['admin'])
 @api_bp.route('/permission/<int:id>')
+@permissions_required(['admin'])
+@response_cache.cached(lambda id: ['permission:{}'.format(id)])
 def get_permission(id):
     try:
-        role = models.Role.query.filter_by(id=id).one()
+        permission = models.Permission.query.filter_by(id=id).one()
     except NoResultFound:
         return RestApiErrors.not_found_404('No permission {} found'.format(id))
-    return jsonify(role.export_to_dict())
\ No newline at end of file
+    return conditional(
+        resource_etag('permission', permission.id, permission.version),
+        lambda: jsonify(permission.export_to_dict()))
@@ -1,19 +1,47 @@
-from flask import jsonify
+from flask import jsonify, request
 from authentication_views import auth
 from . import api_bp
 from ..decorators import permissions_required
 from .. import models
 from sqlalchemy.orm.exc import NoResultFound
+from .. import db, response_cache
+from ..resource_urls import resource_url
+from .pagination import KeysetPage, get_limit, paginated_response
+from .etags import conditional, resource_etag, collection_etag
 
 
 from errors import RestApiErrors
 
-@permissions_required(['admin'])
 @api_bp.route('/role/<int:id>')
+@permissions_required(['admin'])
+@response_cache.cached(lambda id: ['role:{}'.format(id)])
 def get_role(id):
     try:
         role = models.Role.query.filter_by(id=id).one()
     except NoResultFound:
         return RestApiErrors.not_found_404('No role {} found'.format(id))
-    return jsonify(role.export_to_dict())
+    # representation has number of members, which is not part of role version
+    user_count = role.user_count
+    return conditional(
+        resource_etag('role', role.id, role.version, user_count),
+        lambda: jsonify(role.export_to_dict(user_count=user_count)))
+
 
+@api_bp.route('/role/<int:id>/users')
+@permissions_required(['admin'])
+def get_role_users(id):
+    '''
+    Paginated list of urls of the role members, see get_users for pagination arguments
+
+    :return:
+    '''
+    if db.session.query(models.Role.id).filter_by(id=id).first() is None:
+        return RestApiErrors.not_found_404('No role {} found'.format(id))
+    page = KeysetPage(
+        db.session.query(models.User.id, models.User.version).filter(models.User.role_id == id), models.User.id,
+        limit=get_limit(), cursor=request.args.get('cursor'))
+    return conditional(
+        collection_etag('role-users', page),
+        lambda: paginated_response(
+            page, 'users', [resource_url('api_bp.get_user', row.id) for row in page.items],
+            'api_bp.get_role_users', id=id))
@@ -1,10 +1,14 @@
-from flask import jsonify, request, abort
+from itertools import islice
+from flask import jsonify, request, abort, json, current_app, Response, stream_with_context
 from authentication_views import auth
 from . import api_bp
 from ..decorators import permissions_required
 from .. import models
 from sqlalchemy.orm.exc import NoResultFound
-from .. import db
+from .. import db, bulk, response_cache
+from .pagination import KeysetPage, get_limit, paginated_response
+from .etags import conditional, resource_etag, collection_etag
+from ..resource_urls import resource_url
 
 
 # To protect single route, the auth.login_required decorator can be used
@@ -23,52 +27,156 @@ from .. import db
 from errors import RestApiErrors
 
 
-@permissions_required(['admin'])
 @api_bp.route('/users/<int:id>', methods=['GET'])
+@permissions_required(['admin'])
+@response_cache.cached(lambda id: ['user:{}'.format(id)])
 def get_user(id):
     try:
         user = models.User.query.filter_by(id=id).one()
     except NoResultFound as e:
         abort(404)
-    return jsonify(user.export_to_dict())
+    return conditional(
+        resource_etag('user', user.id, user.version),
+        lambda: jsonify(user.export_to_dict()))
 
 
-@permissions_required(['admin'])
 @api_bp.route('/users/', methods=['GET'])
+@permissions_required(['admin'])
+@response_cache.cached(lambda: ['users'])
 def get_users():
     '''
     Returns list of urls for all users. This route intentionally returns URL's and not Data in order
     to use caching which is most efficient when we have only one way to return data - resource by id
 
+    Users are paginated by id with opaque cursors, "limit" argument sets page size (API_USERS_PER_PAGE by default),
+    next/prev pages are returned in the body and in Link header
+
     :return:
     '''
-    return jsonify({'customers': [u.url for u in
-                                  models.User.query.all()]})
+    page = KeysetPage(
+        db.session.query(models.User.id, models.User.version), models.User.id,
+        limit=get_limit(), cursor=request.args.get('cursor'))
+    return conditional(
+        collection_etag('users', page),
+        lambda: paginated_response(
+            page, 'customers', [resource_url('api_bp.get_user', row.id) for row in page.items],
+            'api_bp.get_users'))
+
+
+EXPORT_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json'
+}
+
+
+@api_bp.route('/users/export', methods=['GET'])
+@permissions_required(['admin'])
+def export_users():
+    '''
+    Streams all the users (same representation as get_user) for bulk consumers like sync jobs
+
+    format=ndjson (default) - one JSON document per line, format=json - single JSON array.
+    Users are fetched in batches of API_EXPORT_BATCH_SIZE through server side cursor (yield_per)
+    and written as generator response, so memory does not grow with the table size
+    and the first row is sent as soon as it is fetched.
+
+    :return: streamed response
+    '''
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_MIMETYPES:
+        raise models.ValidationError('Invalid export format: {}'.format(export_format))
+    batch_size = current_app.config['API_EXPORT_BATCH_SIZE']
+
+    def generate():
+        query = models.User.query.order_by(models.User.id).yield_per(batch_size)
+        if export_format == 'json':
+            yield '['
+
+        users = iter(query)
+        # first row goes out alone so client gets first byte immediately, then full batches
+        batch = list(islice(users, 1))
+        first = True
+        while batch:
+            lines = [json.dumps(user) for user in models.User.export_many(batch)]
+            if export_format == 'ndjson':
+                yield '\n'.join(lines) + '\n'
+            else:
+                yield ('' if first else ',') + ','.join(lines)
+            first = False
+            batch = list(islice(users, batch_size))
+
+        if export_format == 'json':
+            yield ']'
+
+    return Response(stream_with_context(generate()), mimetype=EXPORT_MIMETYPES[export_format])
 
 
-@permissions_required(['admin', ])
 @api_bp.route('/users/', methods=['POST'])
+@permissions_required(['admin', ])
 def new_user():
     user = models.User()
     user.import_from_dict(request.json)
     db.session.add(user)
     db.session.commit()
+    response_cache.invalidate('users', 'role:{}'.format(user.role_id))
     return jsonify(user.export_to_dict()), 201, {'Location': user.url}
 
 
+def _batch_items():
+    '''
+    Users of batch request - {"users": [user, ...]}, at most API_BATCH_MAX_ITEMS
+    '''
+    items = (request.get_json(silent=True) or {}).get('users')
+    if not isinstance(items, list):
+        raise models.ValidationError('Invalid batch: expected {"users": [...]}')
+    if len(items) > current_app.config['API_BATCH_MAX_ITEMS']:
+        raise models.ValidationError('Invalid batch: at most {} users allowed'.format(
+            current_app.config['API_BATCH_MAX_ITEMS']))
+    return items
+
+
+@api_bp.route('/users/batch', methods=['POST'])
 @permissions_required(['admin', ])
+def new_users_batch():
+    '''
+    Create many users with single request, see bulk.bulk_create_users
+
+    :return: per user results (in the same order as request users) and throughput stats
+    '''
+    results, stats = bulk.bulk_create_users(_batch_items())
+    return jsonify({'results': results, 'stats': stats})
+
+
+@api_bp.route('/users/batch', methods=['PUT'])
+@permissions_required(['admin', ])
+def update_users_batch():
+    '''
+    Update many users with single request, see bulk.bulk_update_users
+
+    :return: per user results (in the same order as request users) and throughput stats
+    '''
+    results, stats = bulk.bulk_update_users(_batch_items())
+    return jsonify({'results': results, 'stats': stats})
+
+
 @api_bp.route('/users/<int:id>', methods=['PUT'])
+@permissions_required(['admin', ])
 def update_user(id):
     user = models.User.query.get_or_404(id)
+    old_role_id = user.role_id
     user.import_from_dict(request.json)
     db.session.add(user)
     db.session.commit()
+    # list of users has only URLs, so it is not affected by update
+    response_cache.invalidate('user:{}'.format(id), 'role:{}'.format(old_role_id), 'role:{}'.format(user.role_id))
     return jsonify(user.export_to_dict()), 200, {'Location': user.url}
 
-@permissions_required(['admin'])
 @api_bp.route('/users/<int:id>', methods=['DELETE'])
+@permissions_required(['admin'])
 def delete_user(id):
     user = models.User.query.get_or_404(id)
+    role_id = user.role_id
     db.session.delete(user)
     db.session.commit()
+    response_cache.invalidate('user:{}'.format(id), 'users', 'role:{}'.format(role_id))
     return jsonify({}), 204
@@ -1,3 +1,4 @@
+import logging
 from flask import render_template, redirect, request, url_for, flash, current_app
 from flask_login import logout_user, login_required, login_user, current_user
 from . import auth_bp
@@ -5,6 +6,9 @@ from ..models import User
 from .forms import LoginForm, RegistrationForm
 from .. import db
 from ..email import send_email
+from ..db_routing import read_write
+
+logger = logging.getLogger(__name__)
 
 
 @auth_bp.before_app_request
@@ -14,8 +18,7 @@ def before_request():
     This is happenining before each request, so attempts to access any other then
     auth content is intercepted and redirected to confirmation url
     '''
-    current_app.logger.debug(
-        "Current user {} requesting endpoint {}".format(current_user, request.endpoint))
+    logger.debug('Current user %s requesting endpoint %s', current_user, request.endpoint)
 
     if current_user.is_authenticated \
             and not current_user.confirmed \
@@ -91,6 +94,7 @@ def register():
 
 @auth_bp.route('/confirm/<token>')
 @login_required
+@read_write
 def confirm(token):
     '''
     This is personal confirmation route function for each user based on his own id
@@ -115,7 +119,7 @@ def confirm(token):
 @auth_bp.route('/confirm')
 def resend_confirmation():
     token = current_user.generate_confirmation_token()
-    send_email(current_user.email, 'auth_bp/email/confirm',
-               'Confirm Your Account', token=token, user=current_user)
+    send_email(current_user.email, 'Confirm Your Account',
+               'auth_bp/email/confirm', token=token, user=current_user)
     flash('A new confirmation email has been sent to you')
-    return redirect(url_for('main.index'))
+    return redirect(url_for('main_bp.index'))
@@ -0,0 +1,466 @@
+import csv
+import json
+import time
+from itertools import islice
+from flask import current_app
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from . import db, token_cache, response_cache, password_hasher, claims_tokens
+from .models import User, Role, ValidationError
+from .resource_urls import resolve_url, resource_url
+from .claims_tokens import CLAIMED_USER_ATTRIBUTES
+
+# columns of the claims of access tokens ('role' relationship is written as role_id by bulk operations)
+_CLAIMED_COLUMNS = [key for key in CLAIMED_USER_ATTRIBUTES if key in User.__table__.columns]
+
+
+class RoleResolver(object):
+    '''
+    Resolves role URLs to role ids for bulk operations
+
+    Every distinct URL is parsed only once and existence of all the roles
+    is validated with single query
+    '''
+
+    def __init__(self):
+        self._role_ids = {}  # url -> role id or ValidationError
+
+    def resolve_all(self, urls):
+        '''
+        Resolve and validate all urls at once, results are kept for resolve()
+
+        :param urls: iterable of role urls
+        '''
+        pending = {}
+        for url in set(urls).difference(self._role_ids):
+            try:
+                endpoint, args = resolve_url(url)
+            except ValueError:
+                endpoint, args = None, {}
+            if endpoint != 'api_bp.get_role' or 'id' not in args:
+                self._role_ids[url] = ValidationError('Invalid role URL: {}'.format(url))
+            else:
+                pending[url] = args['id']
+
+        existing = set()
+        if pending:
+            existing = set(role_id for (role_id,) in
+                           db.session.query(Role.id).filter(Role.id.in_(set(pending.values()))))
+        for url, role_id in pending.items():
+            if role_id in existing:
+                self._role_ids[url] = role_id
+            else:
+                self._role_ids[url] = ValidationError('Invalid role id {}'.format(role_id))
+
+    def resolve(self, url):
+        '''
+        :return: role id
+        Raises ValidationError for invalid URL or not existing role
+        '''
+        if url not in self._role_ids:
+            self.resolve_all([url])
+        role_id = self._role_ids[url]
+        if isinstance(role_id, ValidationError):
+            raise role_id
+        return role_id
+
+
+def _chunks(items, chunk_size):
+    for start in range(0, len(items), chunk_size):
+        yield items[start:start + chunk_size]
+
+
+def _user_values(user_dict, role_resolver, require_id=False):
+    '''
+    Parse user dictionary (same format as User.import_from_dict) into column values
+    '''
+    if not isinstance(user_dict, dict):
+        raise ValidationError('Invalid User: expected object')
+    try:
+        values = {'username': user_dict['username'], 'email': user_dict['email']}
+        if require_id:
+            values['id'] = int(user_dict['id'])
+    except KeyError as e:
+        raise ValidationError('Invalid User: missing requiered args {}'.format(e.args[0]))
+    except (TypeError, ValueError):
+        raise ValidationError('Invalid User id: {}'.format(user_dict['id']))
+
+    if 'role' in user_dict:
+        values['role_id'] = role_resolver.resolve(user_dict['role'])
+    if 'confirmed' in user_dict:
+        values['confirmed'] = user_dict['confirmed'] == 'true'
+    return values
+
+
+def _validate(user_dicts, role_resolver, require_id):
+    '''
+    Validate all rows up front
+
+    :return: (results, rows) - results are pre-populated with errors of invalid rows,
+        rows is list of (index, column values) of valid rows
+    '''
+    results = [None] * len(user_dicts)
+    rows = []
+    seen = {'id': set(), 'username': set(), 'email': set()}
+    for index, user_dict in enumerate(user_dicts):
+        try:
+            values = _user_values(user_dict, role_resolver, require_id)
+            for key in seen:
+                if key in values and values[key] in seen[key]:
+                    raise ValidationError('Duplicate {} in batch: {}'.format(key, values[key]))
+        except ValidationError as e:
+            results[index] = {'status': 400, 'error': e.args[0]}
+            continue
+        for key in seen:
+            if key in values:
+                seen[key].add(values[key])
+        rows.append((index, values))
+    return results, rows
+
+
+def _stats(results, started):
+    elapsed = time.time() - started
+    succeeded = sum(1 for result in results if result['status'] < 400)
+    return {
+        'total': len(results),
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded,
+        'elapsed_seconds': round(elapsed, 3),
+        'rows_per_second': round(len(results) / elapsed, 1) if elapsed else None
+    }
+
+
+def _conflicts(chunk):
+    '''
+    Find usernames/emails of the chunk owned by other users in DB - single query
+
+    :return: dict {('username'|'email', value): owner id}
+    '''
+    query = db.session.query(User.id, User.username, User.email).filter(or_(
+        User.username.in_([values['username'] for index, values in chunk]),
+        User.email.in_([values['email'] for index, values in chunk])))
+    owners = {}
+    for user_id, username, email in query:
+        owners[('username', username)] = user_id
+        owners[('email', email)] = user_id
+    return owners
+
+
+def _apply_chunk(results, chunk, write):
+    '''
+    Write the chunk in single transaction, on failure all the rows of the chunk are reported as conflicts
+
+    :return: list of written rows
+    '''
+    try:
+        write([values for index, values in chunk])
+        db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        current_app.logger.exception('Bulk write of users failed')
+        for index, values in chunk:
+            results[index] = {'status': 409, 'error': 'Conflict: {}'.format(e.orig)}
+        return []
+    return chunk
+
+
+def _update_mappings(mappings, claims):
+    '''
+    :param claims: dict {user id: {claimed column: current value}}
+    '''
+    db.session.bulk_update_mappings(User, mappings)
+    # bulk operations bypass session events - increment row versions and revoke tokens explicitly
+    db.session.query(User).filter(User.id.in_([values['id'] for values in mappings])).update(
+        {User.version: User.version + 1}, synchronize_session=False)
+    claims_tokens.revoke_users([values['id'] for values in mappings
+                                if any(key in values and values[key] != claims[values['id']][key]
+                                       for key in _CLAIMED_COLUMNS)])
+
+
+def _conflict_error(values, owners):
+    for key in ('username', 'email'):
+        owner = owners.get((key, values[key]))
+        if owner is not None and owner != values.get('id'):
+            return {'status': 409, 'error': '{} already in use: {}'.format(key, values[key])}
+    return None
+
+
+def bulk_create_users(user_dicts, chunk_size=None):
+    '''
+    Create users in chunked bulk transactions
+
+    All the rows are validated up front, every distinct role URL is resolved once,
+    rows without role get default role (Admin for ADMINS) like User.__init__ does.
+
+    :param user_dicts: list of dictionaries in User.import_from_dict format
+    :param chunk_size: rows per transaction, API_BATCH_CHUNK_SIZE by default
+    :return: (results, stats) - results has item per row {status, id, self_url} or {status, error}
+    '''
+    started = time.time()
+    chunk_size = chunk_size or current_app.config['API_BATCH_CHUNK_SIZE']
+    role_resolver = RoleResolver()
+    role_resolver.resolve_all(d['role'] for d in user_dicts if isinstance(d, dict) and 'role' in d)
+    results, rows = _validate(user_dicts, role_resolver, require_id=False)
+
+    admin_role = Role.query.filter_by(name='Admin').first()
+    default_role = Role.query.filter_by(is_default=True).first()
+    for index, values in rows:
+        if 'role_id' not in values:
+            role = admin_role if values['email'] in current_app.config['ADMINS'] else None
+            role = role or default_role
+            values['role_id'] = role.id if role is not None else None
+
+    for chunk in _chunks(rows, chunk_size):
+        owners = _conflicts(chunk)
+        valid = []
+        for index, values in chunk:
+            results[index] = _conflict_error(values, owners)
+            if results[index] is None:
+                valid.append((index, values))
+        if not valid:
+            continue
+
+        written = _apply_chunk(results, valid, lambda mappings: db.session.bulk_insert_mappings(User, mappings))
+        if written:
+            ids = dict(db.session.query(User.email, User.id).filter(
+                User.email.in_([values['email'] for index, values in written])))
+            for index, values in written:
+                user_id = ids[values['email']]
+                results[index] = {'status': 201, 'id': user_id,
+                                  'self_url': resource_url('api_bp.get_user', user_id)}
+            response_cache.invalidate('users', *set('role:{}'.format(values['role_id']) for index, values in written))
+
+    return results, _stats(results, started)
+
+
+def bulk_update_users(user_dicts, chunk_size=None):
+    '''
+    Update users in chunked bulk transactions, every row must have "id",
+    other attributes have the same format and semantics as in User.import_from_dict
+
+    :param user_dicts: list of dictionaries
+    :param chunk_size: rows per transaction, API_BATCH_CHUNK_SIZE by default
+    :return: (results, stats) - results has item per row {status, id, self_url} or {status, error}
+    '''
+    started = time.time()
+    chunk_size = chunk_size or current_app.config['API_BATCH_CHUNK_SIZE']
+    role_resolver = RoleResolver()
+    role_resolver.resolve_all(d['role'] for d in user_dicts if isinstance(d, dict) and 'role' in d)
+    results, rows = _validate(user_dicts, role_resolver, require_id=True)
+
+    for chunk in _chunks(rows, chunk_size):
+        claims = dict((row[0], dict(zip(_CLAIMED_COLUMNS, row[1:]))) for row in db.session.query(
+            User.id, *[getattr(User, key) for key in _CLAIMED_COLUMNS]).filter(
+            User.id.in_([values['id'] for index, values in chunk])))
+        existing = dict((user_id, values['role_id']) for user_id, values in claims.items())
+        owners = _conflicts(chunk)
+        valid = []
+        for index, values in chunk:
+            if values['id'] not in existing:
+                results[index] = {'status': 404, 'error': 'No user {} found'.format(values['id'])}
+            else:
+                results[index] = _conflict_error(values, owners)
+            if results[index] is None:
+                valid.append((index, values))
+        if not valid:
+            continue
+
+        written = _apply_chunk(results, valid, lambda mappings: _update_mappings(mappings, claims))
+        tags = set()
+        for index, values in written:
+            # bulk operations bypass session events
+            token_cache.evict_user(values['id'])
+            tags.update(['user:{}'.format(values['id']), 'role:{}'.format(existing[values['id']]),
+                         'role:{}'.format(values.get('role_id', existing[values['id']]))])
+            results[index] = {'status': 200, 'id': values['id'],
+                              'self_url': resource_url('api_bp.get_user', values['id'])}
+        if tags:
+            response_cache.invalidate(*tags)
+
+    return results, _stats(results, started)
+
+
+def read_user_rows(path, file_format=None):
+    '''
+    Stream user rows from CSV (with header line) or JSONL file, one row at a time
+
+    :param path: file path
+    :param file_format: 'csv' or 'jsonl', by file extension by default
+    :return: generator of dicts, malformed JSONL line is yielded as ValidationError (skipped by import_users)
+    '''
+    file_format = file_format or path.rsplit('.', 1)[-1].lower()
+    if file_format not in ('csv', 'jsonl'):
+        raise ValueError('Unsupported format: {}'.format(file_format))
+    with open(path, 'rb') as f:
+        if file_format == 'csv':
+            for row in csv.DictReader(f):
+                yield dict((key, value.decode('utf-8') if isinstance(value, str) else value)
+                           for key, value in row.items())
+        else:
+            for line in f:
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except ValueError as e:
+                        yield ValidationError('Invalid JSON: {}'.format(e))
+
+
+class RoleNames(object):
+    '''
+    Role name -> id lookup for imports, all the roles are loaded with single query
+    '''
+
+    def __init__(self):
+        self.role_ids = dict(db.session.query(Role.name, Role.id))
+        default_roles = [role_id for (role_id,) in db.session.query(Role.id).filter_by(is_default=True)]
+        self.default_role_id = default_roles[0] if default_roles else None
+        self.admins = set(current_app.config['ADMINS'])
+
+    def resolve(self, name, email):
+        '''
+        :return: role id, rows without role get default role (Admin for ADMINS) like User.__init__ does
+        Raises ValidationError for unknown role
+        '''
+        if not name:
+            return self.role_ids.get('Admin') if email in self.admins else self.default_role_id
+        try:
+            return self.role_ids[name]
+        except KeyError:
+            raise ValidationError('Unknown role: {}'.format(name))
+
+
+def _import_values(row, role_names):
+    if isinstance(row, ValidationError):
+        raise row
+    try:
+        values = {'username': row['username'], 'email': row['email']}
+    except (KeyError, TypeError) as e:
+        raise ValidationError('Invalid User: missing requiered args {}'.format(e.args[0]))
+    if not values['username'] or not values['email']:
+        raise ValidationError('Invalid User: empty username or email')
+    values['role_id'] = role_names.resolve(row.get('role'), values['email'])
+    confirmed = row.get('confirmed')
+    if isinstance(confirmed, basestring):
+        confirmed = confirmed.lower()
+    if confirmed in (True, 1, 'true', '1', 'yes'):
+        values['confirmed'] = True
+    elif confirmed in (None, False, 0, '', 'false', '0', 'no'):
+        values['confirmed'] = False
+    else:
+        raise ValidationError(u'Invalid confirmed: {}'.format(row['confirmed']))
+    return values, row.get('password')
+
+
+def _insert_imported(rows):
+    '''
+    Insert the rows in single transaction - when some username/email was taken meanwhile (IntegrityError),
+    the conflicts are checked again and the rest of the rows is inserted, rows that fail without
+    visible conflict are inserted one by one
+
+    :param rows: list of (line, values)
+    :return: list of inserted values
+    '''
+    try:
+        db.session.bulk_insert_mappings(User, [values for line, values in rows])
+        db.session.commit()
+        return [values for line, values in rows]
+    except IntegrityError as e:
+        db.session.rollback()
+        if len(rows) == 1:
+            current_app.logger.warning('Skipping row %d: %s', rows[0][0], e.orig)
+            return []
+    owners = _conflicts(rows)
+    survivors = []
+    for line, values in rows:
+        conflict = _conflict_error(values, owners)
+        if conflict is not None:
+            current_app.logger.warning('Skipping row %d: %s', line, conflict['error'])
+        else:
+            survivors.append((line, values))
+    if len(survivors) == len(rows):
+        return [values for row in rows for values in _insert_imported([row])]
+    return _insert_imported(survivors) if survivors else []
+
+
+def _import_chunk(valid):
+    '''
+    Skip rows with username/email used in DB, hash passwords and insert the rest
+
+    :param valid: list of (line, values, password) of valid rows
+    :return: (list of inserted values, number of skipped rows)
+    '''
+    owners = _conflicts([(line, values) for line, values, password in valid])
+    rows_to_write = []
+    for line, values, password in valid:
+        conflict = _conflict_error(values, owners)
+        if conflict is not None:
+            current_app.logger.warning('Skipping row %d: %s', line, conflict['error'])
+        else:
+            rows_to_write.append((line, values, password))
+    hashes = iter(password_hasher.hash_many([password for line, values, password in rows_to_write if password]))
+    for line, values, password in rows_to_write:
+        values['password_hash'] = next(hashes) if password else None
+    inserted = _insert_imported([(line, values) for line, values, password in rows_to_write])
+    return inserted, len(valid) - len(inserted)
+
+
+def import_users(rows, chunk_size=None, offset=0, progress=None):
+    '''
+    Insert users from stream of rows in chunked bulk transactions
+
+    Rows have username, email and optional password, role (name) and confirmed. Rows are read lazily,
+    passwords of every chunk are hashed across the password hashing process pool, invalid rows and rows
+    with username/email that is already used are skipped (and logged). Every chunk is committed
+    separately, so interrupted import can be resumed from the offset reported by progress.
+    Database error other than conflict stops the import - stats have the error and the offset to resume from.
+
+    :param rows: iterable of dicts, e.g read_user_rows()
+    :param chunk_size: rows per transaction, API_BATCH_CHUNK_SIZE by default
+    :param offset: number of rows to skip (already imported)
+    :param progress: function called with stats after every chunk
+    :return: stats - offset (rows processed including skipped offset), imported, skipped, rows_per_second, error
+    '''
+    started = time.time()
+    chunk_size = chunk_size or current_app.config['API_BATCH_CHUNK_SIZE']
+    role_names = RoleNames()
+    stats = {'offset': offset, 'imported': 0, 'skipped': 0, 'rows_per_second': None, 'error': None}
+    seen = {'username': set(), 'email': set()}
+    rows = islice(rows, offset, None)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        valid = []
+        for line, row in enumerate(chunk, stats['offset'] + 1):
+            try:
+                values, password = _import_values(row, role_names)
+                for key in seen:
+                    if values[key] in seen[key]:
+                        raise ValidationError('Duplicate {} in import: {}'.format(key, values[key]))
+            except ValidationError as e:
+                current_app.logger.warning('Skipping row %d: %s', line, e.args[0])
+                stats['skipped'] += 1
+                continue
+            for key in seen:
+                seen[key].add(values[key])
+            valid.append((line, values, password))
+
+        if valid:
+            try:
+                inserted, skipped = _import_chunk(valid)
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                current_app.logger.exception('Import stopped at row %d', stats['offset'] + 1)
+                stats['error'] = str(e)
+                break
+            stats['imported'] += len(inserted)
+            stats['skipped'] += skipped
+            if inserted:
+                response_cache.invalidate('users', *set('role:{}'.format(values['role_id']) for values in inserted))
+
+        stats['offset'] += len(chunk)
+        elapsed = time.time() - started
+        stats['rows_per_second'] = round((stats['offset'] - offset) / elapsed, 1) if elapsed else None
+        if progress is not None:
+            progress(dict(stats))
+    return stats
@@ -1,6 +1,20 @@
 #!/usr/bin/env python
 import os
-from app import celery, create_app
+from celery.signals import task_postrun
+from app import celery, create_app, db
 
 app = create_app(os.getenv('FLASK_CONFIG') or 'default')
-app.app_context().push()
\ No newline at end of file
+app.app_context().push()
+
+
+@task_postrun.connect
+def remove_db_session(**kwargs):
+    # the app context lives as long as the worker - without this, tasks would load models (e.g users
+    # of email templates) from identity map and transaction of the previous tasks
+    db.session.remove()
+
+
+from app import email  # registers email tasks (templates are rendered here, in the worker)
+
+# celery command (celery -A app.celery_worker.celery worker) needs the Celery application itself
+celery = celery.get_app()
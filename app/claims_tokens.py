@@ -0,0 +1,318 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import os
+import struct
+import threading
+import time
+from flask import current_app, has_app_context
+from sqlalchemy import and_, event, or_
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
+
+# format version, issued at (ms), expires at (s), user id, role id, flags, catalog fingerprint, token id
+_HEADER = struct.Struct('>BQIIIBI6s')
+_FORMAT = 1
+_CONFIRMED = 1
+_SIGNATURE_SIZE = 16
+# user attributes that are part of the claims - their change revokes all tokens of the user
+CLAIMED_USER_ATTRIBUTES = ('role', 'role_id', 'confirmed')
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=')
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + b'=' * (-len(data) % 4))
+
+
+def _mask_bytes(mask):
+    if not mask:
+        return b''
+    digits = '{:x}'.format(mask)
+    return binascii.unhexlify('0' * (len(digits) % 2) + digits)
+
+
+class BloomFilter(object):
+    '''
+    Fixed size Bloom filter of strings - no false negatives, false positives with probability
+    given by number of items, size (bits) and number of hashes
+    '''
+
+    def __init__(self, size, hashes):
+        self.size = size
+        self.hashes = hashes
+        self.bits = bytearray((size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.md5(key).digest()
+        first, second = struct.unpack('>QQ', digest)
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class TokenPrincipal(object):
+    '''
+    Authenticated user as described by claims of the access token
+
+    Authorization uses the claims only - the User is loaded (single query) on first access
+    to an attribute that is not in the token.
+    '''
+
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def __init__(self, user_id, role_id, confirmed, permissions, catalog_fingerprint, token_id, issued_at,
+                 expires_at):
+        self.id = user_id
+        self.role_id = role_id
+        self.confirmed = confirmed
+        self.permissions = permissions
+        self.catalog_fingerprint = catalog_fingerprint
+        self.token_id = token_id
+        self.issued_at = issued_at
+        self.expires_at = expires_at
+        self._user = None
+
+    def get_id(self):
+        return unicode(self.id)
+
+    def can(self, permissions):
+        '''
+        Same as User.can - permission mask of the token is used while the catalog it was issued for
+        is current, otherwise the role of the token is checked against current catalog
+        '''
+        from . import rbac_cache
+        catalog = rbac_cache.catalog()
+        mask = catalog.mask_for(permissions)
+        if mask is None:
+            return False
+        if catalog.fingerprint == self.catalog_fingerprint:
+            return self.permissions & mask == mask
+        return catalog.role_has(self.role_id, mask)
+
+    def is_admin(self):
+        from . import rbac_cache
+        return rbac_cache.catalog().role_name(self.role_id) == 'Admin'
+
+    def rbac_role_id(self):
+        '''
+        Same as User.rbac_role_id - role of the token
+        '''
+        return self.role_id
+
+    @property
+    def user(self):
+        '''
+        :return: User the token was issued for (loaded on first access)
+        '''
+        if self._user is None:
+            from .models import User
+            self._user = User.query.get(self.id)
+        return self._user
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.user, name)
+
+    def __repr__(self):
+        return '<TokenPrincipal %r>' % self.id
+
+
+class _ClaimsTokensState(object):
+    def __init__(self, app):
+        self.key = hashlib.sha256(b'claims-token:' + app.config['SECRET_KEY'].encode('utf-8')).digest()
+        self.refresh_seconds = app.config['API_TOKEN_REVOCATION_REFRESH_SECONDS']
+        self.bloom_size = app.config['API_TOKEN_REVOCATION_BLOOM_BITS']
+        self.bloom_hashes = app.config['API_TOKEN_REVOCATION_BLOOM_HASHES']
+        self.bloom = None
+        self.refreshed_at = 0
+        self.lock = threading.Lock()
+
+
+class ClaimsTokens(object):
+    '''
+    Compact signed access tokens with claims needed for authorization
+
+    Token carries user id, role id, confirmed flag, permission bitmask of the role and fingerprint
+    of the RBAC catalog the mask was compiled from, signed by HMAC-SHA256 (truncated to 128 bits)
+    of key derived from SECRET_KEY. Verification and permission checks need no queries.
+
+    Tokens are revoked one by one (revoke) or all tokens of user issued so far (revoke_users - done
+    automatically when role or confirmation of the user changes or the user is deleted). Revocations
+    are stored in revoked_tokens table, every process keeps Bloom filter of them refreshed every
+    API_TOKEN_REVOCATION_REFRESH_SECONDS, only tokens that hit the filter are checked by query.
+    '''
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('API_TOKEN_REVOCATION_REFRESH_SECONDS', 5)
+        app.config.setdefault('API_TOKEN_REVOCATION_BLOOM_BITS', 1 << 16)
+        app.config.setdefault('API_TOKEN_REVOCATION_BLOOM_HASHES', 4)
+        app.extensions['claims_tokens'] = _ClaimsTokensState(app)
+
+    def _state(self):
+        return current_app.extensions['claims_tokens']
+
+    def _sign(self, state, body):
+        return hmac.new(state.key, body, hashlib.sha256).digest()[:_SIGNATURE_SIZE]
+
+    def issue(self, user, expiration):
+        '''
+        :param user: User
+        :param expiration: time in seconds for token to expire
+        :return: token (URL safe string)
+        '''
+        from . import rbac_cache
+        state = self._state()
+        catalog = rbac_cache.catalog()
+        role_id = user.role_id or 0
+        now = time.time()
+        body = _HEADER.pack(_FORMAT, int(now * 1000), int(now + expiration), user.id, role_id,
+                            _CONFIRMED if user.confirmed else 0, catalog.fingerprint,
+                            os.urandom(6)) + _mask_bytes(catalog.role_mask(role_id))
+        return _b64encode(body + self._sign(state, body)).decode('ascii')
+
+    @staticmethod
+    def is_claims_token(token):
+        '''
+        Tokens of User.generate_auth_token are dot separated, claims tokens are not
+        '''
+        return '.' not in token
+
+    def verify(self, token):
+        '''
+        :param token: token of issue()
+        :return: TokenPrincipal or None when the token is invalid, expired or revoked
+        '''
+        state = self._state()
+        try:
+            data = _b64decode(token.encode('ascii') if not isinstance(token, bytes) else token)
+        except (TypeError, ValueError, UnicodeError):
+            return None
+        if len(data) < _HEADER.size + _SIGNATURE_SIZE:
+            return None
+        body, signature = data[:-_SIGNATURE_SIZE], data[-_SIGNATURE_SIZE:]
+        if not hmac.compare_digest(self._sign(state, body), signature):
+            return None
+        (version, issued_at, expires_at, user_id, role_id, flags, fingerprint,
+         token_id) = _HEADER.unpack_from(body)
+        if version != _FORMAT or expires_at <= time.time():
+            return None
+        token_id = binascii.hexlify(token_id)
+        if self._is_revoked(state, token_id, user_id, issued_at):
+            return None
+        mask_data = body[_HEADER.size:]
+        permissions = int(binascii.hexlify(mask_data), 16) if mask_data else 0
+        return TokenPrincipal(user_id, role_id or None, bool(flags & _CONFIRMED), permissions, fingerprint,
+                              token_id, issued_at, expires_at)
+
+    def _bloom(self, state):
+        if state.bloom is None or time.time() - state.refreshed_at >= state.refresh_seconds:
+            with state.lock:
+                if state.bloom is None or time.time() - state.refreshed_at >= state.refresh_seconds:
+                    state.bloom = self._load_bloom(state)
+                    state.refreshed_at = time.time()
+        return state.bloom
+
+    @staticmethod
+    def _load_bloom(state):
+        from . import db
+        from .models import RevokedToken
+        bloom = BloomFilter(state.bloom_size, state.bloom_hashes)
+        for token_id, user_id in db.session.query(RevokedToken.token_id, RevokedToken.user_id).filter(
+                RevokedToken.expires_at > int(time.time())):
+            bloom.add(_revocation_key(token_id, user_id))
+        return bloom
+
+    def _is_revoked(self, state, token_id, user_id, issued_at):
+        bloom = self._bloom(state)
+        if _revocation_key(token_id, None) not in bloom and _revocation_key(None, user_id) not in bloom:
+            return False
+        from . import db
+        from .models import RevokedToken
+        return db.session.query(RevokedToken.id).filter(or_(
+            RevokedToken.token_id == token_id,
+            and_(RevokedToken.user_id == user_id, RevokedToken.token_id.is_(None),
+                 RevokedToken.revoked_at >= issued_at))).first() is not None
+
+    def revoke(self, principal):
+        '''
+        Revoke single token (added to the session, committed by caller)
+
+        :param principal: TokenPrincipal of verified token
+        '''
+        self._revoke([{'token_id': principal.token_id, 'user_id': principal.id,
+                       'expires_at': principal.expires_at}])
+
+    def revoke_users(self, user_ids, session=None):
+        '''
+        Revoke all tokens issued so far to the users (added to the session, committed by caller)
+
+        :param user_ids: iterable of user ids
+        :param session: session to add revocations to, db.session by default
+        '''
+        expires_at = int(time.time() + current_app.config['API_TOKEN_EXPIRATION_SECONDS'])
+        self._revoke([{'token_id': None, 'user_id': user_id, 'expires_at': expires_at} for user_id in user_ids],
+                     session)
+
+    def _revoke(self, rows, session=None):
+        from . import db
+        from .models import RevokedToken
+        if not rows:
+            return
+        revoked_at = int(time.time() * 1000)
+        (session or db.session).add_all(RevokedToken(revoked_at=revoked_at, **row) for row in rows)
+        # visible in this process at once, other processes see it after refresh of their filter
+        state = self._state()
+        bloom = self._bloom(state)
+        with state.lock:
+            for row in rows:
+                bloom.add(_revocation_key(row['token_id'], row['user_id']))
+
+    def purge(self):
+        '''
+        Delete revocations of tokens that are expired anyway
+
+        :return: number of deleted revocations
+        '''
+        from . import db
+        from .models import RevokedToken
+        deleted = RevokedToken.query.filter(RevokedToken.expires_at <= int(time.time())).delete(
+            synchronize_session=False)
+        db.session.commit()
+        return deleted
+
+
+def _revocation_key(token_id, user_id):
+    return 't:{}'.format(token_id) if token_id is not None else 'u:{}'.format(user_id)
+
+
+@event.listens_for(Session, 'before_flush')
+def _revoke_changed_claims(session, flush_context, instances):
+    from .models import User
+    user_ids = set()
+    for obj in session.deleted:
+        if isinstance(obj, User) and obj.id is not None:
+            user_ids.add(obj.id)
+    for obj in session.dirty:
+        if isinstance(obj, User) and obj.id is not None and \
+                any(get_history(obj, key).has_changes() for key in CLAIMED_USER_ATTRIBUTES):
+            user_ids.add(obj.id)
+    if user_ids and has_app_context() and 'claims_tokens' in current_app.extensions:
+        from . import claims_tokens
+        claims_tokens.revoke_users(sorted(user_ids), session)
@@ -0,0 +1,311 @@
+from flask import current_app
+from sqlalchemy import and_, bindparam
+from . import db, rbac_cache, token_cache, response_cache, password_hasher, claims_tokens
+from .models import User, Role, Permission, permissions_in_role
+from .refresh_tokens import revoke_refresh_tokens
+
+# config sections in dependency order - roles refer to permissions, users to roles
+SYNC_STEPS = ('permissions', 'roles', 'users')
+
+# user config keys that are copied to columns as they are
+USER_ATTRIBUTES = ('email', 'confirmed')
+ROLE_ATTRIBUTES = ('description', 'is_default')
+
+# max number of bound parameters in single IN clause (SQLite allows 999 per statement)
+IN_CHUNK_SIZE = 500
+
+
+class ConfigSyncError(ValueError):
+    '''
+    Raised when config refers to permission or role that is neither configured nor in DB
+    '''
+    pass
+
+
+class SyncPlan(object):
+    '''
+    Differences between config (PERMISSIONS, ROLES, USERS) and database
+
+    insert lists have column values of new rows, update lists have id and changed column values,
+    role_permissions has (role name, permission name) pairs to add/remove.
+    Plain text passwords of new and changed users are kept in _passwords until the plan is applied.
+    '''
+
+    def __init__(self, steps):
+        self.steps = steps
+        self.permissions = {'insert': [], 'update': []}
+        self.roles = {'insert': [], 'update': []}
+        self.role_permissions = {'add': [], 'remove': []}
+        self.users = {'insert': [], 'update': []}
+        self.changed_passwords = 0  # new users with password included
+        self.unchanged_passwords = 0
+        self._passwords = {}  # username -> plain text password to hash
+        self._rehashed = set()  # ids of users with unchanged password hashed again by current method
+        self._role_names = {}  # username -> role name for users with new role
+
+    @property
+    def is_empty(self):
+        return not any(rows for changes in (self.permissions, self.roles, self.role_permissions, self.users)
+                       for rows in changes.values())
+
+    def report(self):
+        '''
+        :return: human readable list of changes, passwords are never shown
+        '''
+        lines = []
+        for kind, changes, key in (('permission', self.permissions, 'name'), ('role', self.roles, 'name'),
+                                   ('user', self.users, 'username')):
+            for values in changes['insert']:
+                lines.append('+ {} {}'.format(kind, values[key]))
+            for values in changes['update']:
+                lines.append('~ {} {}: {}'.format(kind, values['_label'], ', '.join(
+                    sorted(name for name in values if not name.startswith('_') and name != 'id'))))
+        for role_name, permission_name in self.role_permissions['add']:
+            lines.append('+ role {} permission {}'.format(role_name, permission_name))
+        for role_name, permission_name in self.role_permissions['remove']:
+            lines.append('- role {} permission {}'.format(role_name, permission_name))
+        return '\n'.join(lines)
+
+
+def _chunks(items, chunk_size=IN_CHUNK_SIZE):
+    items = list(items)
+    for start in range(0, len(items), chunk_size):
+        yield items[start:start + chunk_size]
+
+
+def _mappings(rows):
+    # update rows carry labels for the report
+    return [dict((name, value) for name, value in values.items() if not name.startswith('_')) for values in rows]
+
+
+def plan_sync(until='users'):
+    '''
+    Compare config with database - single query per table, no writes
+
+    :param until: last config section to compare (see SYNC_STEPS)
+    :return: SyncPlan
+    Raises ConfigSyncError
+    '''
+    config = current_app.config
+    steps = SYNC_STEPS[:SYNC_STEPS.index(until) + 1]
+    plan = SyncPlan(steps)
+
+    permissions = dict((row.name, row) for row in
+                       db.session.query(Permission.id, Permission.name, Permission.description))
+    for cfg_permission in config['PERMISSIONS']:
+        row = permissions.get(cfg_permission['name'])
+        description = cfg_permission.get('description')
+        if row is None:
+            plan.permissions['insert'].append({'name': cfg_permission['name'], 'description': description})
+        elif description is not None and description != row.description:
+            plan.permissions['update'].append({'id': row.id, '_label': row.name, 'description': description})
+    if 'roles' not in steps:
+        return plan
+
+    permission_names = set(permissions).union(values['name'] for values in plan.permissions['insert'])
+    permission_names_by_id = dict((row.id, name) for name, row in permissions.items())
+    roles = dict((row.name, row) for row in
+                 db.session.query(Role.id, Role.name, Role.description, Role.is_default))
+    role_permissions = {}
+    for role_id, permission_id in db.session.query(permissions_in_role.c.role_id, permissions_in_role.c.permission_id):
+        role_permissions.setdefault(role_id, set()).add(permission_names_by_id[permission_id])
+    for cfg_role in config['ROLES']:
+        name = cfg_role['name']
+        values = dict((key, cfg_role[key]) for key in ROLE_ATTRIBUTES if key in cfg_role)
+        row = roles.get(name)
+        if row is None:
+            values['name'] = name
+            plan.roles['insert'].append(values)
+            current = set()
+        else:
+            changed = dict((key, value) for key, value in values.items() if getattr(row, key) != value)
+            if changed:
+                changed.update({'id': row.id, '_label': name})
+                plan.roles['update'].append(changed)
+            current = role_permissions.get(row.id, set())
+        if 'permissions' in cfg_role:
+            configured = set(cfg_role['permissions'])
+            missing = configured - permission_names
+            if missing:
+                raise ConfigSyncError('Role {} refers to unknown permissions {}'.format(name, sorted(missing)))
+            plan.role_permissions['add'].extend((name, permission) for permission in sorted(configured - current))
+            plan.role_permissions['remove'].extend((name, permission) for permission in sorted(current - configured))
+    if 'users' not in steps:
+        return plan
+
+    role_names = set(roles).union(values['name'] for values in plan.roles['insert'])
+    role_names_by_id = dict((row.id, name) for name, row in roles.items())
+    cfg_users = config['USERS']
+    users = {}
+    for usernames in _chunks(cfg_user['username'] for cfg_user in cfg_users):
+        for row in db.session.query(User.id, User.username, User.email, User.confirmed,
+                                    User.role_id, User.password_hash).filter(User.username.in_(usernames)):
+            users[row.username] = row
+
+    to_verify = []  # (row, password)
+    changes = {}  # username -> changed values of existing user
+    for cfg_user in cfg_users:
+        username = cfg_user['username']
+        if cfg_user['role'] not in role_names:
+            raise ConfigSyncError('Could not add User {}, no such role {}'.format(username, cfg_user['role']))
+        values = dict((key, cfg_user[key]) for key in USER_ATTRIBUTES if key in cfg_user)
+        row = users.get(username)
+        if row is None:
+            values['username'] = username
+            plan.users['insert'].append(values)
+            plan._role_names[username] = cfg_user['role']
+            if 'password' in cfg_user:
+                plan._passwords[username] = cfg_user['password']
+            continue
+        changed = dict((key, value) for key, value in values.items() if getattr(row, key) != value)
+        if role_names_by_id.get(row.role_id) != cfg_user['role']:
+            plan._role_names[username] = cfg_user['role']
+            changed['role'] = cfg_user['role']
+        if 'password' in cfg_user:
+            if row.password_hash:
+                to_verify.append((row, cfg_user['password']))
+            else:
+                plan._passwords[username] = cfg_user['password']
+                changed['password'] = None
+        changes[username] = (row, changed)
+
+    # hashing costs the same as verification - only changed passwords (or outdated hashes) are hashed again
+    results = password_hasher.verify_many([(row.password_hash, password) for row, password in to_verify])
+    for (row, password), matches in zip(to_verify, results):
+        if matches and not password_hasher.needs_rehash(row.password_hash):
+            plan.unchanged_passwords += 1
+        else:
+            if matches:
+                plan._rehashed.add(row.id)
+            plan._passwords[row.username] = password
+            changes[row.username][1]['password'] = None
+
+    for cfg_user in cfg_users:
+        row, changed = changes.get(cfg_user['username'], (None, None))
+        if changed:
+            changed.update({'id': row.id, '_label': row.username, '_role_id': row.role_id})
+            plan.users['update'].append(changed)
+    plan.changed_passwords = len(plan._passwords)
+    return plan
+
+
+def _bump_versions(model, ids):
+    # bulk operations bypass session events - increment row versions explicitly
+    for chunk in _chunks(ids):
+        db.session.query(model).filter(model.id.in_(chunk)).update(
+            {model.version: model.version + 1}, synchronize_session=False)
+
+
+def apply_sync(plan):
+    '''
+    Write the plan in single transaction and invalidate caches of changed objects
+
+    :param plan: SyncPlan made by plan_sync
+    '''
+    if plan.is_empty:
+        return
+    tags = set()
+    changed_permissions, changed_roles, changed_users = set(), set(), set()
+    try:
+        db.session.bulk_insert_mappings(Permission, plan.permissions['insert'])
+        db.session.bulk_update_mappings(Permission, _mappings(plan.permissions['update']))
+        changed_permissions.update(values['id'] for values in plan.permissions['update'])
+
+        if 'roles' in plan.steps:
+            db.session.bulk_insert_mappings(Role, plan.roles['insert'])
+            db.session.bulk_update_mappings(Role, _mappings(plan.roles['update']))
+            changed_roles.update(values['id'] for values in plan.roles['update'])
+
+        links = plan.role_permissions
+        if links['add'] or links['remove'] or 'users' in plan.steps:
+            role_ids = dict(db.session.query(Role.name, Role.id))
+        if links['add'] or links['remove']:
+            permission_ids = dict(db.session.query(Permission.name, Permission.id))
+            pairs = {}
+            new_roles = set(values['name'] for values in plan.roles['insert'])
+            new_permissions = set(values['name'] for values in plan.permissions['insert'])
+            for action in ('add', 'remove'):
+                pairs[action] = [{'role': role_ids[role_name], 'permission': permission_ids[permission_name]}
+                                 for role_name, permission_name in links[action]]
+                # membership changes representation of both sides (rows inserted now have initial version)
+                for role_name, permission_name in links[action]:
+                    if role_name not in new_roles:
+                        changed_roles.add(role_ids[role_name])
+                    if permission_name not in new_permissions:
+                        changed_permissions.add(permission_ids[permission_name])
+            if pairs['add']:
+                db.session.execute(permissions_in_role.insert().values(
+                    role_id=bindparam('role'), permission_id=bindparam('permission')), pairs['add'])
+            if pairs['remove']:
+                db.session.execute(permissions_in_role.delete().where(and_(
+                    permissions_in_role.c.role_id == bindparam('role'),
+                    permissions_in_role.c.permission_id == bindparam('permission'))), pairs['remove'])
+
+        if 'users' in plan.steps:
+            usernames = list(plan._passwords)
+            hashes = dict(zip(usernames, password_hasher.hash_many([plan._passwords[name] for name in usernames])))
+            inserts = []
+            for values in plan.users['insert']:
+                values = dict(values, role_id=role_ids[plan._role_names[values['username']]])
+                if values['username'] in hashes:
+                    values['password_hash'] = hashes[values['username']]
+                inserts.append(values)
+                tags.update(['users', 'role:{}'.format(values['role_id'])])
+            updates = []
+            for update in plan.users['update']:
+                values = dict((key, value) for key, value in update.items()
+                              if not key.startswith('_') and key not in ('role', 'password'))
+                if 'role' in update:
+                    values['role_id'] = role_ids[update['role']]
+                    # number of members is part of role representation
+                    tags.update(['role:{}'.format(update['_role_id']), 'role:{}'.format(values['role_id'])])
+                if 'password' in update:
+                    values['password_hash'] = hashes[update['_label']]
+                updates.append(values)
+            db.session.bulk_insert_mappings(User, inserts)
+            db.session.bulk_update_mappings(User, updates)
+            changed_users.update(values['id'] for values in updates)
+            claims_tokens.revoke_users([values['id'] for values in updates
+                                        if 'role_id' in values or 'confirmed' in values])
+            for chunk in _chunks(values['id'] for values in updates
+                                 if 'password_hash' in values and values['id'] not in plan._rehashed):
+                revoke_refresh_tokens(user_ids=chunk)
+
+        _bump_versions(Permission, changed_permissions)
+        _bump_versions(Role, changed_roles)
+        _bump_versions(User, changed_users)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        plan._passwords.clear()
+        plan._rehashed.clear()
+
+    if plan.permissions['insert'] or plan.roles['insert'] or changed_permissions or changed_roles:
+        rbac_cache.invalidate()
+    for user_id in changed_users:
+        token_cache.evict_user(user_id)
+    tags.update('permission:{}'.format(permission_id) for permission_id in changed_permissions)
+    tags.update('role:{}'.format(role_id) for role_id in changed_roles)
+    tags.update('user:{}'.format(user_id) for user_id in changed_users)
+    if tags:
+        response_cache.invalidate(*tags)
+
+
+def sync_config(dry_run=False, until='users'):
+    '''
+    Reconcile PERMISSIONS, ROLES and USERS of the config with the database
+
+    Missing rows are inserted, rows that differ are updated (by bulk statements in single transaction),
+    rows that are not in config are left as they are. Role permissions are set exactly to configured ones.
+    Passwords of existing users are hashed again only when they don't match the configured ones.
+
+    :param dry_run: only compute the plan
+    :param until: last config section to sync (see SYNC_STEPS)
+    :return: SyncPlan
+    '''
+    plan = plan_sync(until)
+    if not dry_run:
+        apply_sync(plan)
+    return plan
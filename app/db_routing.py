@@ -0,0 +1,240 @@
+import random
+from contextlib import contextmanager
+from flask import current_app, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import event, orm
+from sqlalchemy.sql.expression import GenerativeSelect
+
+
+class ReadOnlyRequestError(RuntimeError):
+    '''
+    Raised when read-only request tries to write (see ReadOnlyRequests)
+    '''
+    pass
+
+
+def _is_read(clause):
+    # SELECT and compound SELECT (UNION...) without FOR UPDATE - DML and textual statements (text(), also
+    # text().columns()) go to the primary, their kind is not known without parsing them
+    # (GenerativeSelect of SQLAlchemy 1.1 - ClauseElement.is_select comes with 1.4)
+    return isinstance(clause, GenerativeSelect) and clause.for_update is None
+
+
+class RoutingSession(SignallingSession):
+    '''
+    Session that sends SELECTs to read replica chosen for current request (info['replica'])
+
+    Flushes, bulk, DML and textual statements always use the primary. Once the session has written
+    (info['wrote']), its reads stay on the primary too, so the request sees its own writes.
+
+    In read-only mode (info['read_only']) writes raise ReadOnlyRequestError, commit neither flushes
+    nor commits and connections use SQLALCHEMY_READ_ONLY_ISOLATION_LEVEL.
+    '''
+
+    def __init__(self, db, **options):
+        SignallingSession.__init__(self, db, **options)
+        event.listen(self, 'before_flush', _before_flush)
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = self.info.get('replica')
+        if replica is not None and not self.info.get('wrote') and not self.info.get('primary'):
+            if _is_read(clause) and (mapper is None or mapper.mapped_table.info.get('bind_key') is None):
+                return get_state(self.app).db.get_engine(self.app, bind=replica)
+        if clause is not None and not _is_read(clause):
+            if self.info.get('read_only'):
+                raise ReadOnlyRequestError('Statement {} in read-only request'.format(clause.__class__.__name__))
+            self.info['wrote'] = True
+        return SignallingSession.get_bind(self, mapper, clause)
+
+    def _connection_for_bind(self, engine, execution_options=None, **kw):
+        # private Session hook (signature and self.transaction._connections of SQLAlchemy 1.1,
+        # see requirements.txt) - check it on upgrade
+        # isolation level can be set only before the first statement of the transaction
+        level = self.app.config.get('SQLALCHEMY_READ_ONLY_ISOLATION_LEVEL')
+        if level and self.info.get('read_only') and execution_options is None and \
+                (self.transaction is None or engine not in self.transaction._connections):
+            execution_options = {'isolation_level': level}
+        return SignallingSession._connection_for_bind(self, engine, execution_options, **kw)
+
+    def commit(self):
+        if self.info.get('read_only'):
+            _check_read_only(self)
+            return
+        SignallingSession.commit(self)
+
+
+def _check_read_only(session):
+    if session.info.get('read_only') and (session.new or session.deleted or
+                                          any(session.is_modified(obj) for obj in session.dirty)):
+        raise ReadOnlyRequestError('Changes of {} objects in read-only request'.format(
+            len(session.new) + len(session.dirty) + len(session.deleted)))
+
+
+def _before_flush(session, flush_context, instances):
+    _check_read_only(session)
+    session.info['wrote'] = True
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    '''
+    SQLAlchemy extension with RoutingSession
+    '''
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+class ReadReplicas(object):
+    '''
+    Routes reads of safe GET requests to read replicas
+
+    Replicas are SQLALCHEMY_BINDS keys listed in SQLALCHEMY_READ_REPLICAS, every GET/HEAD request to
+    blueprint in SQLALCHEMY_READ_REPLICA_BLUEPRINTS reads from one of them (chosen at random for the
+    whole request), unless the view is decorated by use_primary. Only SELECT constructs are routed,
+    textual statements (text()) are executed on the primary. Other requests and code outside of
+    requests use the primary only. Statements per bind are reported by query_counter.
+    '''
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_READ_REPLICAS', [])
+        app.config.setdefault('SQLALCHEMY_READ_REPLICA_BLUEPRINTS', ['api_bp', 'main_bp'])
+        missing = set(app.config['SQLALCHEMY_READ_REPLICAS']) - set(app.config.get('SQLALCHEMY_BINDS') or ())
+        if missing:
+            raise ValueError('Read replicas {} are not in SQLALCHEMY_BINDS'.format(sorted(missing)))
+        app.extensions['read_replicas'] = list(app.config['SQLALCHEMY_READ_REPLICAS'])
+        if app.extensions['read_replicas']:
+            app.before_request(self._route_request)
+            app.teardown_request(self._reset_routing)
+
+    def _session(self):
+        return current_app.extensions['sqlalchemy'].db.session
+
+    def route_to_replica(self, replica=None):
+        '''
+        Send reads of current session to replica (until it writes)
+
+        :param replica: bind key, random one of SQLALCHEMY_READ_REPLICAS by default
+        '''
+        replica = replica or random.choice(current_app.extensions['read_replicas'])
+        info = self._session().info
+        info['replica'] = replica
+        info['wrote'] = False
+
+    def reset(self):
+        '''
+        Send all the statements of current session to the primary
+        '''
+        info = self._session().info
+        for key in ('replica', 'wrote', 'primary'):
+            info.pop(key, None)
+
+    @contextmanager
+    def primary(self):
+        '''
+        Read from the primary inside the block, e.g to authenticate with up to date credentials
+        '''
+        info = self._session().info
+        previous = info.get('primary')
+        info['primary'] = True
+        try:
+            yield
+        finally:
+            info['primary'] = previous
+
+    def _route_request(self):
+        if request.method not in ('GET', 'HEAD') or \
+                request.blueprint not in current_app.config['SQLALCHEMY_READ_REPLICA_BLUEPRINTS']:
+            return
+        view = current_app.view_functions.get(request.endpoint)
+        if not getattr(view, 'use_primary', False):
+            self.route_to_replica()
+
+    def _reset_routing(self, exc):
+        self.reset()
+
+
+class ReadOnlyRequests(object):
+    '''
+    Runs requests with safe methods (SQLALCHEMY_READ_ONLY_METHODS) in read-only mode
+
+    Read-only requests never flush and skip commit of SQLALCHEMY_COMMIT_ON_TEARDOWN - their transaction
+    is ended by rollback when the request is finished (with SQLALCHEMY_READ_ONLY_ISOLATION_LEVEL
+    'AUTOCOMMIT' no transaction is started at all). Any write raises ReadOnlyRequestError - textual
+    statements (text()) count as writes, read-only views use SELECT constructs.
+    Views that write on GET are decorated by read_write, views of other methods that only read
+    can be decorated by read_only. Code that sometimes has to write (e.g rehash of password on login)
+    calls allow_writes first.
+    '''
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_READ_ONLY_METHODS', ['GET', 'HEAD', 'OPTIONS'])
+        app.config.setdefault('SQLALCHEMY_READ_ONLY_ISOLATION_LEVEL', None)
+        app.before_request(self._start_request)
+        app.after_request(self._check_response)
+        app.teardown_request(self._finish_request)
+
+    def _session(self):
+        return current_app.extensions['sqlalchemy'].db.session
+
+    @property
+    def is_read_only(self):
+        return bool(self._session().info.get('read_only'))
+
+    def allow_writes(self):
+        '''
+        Switch current read-only request to read-write mode
+        '''
+        session = self._session()
+        if session.info.pop('read_only', False) and current_app.config['SQLALCHEMY_READ_ONLY_ISOLATION_LEVEL']:
+            # connections of the autocommit reads can't be used for transaction
+            session.rollback()
+
+    def _start_request(self):
+        view = current_app.view_functions.get(request.endpoint)
+        mode = getattr(view, 'read_only', None)
+        if mode is None:
+            mode = request.method in current_app.config['SQLALCHEMY_READ_ONLY_METHODS']
+        self._session().info['read_only'] = mode
+
+    def _check_response(self, response):
+        # changes that were never flushed would be silently lost
+        _check_read_only(self._session())
+        return response
+
+    def _finish_request(self, exc):
+        session = self._session()
+        if session.info.pop('read_only', False):
+            # nothing to commit - SQLALCHEMY_COMMIT_ON_TEARDOWN finds no transaction
+            session.rollback()
+
+
+def read_only(f):
+    '''
+    View decorator - request is read-only regardless of its method
+    '''
+    f.read_only = True
+    return f
+
+
+def read_write(f):
+    '''
+    View decorator - request can write regardless of its method
+    '''
+    f.read_only = False
+    return f
+
+
+def use_primary(f):
+    '''
+    View decorator - GET requests of the view read from the primary
+    '''
+    f.use_primary = True
+    return f
@@ -1,5 +1,5 @@
 from functools import wraps
-from flask import abort
+from flask import abort, g
 from flask_login import current_user
 
 
@@ -9,11 +9,15 @@ def permissions_required(permissions):
     routes from unauthorized uses
     :param permissions List
     :return: error code 403, the Forbidden HTTP error, when the current user does not have the requested permissions.
+
+    User authenticated by the API (g.current_user, e.g TokenPrincipal of claims token) is checked
+    before the Flask-Login user of the session.
     """
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            if not current_user.can(permissions):
+            user = g.get('current_user') or current_user
+            if not user.can(permissions):
                 abort(403)
             return f(*args,**kwargs)
         return decorated_function
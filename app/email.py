@@ -1,26 +1,152 @@
+import smtplib
+import socket
+import time
 from flask_mail import Message
-from flask import current_app, render_template
-from threading import Thread
-from . import mail, celery
+from flask import current_app, render_template, request, has_request_context
+from . import mail, mail_pool, outbox, celery, db, models
 
 
-def send_async_email(msg, app):
+def _dump_value(value):
+    # proxies (e.g current_user) are unwrapped, LocalProxy is not an instance of the proxied class
+    value = getattr(value, '_get_current_object', lambda: value)()
+    if isinstance(value, db.Model):
+        return {'__model__': type(value).__name__, 'id': value.id}
+    return value
+
+
+def _dump_context(context):
     '''
-    This function is built so it can me run from separate thread,
-    this is why current_app context should be saved
+    Makes template context serializable for celery - models are passed as references (class name and id)
+    and loaded again by the worker, other values must be JSON serializable
+    '''
+    return dict((name, _dump_value(value)) for name, value in context.items())
+
+
+def _load_context(context):
+    loaded = {}
+    for name, value in context.items():
+        if isinstance(value, dict) and '__model__' in value:
+            value = getattr(models, value['__model__']).query.get(value['id'])
+        loaded[name] = value
+    return loaded
+
+
+def _url_root():
+    # workers have no request - links in templates (url_for(..., _external=True)) are built for this root
+    return request.url_root if has_request_context() else None
 
-    Parameters:
-    ------------
-        msg: The msg with all the data pre-populated
 
+def render_email(to_email_addresses, subject, template, **context):
     '''
+    Constructs the message from txt and html versions of the template
+
+    :param to_email_addresses: list of recipients
+    :return: flask_mail.Message
+    '''
+    msg = Message(
+        current_app.config['MAIL_SUBJECT_PREFIX'] + subject,
+        sender=current_app.config['MAIL_SENDER'], recipients=to_email_addresses)
+    msg.body = render_template(template + '.txt', **context)
+    msg.html = render_template(template + '.html', **context)
+    return msg
+
+
+def _message_to(msg, to_email_address):
+    '''
+    Own message (Message-ID, Date) for single recipient from already rendered message
+    '''
+    return Message(msg.subject, sender=msg.sender, recipients=[to_email_address], body=msg.body, html=msg.html)
+
+
+def _render_in_worker(to_email_addresses, subject, template, context, url_root):
+    with current_app.test_request_context(base_url=url_root):
+        return render_email(to_email_addresses, subject, template, **_load_context(context))
+
+
+@celery.task
+def send_templated_email(to_email_address, subject, template, context, url_root=None):
+    '''
+    Renders the template and sends the message - the worker gets only template name and small context,
+    not rendered message
+
+    :param context: template context made by _dump_context
+    :param url_root: root URL of the request that sent the email
+    '''
+    mail.send(_render_in_worker([to_email_address], subject, template, context, url_root))
 
-    with app.app_context():
-        mail.send(msg)
 
 @celery.task
-def send_async_celery_email(msg):
-    mail.send(msg)
+def send_templated_email_to_many(to_email_addresses, subject, template, context, url_root=None):
+    '''
+    Renders the template once and sends separate message to every recipient over single SMTP connection
+    '''
+    msg = _render_in_worker([], subject, template, context, url_root)
+    with mail.connect() as connection:
+        for to_email_address in to_email_addresses:
+            connection.send(_message_to(msg, to_email_address))
+
+
+def _spool(to_email_addresses, subject, template, context, url_root):
+    outbox.append({'to': to_email_addresses, 'subject': subject, 'template': template,
+                   'context': context, 'url_root': url_root, 'queued_at': time.time()})
+
+
+def _deliver_spooled(records):
+    '''
+    Sends spooled emails over single SMTP connection
+
+    :return: number of processed records - stops at first SMTP error, records that can't be rendered are skipped
+    '''
+    processed = 0
+    try:
+        with mail.connect() as connection:
+            for record in records:
+                try:
+                    msg = _render_in_worker([], record['subject'], record['template'],
+                                            record['context'], record['url_root'])
+                except Exception:
+                    current_app.logger.exception('Dropping spooled email "%s" to %s',
+                                                 record.get('subject'), record.get('to'))
+                else:
+                    for to_email_address in record['to']:
+                        connection.send(_message_to(msg, to_email_address))
+                processed += 1
+    except (smtplib.SMTPException, socket.error) as e:
+        current_app.logger.warning('Outbox delivery stopped after %d emails: %s', processed, e)
+    return processed
+
+
+@celery.task
+def drain_outbox():
+    '''
+    Sends emails spooled to the outbox (run periodically by celery beat, see CELERYBEAT_SCHEDULE,
+    or by manage.py drain_outbox)
+
+    :return: number of sent emails
+    '''
+    return outbox.drain(_deliver_spooled)
+
+
+def _queue_task(task, to_email_addresses, subject, template, context, url_root):
+    from kombu.exceptions import OperationalError  # celery is imported on first use
+    fallback = current_app.config['MAIL_OUTBOX_FALLBACK']
+    if fallback and not outbox.broker_available():
+        # broker failed recently - don't wait for its connect timeout again
+        _spool(to_email_addresses if isinstance(to_email_addresses, list) else [to_email_addresses],
+               subject, template, context, url_root)
+        return
+    try:
+        # no publish retries - with broker down the request waits for single connect timeout only
+        task.apply_async((to_email_addresses, subject, template, context, url_root), retry=False)
+    except (OperationalError, socket.error, IOError) as e:
+        # broker is unreachable
+        if not fallback:
+            raise
+        outbox.broker_failed()
+        current_app.logger.warning('Broker unavailable (%s), email "%s" is spooled to outbox', e, subject)
+        _spool(to_email_addresses if isinstance(to_email_addresses, list) else [to_email_addresses],
+               subject, template, context, url_root)
+
 
 def send_email(to_email_address, subject, template, **kwargs):
     '''
@@ -36,27 +162,38 @@ def send_email(to_email_address, subject, template, **kwargs):
         the files should have following extensions (txt/html)
 
     :param kwargs:
-        additional kwargs that can be used in templates, e.g token
-
-    :return: Thread instance
-        Instance of thread that include all the information regarding messange sending process
+        additional kwargs that can be used in templates, e.g token,
+        use_celery=True sends the message by celery worker (templates are rendered by the worker,
+        models in kwargs are passed by id), when the broker is unavailable the message is spooled
+        to the outbox (MAIL_OUTBOX_FALLBACK) - for MAIL_OUTBOX_BROKER_RETRY_SECONDS the following
+        messages too, without trying the broker,
+        (the outbox is only a fallback - the first message after the retry period waits for the broker
+        connect timeout again),
+        use_outbox=True only appends the message to the outbox (sent by drain_outbox later), latency
+        doesn't depend on the broker,
+        otherwise it is rendered here and queued to mail_pool
+        (use_thread is accepted for backward compatibility, it means mail_pool as well)
+
+    Raises MailQueueFull when the delivery queue stays full (see MailPool)
     '''
+    use_celery = kwargs.pop('use_celery', False)
+    use_outbox = kwargs.pop('use_outbox', False)
+    kwargs.pop('use_thread', None)
+    if use_outbox:
+        _spool([to_email_address], subject, template, _dump_context(kwargs), _url_root())
+    elif use_celery:
+        _queue_task(send_templated_email, to_email_address, subject, template, _dump_context(kwargs), _url_root())
+    else:
+        # bounded pool of delivery threads with persistent SMTP connections
+        mail_pool.send(render_email([to_email_address], subject, template, **kwargs))
+
+
+def send_bulk_email(to_email_addresses, subject, template, **kwargs):
+    '''
+    Sends the same email to many recipients (each gets own message) by single celery task
 
-    # Construct the message
-    msg = Message(
-        current_app.config['MAIL_SUBJECT_PREFIX'] + subject,
-        sender=current_app.config['MAIL_SENDER'], recipients=[to_email_address])
-    msg.body = render_template(template + '.txt', **kwargs)  # for email kwargs expected to have token and user objects
-    msg.html = render_template(template + '.html', **kwargs) # for email kwargs expected to have token and user objects
-
-    if kwargs.get('use_thread'):
-        # Send the message via thread
-        app = current_app._get_current_object()
-
-        email_thread = Thread(target=send_async_email, args=[msg, app])
-        email_thread.start()
-
-    if kwargs.get('use_celery'):
-        send_async_celery_email.delay(msg)
-
-
+    :param to_email_addresses: list of recipients
+    :param kwargs: template context, same for all the recipients
+    '''
+    _queue_task(send_templated_email_to_many, list(to_email_addresses), subject, template,
+                _dump_context(kwargs), _url_root())
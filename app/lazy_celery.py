@@ -0,0 +1,93 @@
+import threading
+
+
+class _LazyTask(object):
+    '''
+    Task declared by LazyCelery.task - registered in the Celery application when it is created,
+    calling it directly runs the function in current process (like Celery task)
+    '''
+
+    def __init__(self, celery, fun, options):
+        self.celery = celery
+        self.fun = fun
+        self.options = options
+        self.task = None
+        self.__name__ = fun.__name__
+        self.__module__ = fun.__module__
+        self.__doc__ = fun.__doc__
+
+    def register(self, celery_app):
+        self.task = celery_app.task(**self.options)(self.fun)
+        return self.task
+
+    def __call__(self, *args, **kwargs):
+        return self.fun(*args, **kwargs)
+
+    def __getattr__(self, name):
+        # delay, apply_async, name etc. - needs the Celery application
+        if self.task is None:
+            self.celery.get_app()
+        return getattr(self.task, name)
+
+
+class LazyCelery(object):
+    '''
+    Celery application that is created (and celery imported) only on first use
+
+    Importing celery and kombu is large part of the app package import time, while most processes
+    (web workers that don't send emails by celery, manage.py commands, tests) never use it.
+    Tasks are declared by LazyCelery.task and registered when the application is created.
+    Connection to the broker is opened by Celery itself on first published task.
+
+    :param main: name of the main module
+    :param kwargs: Celery arguments (e.g broker)
+    '''
+
+    def __init__(self, main, **kwargs):
+        self.main = main
+        self.kwargs = kwargs
+        self.config = {}
+        self.tasks = []
+        self.lock = threading.Lock()
+        self._app = None
+
+    def init_app(self, app):
+        '''
+        Celery application is configured by config of the Flask application
+        '''
+        if self._app is not None:
+            self._app.conf.update(app.config)
+        else:
+            self.config.update(app.config)
+
+    def get_app(self):
+        '''
+        :return: celery.Celery application (created on first call)
+        '''
+        if self._app is None:
+            with self.lock:
+                if self._app is None:
+                    from celery import Celery
+                    celery_app = Celery(self.main, **self.kwargs)
+                    celery_app.conf.update(self.config)
+                    for task in self.tasks:
+                        task.register(celery_app)
+                    self._app = celery_app
+        return self._app
+
+    def task(self, fun=None, **options):
+        '''
+        Same as Celery.task - @celery.task or @celery.task(**options)
+        '''
+        def decorator(fun):
+            with self.lock:
+                task = _LazyTask(self, fun, options)
+                if self._app is not None:
+                    task.register(self._app)
+                else:
+                    self.tasks.append(task)
+            return task
+        return decorator(fun) if fun is not None else decorator
+
+    def __getattr__(self, name):
+        return getattr(self.get_app(), name)
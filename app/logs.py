@@ -0,0 +1,248 @@
+import atexit
+import datetime
+import json
+import logging
+import random
+import re
+import sys
+import threading
+import uuid
+from collections import deque
+from flask import g, has_request_context, request
+
+# argument types that are safe to format later on the listener thread
+_PLAIN_TYPES = (str, unicode, int, long, float, bool, type(None))
+
+
+class QueueHandler(logging.Handler):
+    '''
+    Handler that only appends records to queue, records are written by QueueListener on background thread
+
+    Queue is collections.deque - append is atomic and doesn't take any python level lock,
+    request thread never blocks on it - when the queue has max_size records, records are dropped (and counted).
+    Messages with plain arguments (strings, numbers) are formatted by the listener,
+    other arguments (models, proxies of request objects) are formatted on the calling thread,
+    as they can't be safely accessed from other thread.
+
+    :param queue: collections.deque instance
+    :param max_size: max number of queued records
+    '''
+
+    def __init__(self, queue, max_size):
+        logging.Handler.__init__(self)
+        self.queue = queue
+        self.max_size = max_size
+        self.dropped = 0
+
+    def prepare(self, record):
+        if record.args:
+            args = record.args.values() if isinstance(record.args, dict) else record.args
+            if not all(isinstance(arg, _PLAIN_TYPES) for arg in args):
+                record.msg = record.getMessage()
+                record.args = None
+        if record.exc_info:
+            # traceback objects must not outlive the request thread
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        if len(self.queue) >= self.max_size:
+            self.dropped += 1
+            return
+        try:
+            self.queue.append(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+    def handle(self, record):
+        # same as logging.Handler.handle, without handler lock - appending to deque is thread safe
+        if self.filter(record):
+            self.emit(record)
+        return record
+
+
+class QueueListener(object):
+    '''
+    Background thread that passes records from the queue to the handlers
+
+    The queue is polled every poll_interval seconds when it is empty, so records are written
+    with at most poll_interval delay.
+
+    :param queue: collections.deque instance
+    :param handlers: handlers that do the actual I/O
+    :param poll_interval: seconds
+    '''
+
+    def __init__(self, queue, *handlers, **kwargs):
+        self.queue = queue
+        self.handlers = handlers
+        self.poll_interval = kwargs.get('poll_interval', 0.05)
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._monitor, name='log-listener')
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        '''
+        Write all queued records and stop the thread
+        '''
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+
+    def handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def _drain(self):
+        while True:
+            try:
+                record = self.queue.popleft()
+            except IndexError:
+                return
+            self.handle(record)
+
+    def _monitor(self):
+        while not self._stopped.is_set():
+            self._drain()
+            self._stopped.wait(self.poll_interval)
+        self._drain()
+
+
+class SamplingFilter(logging.Filter):
+    '''
+    Passes only given fraction of records of each logger, WARNING and above always pass
+
+    :param rates: dict {logger name: rate (0 - 1)}, rate of the nearest configured ancestor applies
+        to child loggers (e.g 'app.api_v1_bp' applies to 'app.api_v1_bp.authentication_views'),
+        loggers without configured rate are not sampled
+    '''
+
+    def __init__(self, rates):
+        logging.Filter.__init__(self)
+        self.rates = dict(rates)
+        self._effective_rates = {}
+
+    def rate(self, name):
+        rate = self._effective_rates.get(name)
+        if rate is None:
+            ancestor = name
+            while ancestor not in self.rates and '.' in ancestor:
+                ancestor = ancestor.rsplit('.', 1)[0]
+            rate = self._effective_rates[name] = self.rates.get(ancestor, 1.0)
+        return rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class RequestIdFilter(logging.Filter):
+    '''
+    Adds request_id of current request to records (None outside of requests)
+    '''
+
+    def filter(self, record):
+        record.request_id = g.get('request_id') if has_request_context() else None
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    '''
+    Formats record as single line JSON document
+    '''
+
+    def format(self, record):
+        document = {
+            'time': datetime.datetime.utcfromtimestamp(record.created).isoformat() + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+            'module': record.module,
+            'line': record.lineno,
+            'thread': record.threadName
+        }
+        if record.exc_info:
+            record.exc_text = record.exc_text or self.formatException(record.exc_info)
+        if record.exc_text:
+            document['exception'] = record.exc_text
+        return json.dumps(document)
+
+
+# accepted X-Request-Id of incoming requests
+_REQUEST_ID_RE = re.compile(r'[A-Za-z0-9._-]{1,64}\Z')
+
+TEXT_FORMAT = '[%(asctime)s] %(levelname)s %(name)s [%(request_id)s]: %(message)s'
+
+
+class StructuredLogging(object):
+    '''
+    Asynchronous, sampled logging of the application logger (and its child loggers)
+
+    Handlers of app.logger are replaced by QueueHandler (LOG_ASYNC), records are written to stderr
+    by QueueListener thread, so request threads don't wait for I/O.
+    LOG_JSON switches to JSON records, LOG_SAMPLING_RATES sets per logger sampling rates,
+    LOG_LEVEL sets level (DEBUG in debug mode and INFO otherwise by default).
+    Every request gets id (X-Request-Id header of the request or random), it is added to records
+    and returned in X-Request-Id response header.
+
+    Messages should use lazy %-style arguments - logger.debug('User %s', user_id),
+    so disabled or sampled out records are never formatted.
+    '''
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LOG_ASYNC', True)
+        app.config.setdefault('LOG_LEVEL', None)
+        app.config.setdefault('LOG_JSON', False)
+        app.config.setdefault('LOG_SAMPLING_RATES', {})
+        app.config.setdefault('LOG_QUEUE_SIZE', 10000)
+        app.before_request(_assign_request_id)
+        app.after_request(_add_request_id_header)
+
+        level = app.config['LOG_LEVEL'] or (logging.DEBUG if app.debug else logging.INFO)
+        logger = app.logger
+        logger.setLevel(level)
+
+        output = logging.StreamHandler(sys.stderr)
+        output.setFormatter(JsonFormatter() if app.config['LOG_JSON'] else logging.Formatter(TEXT_FORMAT))
+        if app.config['LOG_ASYNC']:
+            queue = deque()
+            handler = QueueHandler(queue, app.config['LOG_QUEUE_SIZE'])
+            listener = QueueListener(queue, output)
+            listener.start()
+        else:
+            handler = output
+            listener = None
+        handler.addFilter(SamplingFilter(app.config['LOG_SAMPLING_RATES']))
+        handler.addFilter(RequestIdFilter())
+
+        del logger.handlers[:]
+        logger.addHandler(handler)
+        app.extensions['structured_logging'] = {'handler': handler, 'listener': listener}
+
+
+def _assign_request_id():
+    request_id = request.headers.get('X-Request-Id')
+    g.request_id = request_id if request_id and _REQUEST_ID_RE.match(request_id) else uuid.uuid4().hex
+
+
+def _add_request_id_header(response):
+    request_id = g.get('request_id')
+    if request_id:
+        response.headers['X-Request-Id'] = request_id
+    return response
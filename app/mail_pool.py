@@ -0,0 +1,249 @@
+import atexit
+import logging
+import os
+import smtplib
+import socket
+import threading
+import time
+from Queue import Queue, Empty, Full
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+# errors after which the message is delivered again over new connection
+_CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, smtplib.SMTPHeloError,
+                      socket.error, IOError)
+
+
+def _is_transient(error):
+    if isinstance(error, _CONNECTION_ERRORS):
+        return True
+    # 4xx replies are temporary failures
+    return isinstance(error, smtplib.SMTPResponseException) and 400 <= error.smtp_code < 500
+
+
+class MailQueueFull(Exception):
+    '''
+    Raised when the message could not be queued within MAIL_POOL_ENQUEUE_TIMEOUT seconds
+    '''
+    pass
+
+
+class _Worker(threading.Thread):
+    '''
+    Delivery thread with own persistent SMTP connection
+    '''
+
+    def __init__(self, app, state, index):
+        threading.Thread.__init__(self, name='mail-worker-{}'.format(index))
+        self.daemon = True
+        self.app = app
+        self.state = state
+        self.connection = None
+
+    def run(self):
+        while True:
+            try:
+                batch = [self.state.queue.get(timeout=self.state.idle_timeout)]
+            except Empty:
+                # idle - don't hold the SMTP connection open
+                self.disconnect()
+                continue
+            if batch[0] is None:
+                # shutdown
+                self.disconnect()
+                self.state.queue.task_done()
+                return
+            while len(batch) < self.state.batch_size:
+                try:
+                    msg = self.state.queue.get_nowait()
+                except Empty:
+                    break
+                if msg is None:
+                    # leave shutdown marker for next loop
+                    self.state.queue.task_done()
+                    self.state.queue.put(None)
+                    break
+                batch.append(msg)
+            with self.app.app_context():
+                for msg in batch:
+                    try:
+                        self.deliver(msg)
+                    finally:
+                        self.state.queue.task_done()
+
+    def connect(self):
+        if self.connection is None:
+            from . import mail
+            connection = mail.connect()
+            connection.__enter__()
+            self.connection = connection
+            self.state.count('connections')
+        return self.connection
+
+    def disconnect(self):
+        connection, self.connection = self.connection, None
+        if connection is not None:
+            try:
+                connection.__exit__(None, None, None)
+            except (smtplib.SMTPException, socket.error):
+                pass  # connection is already broken
+
+    def deliver(self, msg):
+        for attempt in range(self.state.max_retries + 1):
+            if attempt:
+                self.state.count('retries')
+                time.sleep(self.state.retry_backoff * 2 ** (attempt - 1))
+            try:
+                self.connect().send(msg)
+            except Exception as e:
+                self.disconnect()
+                if not _is_transient(e):
+                    # message itself is invalid (bad headers, refused recipients) - retry won't help
+                    logger.exception('Delivery of "%s" to %s failed', msg.subject, msg.recipients)
+                    self.state.count('failed')
+                    return False
+                logger.warning('Delivery of "%s" to %s failed (attempt %d): %s',
+                               msg.subject, msg.recipients, attempt + 1, e)
+                continue
+            self.state.count('sent')
+            return True
+        logger.error('Giving up delivery of "%s" to %s', msg.subject, msg.recipients)
+        self.state.count('failed')
+        return False
+
+
+class _MailPoolState(object):
+    def __init__(self, app):
+        config = app.config
+        self.workers_count = config['MAIL_POOL_WORKERS']
+        self.queue = Queue(config['MAIL_POOL_QUEUE_SIZE'])
+        self.batch_size = config['MAIL_POOL_BATCH_SIZE']
+        self.enqueue_timeout = config['MAIL_POOL_ENQUEUE_TIMEOUT']
+        self.max_retries = config['MAIL_POOL_MAX_RETRIES']
+        self.retry_backoff = config['MAIL_POOL_RETRY_BACKOFF']
+        self.idle_timeout = config['MAIL_POOL_IDLE_TIMEOUT']
+        self.shutdown_timeout = config['MAIL_POOL_SHUTDOWN_TIMEOUT']
+        self.lock = threading.Lock()
+        self.workers = []
+        self.pid = None
+        self.stats = dict.fromkeys(['queued', 'sent', 'failed', 'retries', 'connections'], 0)
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.stats[key] += n
+
+    def start(self, app):
+        # threads don't survive fork - every process starts own workers
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            if self.pid is not None:
+                # forked process - messages queued in the parent are delivered by the parent
+                self.queue = Queue(self.queue.maxsize)
+            self.workers = [_Worker(app, self, index) for index in range(self.workers_count)]
+            for worker in self.workers:
+                worker.start()
+            self.pid = os.getpid()
+        atexit.register(self.shutdown, self.shutdown_timeout)
+
+    def shutdown(self, timeout=None):
+        '''
+        Deliver queued messages (waits up to timeout seconds) and stop the workers
+        '''
+        with self.lock:
+            workers, self.workers, self.pid = self.workers, [], None
+        if not workers:
+            return
+        self.wait(timeout)
+        for worker in workers:
+            self.queue.put(None)
+        for worker in workers:
+            worker.join(timeout)
+
+    def wait(self, timeout=None):
+        '''
+        Wait until all the queued messages are processed
+
+        :return: Boolean status - whether the queue was drained within timeout
+        '''
+        deadline = time.time() + timeout if timeout is not None else None
+        while self.queue.unfinished_tasks:
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+
+class MailPool(object):
+    '''
+    Bounded pool of email delivery threads
+
+    MAIL_POOL_WORKERS threads share queue of at most MAIL_POOL_QUEUE_SIZE messages,
+    each thread keeps its own SMTP connection (mail.connect()) open while there are messages to send
+    (it is closed after MAIL_POOL_IDLE_TIMEOUT seconds without messages) and takes messages in batches
+    of up to MAIL_POOL_BATCH_SIZE. When the queue is full, send() blocks for up to
+    MAIL_POOL_ENQUEUE_TIMEOUT seconds and raises MailQueueFull (backpressure).
+    Failed deliveries are retried MAIL_POOL_MAX_RETRIES times over new connection,
+    with exponential backoff starting at MAIL_POOL_RETRY_BACKOFF seconds.
+    '''
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MAIL_POOL_WORKERS', 2)
+        app.config.setdefault('MAIL_POOL_QUEUE_SIZE', 1000)
+        app.config.setdefault('MAIL_POOL_BATCH_SIZE', 50)
+        app.config.setdefault('MAIL_POOL_ENQUEUE_TIMEOUT', 5)
+        app.config.setdefault('MAIL_POOL_MAX_RETRIES', 3)
+        app.config.setdefault('MAIL_POOL_RETRY_BACKOFF', 1.0)
+        app.config.setdefault('MAIL_POOL_IDLE_TIMEOUT', 30)
+        app.config.setdefault('MAIL_POOL_SHUTDOWN_TIMEOUT', 10)
+        app.extensions['mail_pool'] = _MailPoolState(app)
+
+    def _state(self):
+        return current_app.extensions['mail_pool']
+
+    def send(self, msg):
+        '''
+        Queue the message for delivery, workers are started on first use
+
+        :param msg: flask_mail.Message
+        Raises MailQueueFull when the queue stays full for MAIL_POOL_ENQUEUE_TIMEOUT seconds
+        '''
+        state = self._state()
+        state.start(current_app._get_current_object())
+        try:
+            state.queue.put(msg, timeout=state.enqueue_timeout)
+        except Full:
+            raise MailQueueFull('Email queue is full ({} messages)'.format(state.queue.maxsize))
+        state.count('queued')
+
+    def wait(self, timeout=None):
+        '''
+        Wait until all the queued messages are delivered (or given up)
+
+        :return: Boolean status - whether the queue was drained within timeout
+        '''
+        return self._state().wait(timeout)
+
+    def shutdown(self, timeout=None):
+        '''
+        Deliver queued messages (waits up to timeout seconds) and stop the workers,
+        they are started again by next send()
+        '''
+        self._state().shutdown(timeout)
+
+    def stats(self):
+        '''
+        :return: dict with numbers of queued, sent and failed messages, retries and opened connections
+        '''
+        state = self._state()
+        with state.lock:
+            stats = dict(state.stats)
+        stats['pending'] = state.queue.unfinished_tasks
+        return stats
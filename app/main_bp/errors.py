@@ -13,8 +13,8 @@ def page_not_found(e):
             not request.accept_mimetypes.accept_html:
             return RestApiErrors.not_found_404(e.description)
 
-    current_app.logger.debug('accept_json: {}, accept_html: {}'.format(
-        request.accept_mimetypes.accept_html, request.accept_mimetypes.accept_html))
+    current_app.logger.debug('accept_json: %s, accept_html: %s',
+                             request.accept_mimetypes.accept_json, request.accept_mimetypes.accept_html)
 
     return render_template('404.html'), 404
 
@@ -0,0 +1,279 @@
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from flask import current_app, _app_ctx_stack, _request_ctx_stack
+
+# upper bounds (seconds) of latency histogram buckets, +Inf bucket is implicit
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class _EndpointMetrics(object):
+    __slots__ = ('buckets', 'latency_sum', 'db_time_sum', 'statuses')
+
+    def __init__(self, bucket_count):
+        self.buckets = [0] * (bucket_count + 1)  # per bucket (not cumulative) counts, last one is +Inf
+        self.latency_sum = 0.0
+        self.db_time_sum = 0.0
+        self.statuses = {}  # status code -> count
+
+    def as_dict(self):
+        return {
+            'buckets': self.buckets,
+            'latency_sum': self.latency_sum,
+            'db_time_sum': self.db_time_sum,
+            'statuses': dict((str(status), n) for status, n in self.statuses.items())
+        }
+
+
+class _MetricsState(object):
+    '''
+    Metrics of single process
+    '''
+
+    def __init__(self, buckets, multiproc_dir, flush_interval):
+        self.buckets = buckets
+        self.multiproc_dir = multiproc_dir
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.endpoints = {}  # (blueprint, view) -> _EndpointMetrics
+        self.in_flight = 0
+        self.next_flush = 0
+        self.pid = None
+        self.path = None
+
+    def record(self, endpoint, status, latency, db_time):
+        with self.lock:
+            metrics = self.endpoints.get(endpoint)
+            if metrics is None:
+                metrics = self.endpoints[endpoint] = _EndpointMetrics(len(self.buckets))
+            metrics.buckets[bisect_left(self.buckets, latency)] += 1
+            metrics.latency_sum += latency
+            metrics.db_time_sum += db_time
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'pid': os.getpid(),
+                'in_flight': self.in_flight,
+                'endpoints': [[blueprint, view, metrics.as_dict()]
+                              for (blueprint, view), metrics in self.endpoints.items()]
+            }
+
+    def check_process(self):
+        '''
+        Forked worker starts with copy of parent metrics (reported by the parent itself) -
+        reset them and start own metrics file
+        '''
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            self.endpoints = {}
+            self.in_flight = 0
+            self.next_flush = 0
+            self.pid = os.getpid()
+            self.path = os.path.join(self.multiproc_dir, 'metrics-{}-{}.json'.format(self.pid, int(time.time())))
+        atexit.register(self.flush_at_exit)
+
+    def flush_at_exit(self):
+        try:
+            self.flush()
+        except EnvironmentError:
+            pass  # directory was removed
+
+    def flush(self):
+        '''
+        Write snapshot of this process to METRICS_MULTIPROC_DIR (atomically - via rename)
+        '''
+        self.check_process()
+        self.next_flush = time.time() + self.flush_interval
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.rename(tmp_path, self.path)
+
+
+class Metrics(object):
+    '''
+    Request metrics exported in Prometheus text format on unauthenticated /metrics route
+
+    Records per endpoint (blueprint and view name) latency histogram, DB time and responses by status code,
+    and number of requests in flight.
+    With METRICS_MULTIPROC_DIR set, every worker process writes its metrics to own file in the directory
+    (at most every METRICS_FLUSH_INTERVAL seconds and on exit) and /metrics sums the files of all the workers,
+    the directory should be emptied when the server is (re)started.
+    '''
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENABLED', True)
+        app.config.setdefault('METRICS_BUCKETS', DEFAULT_BUCKETS)
+        app.config.setdefault('METRICS_MULTIPROC_DIR', os.environ.get('METRICS_MULTIPROC_DIR'))
+        app.config.setdefault('METRICS_FLUSH_INTERVAL', 5)
+        if not app.config['METRICS_ENABLED']:
+            return
+        multiproc_dir = app.config['METRICS_MULTIPROC_DIR']
+        if multiproc_dir and not os.path.isdir(multiproc_dir):
+            os.makedirs(multiproc_dir)
+        app.extensions['metrics'] = _MetricsState(
+            tuple(sorted(app.config['METRICS_BUCKETS'])), multiproc_dir, app.config['METRICS_FLUSH_INTERVAL'])
+        app.before_request(_start_request)
+        app.after_request(_record_response)
+        app.teardown_request(_finish_request)
+        app.add_url_rule('/metrics', 'metrics', metrics_view)
+
+    def _state(self):
+        return current_app.extensions['metrics']
+
+    def collect(self):
+        '''
+        :return: snapshots of all the processes (only current one without METRICS_MULTIPROC_DIR)
+        '''
+        state = self._state()
+        if not state.multiproc_dir:
+            return [state.snapshot()]
+        state.flush()
+        snapshots = []
+        for path in glob.glob(os.path.join(state.multiproc_dir, 'metrics-*.json')):
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (IOError, ValueError):
+                continue  # removed or written by other process meanwhile
+            if not _is_alive(snapshot['pid']):
+                # counters of exited workers are kept, requests in flight are not
+                snapshot['in_flight'] = 0
+            snapshots.append(snapshot)
+        return snapshots
+
+    def render(self):
+        '''
+        :return: metrics of all the processes in Prometheus text exposition format
+        '''
+        buckets = self._state().buckets
+        endpoints = {}
+        in_flight = 0
+        for snapshot in self.collect():
+            in_flight += snapshot['in_flight']
+            for blueprint, view, metrics in snapshot['endpoints']:
+                total = endpoints.get((blueprint, view))
+                if total is None:
+                    total = endpoints[(blueprint, view)] = {
+                        'buckets': [0] * (len(buckets) + 1), 'latency_sum': 0.0, 'db_time_sum': 0.0, 'statuses': {}}
+                total['buckets'] = [a + b for a, b in zip(total['buckets'], metrics['buckets'])]
+                total['latency_sum'] += metrics['latency_sum']
+                total['db_time_sum'] += metrics['db_time_sum']
+                for status, n in metrics['statuses'].items():
+                    total['statuses'][status] = total['statuses'].get(status, 0) + n
+
+        lines = [
+            '# HELP http_requests_in_flight Requests currently being processed',
+            '# TYPE http_requests_in_flight gauge',
+            'http_requests_in_flight {}'.format(in_flight),
+            '# HELP http_requests_total Finished requests by endpoint and status code',
+            '# TYPE http_requests_total counter'
+        ]
+        for (blueprint, view), total in sorted(endpoints.items()):
+            for status, n in sorted(total['statuses'].items()):
+                lines.append('http_requests_total{{{},status="{}"}} {}'.format(_labels(blueprint, view), status, n))
+
+        lines.extend([
+            '# HELP http_request_duration_seconds Request latency by endpoint',
+            '# TYPE http_request_duration_seconds histogram'
+        ])
+        for (blueprint, view), total in sorted(endpoints.items()):
+            labels = _labels(blueprint, view)
+            cumulative = 0
+            for bound, n in zip(buckets + ('+Inf',), total['buckets']):
+                cumulative += n
+                lines.append('http_request_duration_seconds_bucket{{{},le="{}"}} {}'.format(labels, bound, cumulative))
+            lines.append('http_request_duration_seconds_sum{{{}}} {!r}'.format(labels, total['latency_sum']))
+            lines.append('http_request_duration_seconds_count{{{}}} {}'.format(labels, cumulative))
+
+        lines.extend([
+            '# HELP http_request_db_seconds_total Time spent in database queries by endpoint',
+            '# TYPE http_request_db_seconds_total counter'
+        ])
+        for (blueprint, view), total in sorted(endpoints.items()):
+            lines.append('http_request_db_seconds_total{{{}}} {!r}'.format(
+                _labels(blueprint, view), total['db_time_sum']))
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(blueprint, view):
+    return 'blueprint="{}",view="{}"'.format(_escape(blueprint), _escape(view))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def _split_endpoint(request_ctx):
+    rule = request_ctx.request.url_rule
+    if rule is None:
+        return '', 'not_found'
+    blueprint, dot, view = rule.endpoint.rpartition('.')
+    return blueprint, view
+
+
+# request hooks access context stacks directly instead of through request/g proxies - they run for every request
+
+def _start_request():
+    request_ctx = _request_ctx_stack.top
+    state = request_ctx.app.extensions['metrics']
+    if state.multiproc_dir:
+        state.check_process()
+    request_ctx.metrics_started = request_ctx.metrics_in_flight = time.time()
+    with state.lock:
+        state.in_flight += 1
+
+
+def _record_response(response):
+    request_ctx = _request_ctx_stack.top
+    started = getattr(request_ctx, 'metrics_started', None)
+    if started is not None:
+        request_ctx.metrics_started = None
+        # DB time is taken from per request query stats
+        stats = getattr(_app_ctx_stack.top.g, 'query_stats', None)
+        request_ctx.app.extensions['metrics'].record(
+            _split_endpoint(request_ctx), response.status_code, time.time() - started,
+            stats.duration if stats is not None else 0.0)
+    return response
+
+
+def _finish_request(exception):
+    request_ctx = _request_ctx_stack.top
+    state = request_ctx.app.extensions['metrics']
+    started = getattr(request_ctx, 'metrics_started', None)
+    if started is not None:
+        # after_request was skipped by unhandled exception
+        request_ctx.metrics_started = None
+        state.record(_split_endpoint(request_ctx), 500, time.time() - started, 0.0)
+    if getattr(request_ctx, 'metrics_in_flight', None) is not None:
+        request_ctx.metrics_in_flight = None
+        with state.lock:
+            state.in_flight -= 1
+    if state.multiproc_dir and time.time() >= state.next_flush:
+        state.flush()
+
+
+def metrics_view():
+    from . import metrics
+    return current_app.response_class(metrics.render(), content_type=PROMETHEUS_CONTENT_TYPE)
@@ -1,12 +1,14 @@
 from . import db
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
 import sys
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin, AnonymousUserMixin
-from . import login_manager
+from . import login_manager, rbac_cache, token_cache, password_hasher, read_only_requests
 from itsdangerous import TimedJSONWebSignatureSerializer
-from flask import current_app, url_for
+from flask import current_app
 from sqlalchemy.orm.exc import NoResultFound
-from .utils import split_url
+from .resource_urls import resolve_url, resource_url, url_templates, url_template
 
 
 class ValidationError(ValueError):
@@ -45,7 +47,11 @@ class User(UserMixin, db.Model):
     password_hash = db.Column(db.String(128))
     email = db.Column(db.String(64), unique=True, index=True)
     confirmed = db.Column(db.Boolean(), default=False)
+    # row version, incremented on every change - used for ETags
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     role = db.relationship('Role', back_populates='users')
+    refresh_tokens = db.relationship('RefreshToken', lazy='dynamic', cascade='all, delete-orphan',
+                                     passive_deletes=True)
 
     def __init__(self, **kwargs):
         super(User, self).__init__(**kwargs)
@@ -73,10 +79,37 @@ class User(UserMixin, db.Model):
             'username': self.username,
             'email': self.email,
             'confirmed': self.confirmed,
-            'role': self.role.url
+            'role': resource_url('api_bp.get_role', self.rbac_role_id())
         }
         return export_to_dict_user
 
+    @staticmethod
+    def export_many(users):
+        '''
+        Represent list of users as list of dictionaries (same as export_to_dict of each user)
+
+        URL templates are looked up only once for the whole list,
+        so each user is serialized by plain string formatting
+
+        :param users: iterable of User
+        :return: list of dicts
+        '''
+        templates = url_templates()
+        user_head, user_tail = url_template('api_bp.get_user', templates)
+        role_head, role_tail = url_template('api_bp.get_role', templates)
+        exported = []
+        for user in users:
+            role_id = user.rbac_role_id()
+            exported.append({
+                'id': user.id,
+                'self_url': user_head + str(user.id) + user_tail,
+                'username': user.username,
+                'email': user.email,
+                'confirmed': user.confirmed,
+                'role': role_head + str(role_id) + role_tail if role_id is not None else None
+            })
+        return exported
+
     def import_from_dict(self, user_dict):
         '''
         Get user from Dictionary, can be used for extracting user from JSON/XML...
@@ -87,7 +120,7 @@ class User(UserMixin, db.Model):
 
         #role url
         if 'role' in user_dict:
-            endpoint, args = split_url(user_dict['role'])
+            endpoint, args = resolve_url(user_dict['role'])
             if endpoint != 'api_bp.get_role' or 'id' not in args:
                 raise ValidationError("Invalid role URL: {}".format(user_dict['role']))
 
@@ -113,47 +146,15 @@ class User(UserMixin, db.Model):
 
     @property
     def url(self):
-        return url_for('api_bp.get_user', id=self.id, _external=True)
+        return resource_url('api_bp.get_user', self.id)
 
     @staticmethod
     def insert_cfg_users():
-
-        # Make sure roles are populated
-        Role.insert_cfg_roles()
-
-        for cfg_user in current_app.config['USERS']:
-
-            try:
-                db_role = Role.query.filter_by(name=cfg_user['role']).one()
-            except NoResultFound as e:
-                current_app.logger.exception(
-                    'Could not add User {}, no such role in DB {}'.format(
-                        cfg_user['name'], cfg_user['role']))
-                raise
-
-            # Role is in DB - otherwise can't get here
-            try:
-                db_user = User.query.filter_by(username=cfg_user['username']).one()
-            except NoResultFound:
-                db_user = User(
-                    username=cfg_user['username'],
-                    email=cfg_user['email'],
-                    role=db_role,
-                    confirmed=cfg_user['confirmed']
-                )
-
-            # User in DB - update it per need
-            for cfg_att_name in cfg_user.keys():
-                if not (cfg_att_name.startswith('_') or
-                        cfg_att_name == 'role'):
-                    if getattr(db_user,cfg_att_name) != getattr(cfg_user, cfg_att_name):
-                        setattr(db_user, cfg_att_name, cfg_user[cfg_att_name])
-
-            db_user.role = db_role
-            db_user.password = cfg_user['password']
-            db.session.merge(db_user)
-
-        db.session.commit()
+        '''
+        Sync PERMISSIONS, ROLES and USERS of the config to the database, see config_sync.sync_config
+        '''
+        from .config_sync import sync_config
+        sync_config(until='users')
 
     @property
     def password(self):
@@ -168,10 +169,27 @@ class User(UserMixin, db.Model):
 
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
+        if self.id is not None:
+            # refresh tokens live long - stolen token must not survive password change
+            from .refresh_tokens import revoke_refresh_tokens
+            revoke_refresh_tokens(user_id=self.id)
 
     def password_is_correct(self, password):
-        return check_password_hash(self.password_hash, password)
+        '''
+        Verify password, on successful verification hash generated with outdated
+        method/cost is transparently replaced with hash of current PASSWORD_HASH_METHOD
+
+        :param password: plain text password
+        :return: Boolean status
+        '''
+        is_correct = password_hasher.verify(self.password_hash, password)
+        if is_correct and password_hasher.needs_rehash(self.password_hash):
+            # login is usually read-only request (e.g GET of the API with basic auth)
+            read_only_requests.allow_writes()
+            # the same password - refresh tokens stay valid
+            self.password_hash = password_hasher.hash(password)
+        return is_correct
 
     def generate_confirmation_token(self, expiration=3600):
         s = TimedJSONWebSignatureSerializer(current_app.config['SECRET_KEY'], expires_in=expiration)
@@ -195,24 +213,41 @@ class User(UserMixin, db.Model):
     def can(self, permissions):
         '''
         Check if all the permissions are allowed for current user
+
+        Permissions are checked against compiled RBAC catalog (see app/rbac.py),
+        so no queries are done unless the catalog has to be rebuilt
         :param permissions: List of permissions
         :return: Boolean status
         '''
+        catalog = rbac_cache.catalog()
+        mask = catalog.mask_for(permissions)
+        if mask is None:
+            return False
 
-        for permission in permissions:
-            if isinstance(permission, str):
-                try:
-                    permission = Permission.query.filter_by(name=permission).one()
-                except NoResultFound as e:
-                    return False
-            if permission.name not in \
-                    [p.name for p in self.role.permissions]:
+        role_id = self.rbac_role_id()
+        if role_id is None:
+            # Role is not persisted yet - it is not part of catalog
+            if self.role is None:
                 return False
-        return True
+            role_permissions = [p.name for p in self.role.permissions]
+            return all(getattr(p, 'name', p) in role_permissions for p in permissions)
+        return catalog.role_has(role_id, mask)
 
     def is_admin(self):
-        if self.role.name == 'Admin':
-            return True
+        role_id = self.rbac_role_id()
+        if role_id is None:
+            return self.role is not None and self.role.name == 'Admin'
+        return rbac_cache.catalog().role_name(role_id) == 'Admin'
+
+    def rbac_role_id(self):
+        '''
+        :return: id of the role in RBAC catalog (also of role assigned but not flushed yet), None without role
+        '''
+        if self.role_id is not None:
+            return self.role_id
+        if 'role' in self.__dict__ and self.role is not None:
+            return self.role.id
+        return None
 
     def generate_auth_token(self, expiration):
         """
@@ -233,21 +268,69 @@ class User(UserMixin, db.Model):
 
         this methos is static, as there is no way to find our which user runs it until he authenticates himself
 
+        Verified tokens are kept in token_cache, so clients reusing the same token
+        skip signature verification and user lookup until the token expires
+
         :param token: authentication token
         :return: User id or None
         """
+        cached = token_cache.get(token)
+        if cached is not None:
+            claims, user = cached
+            return db.session.merge(user, load=False)
+
         s = TimedJSONWebSignatureSerializer(current_app.config['SECRET_KEY'])
         try:
-            data = s.loads(token)
+            data, header = s.loads(token, return_header=True)
         except:
             return None
 
-        return User.query.get(data['id'])
+        user = User.query.get(data['id'])
+        if user is not None:
+            token_cache.put(token, data, user, header['exp'])
+        return user
 
     def __repr__(self):
         return '<User %r>' % self.username
 
 
+class RefreshToken(db.Model):
+    '''
+    Refresh token of API client, see refresh_tokens.py - only SHA-256 digest of the token is stored
+
+    Tokens rotated from the same initial token share family_id.
+    '''
+    __tablename__ = 'refresh_tokens'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    token_hash = db.Column(db.String(64), nullable=False, unique=True, index=True)
+    family_id = db.Column(db.String(32), nullable=False, index=True)
+    created_at = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(db.Integer, nullable=False)
+    # set when the token is rotated or revoked
+    revoked_at = db.Column(db.Integer, nullable=True)
+
+    def __repr__(self):
+        return '<RefreshToken %r %r>' % (self.user_id, self.family_id)
+
+
+class RevokedToken(db.Model):
+    '''
+    Revoked access token (token_id) or all access tokens of user issued before revoked_at (no token_id),
+    see claims_tokens.ClaimsTokens
+    '''
+    __tablename__ = 'revoked_tokens'
+    id = db.Column(db.Integer, primary_key=True)
+    token_id = db.Column(db.String(16), nullable=True, index=True)
+    user_id = db.Column(db.Integer, nullable=True, index=True)
+    revoked_at = db.Column(db.BigInteger, nullable=False)  # milliseconds since epoch
+    # no token revoked by the row is valid afterwards - the row can be purged
+    expires_at = db.Column(db.Integer, nullable=False, index=True)
+
+    def __repr__(self):
+        return '<RevokedToken %r %r>' % (self.token_id, self.user_id)
+
+
 @login_manager.user_loader
 def user_loader(user_id):
     """
@@ -274,6 +357,8 @@ class Permission(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), index=True, nullable=False, unique=True)
     description = db.Column(db.String(length=1024), nullable=True)
+    # row version, incremented on every change (including roles) - used for ETags
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
 
     # many-to-many Role<->Permission
     roles = db.relationship(
@@ -293,28 +378,15 @@ class Permission(db.Model):
 
     @property
     def url(self):
-        return url_for('api_bp.get_permission', id=self.id, _external=True)
+        return resource_url('api_bp.get_permission', self.id)
 
     @staticmethod
     def insert_cfg_permissions():
-        cfg_permissions = current_app.config['PERMISSIONS']
-        # Add missing permissions
-        for cfg_permission in cfg_permissions:
-            try:
-                db_permission = Permission.query.filter_by(
-                    name=cfg_permission['name']).one()
-            except NoResultFound:
-                db_permission = Permission(
-                    name=cfg_permission['name'],
-                    description=cfg_permission.get('description')
-                )
-            if db_permission.name != cfg_permission['name']:
-                db_permission.name = cfg_permission['name']
-            if (cfg_permission.get('description') is not None
-                and cfg_permission.get('description') != db_permission.description):
-                db_permission.description = cfg_permission['description']
-            db.session.merge(db_permission)
-        db.session.commit()
+        '''
+        Sync PERMISSIONS of the config to the database, see config_sync.sync_config
+        '''
+        from .config_sync import sync_config
+        sync_config(until='permissions')
 
     def __repr__(self):
         return 'Permission <{}>'.format(self.name)
@@ -330,6 +402,8 @@ class Role(db.Model):
     description = db.Column(db.String(1024), nullable=True)
     # based on this attribute default role can be set to new users
     is_default = db.Column(db.Boolean, default=False, index=True)
+    # row version, incremented on every change (including permissions) - used for ETags
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     # many-to-many Roles<->Permissions
     permissions = db.relationship(
         'Permission',
@@ -343,11 +417,15 @@ class Role(db.Model):
         lazy='dynamic')
 
 
-    def export_to_dict(self):
+    def export_to_dict(self, user_count=None):
         '''
         Helper method that represent user as dictionary,
         this can be used later for converting to XML/JSON...
 
+        Members of the role are not listed, representation has only their number
+        and link to paginated collection of members, so its size doesn't depend on the role popularity
+
+        :param user_count: number of members if it was already counted
         :return: dict{role_attr:value,...}
 
         '''
@@ -358,39 +436,50 @@ class Role(db.Model):
             'description': self.description,
             'is_default': self.is_default,
             'permissions': [p.url for p in self.permissions],
-            'users': [u.url for u in self.users]}
+            'user_count': self.user_count if user_count is None else user_count,
+            'users_url': resource_url('api_bp.get_role_users', self.id)}
+
+    @property
+    def user_count(self):
+        '''
+        Number of users in role, counted by database - members are not loaded
+        '''
+        return db.session.query(db.func.count(User.id)).filter(User.role_id == self.id).scalar()
 
     @property
     def url(self):
-        return url_for('api_bp.get_role', id=self.id, _external=True)
+        return resource_url('api_bp.get_role', self.id)
 
     @staticmethod
     def insert_cfg_roles():
-        Permission.insert_cfg_permissions()
-        for cfg_role in current_app.config['ROLES']:
-            try:
-                db_role = Role.query.filter_by(name=cfg_role.get('name')).one()
-            except NoResultFound:
-                db_role = Role(
-                    name=cfg_role.get('name'),
-                    description=cfg_role.get('description')
-                )
-
-            for cfg_attr in cfg_role.keys():
-                if not cfg_attr.startswith('_'):
-                    if getattr(db_role, cfg_attr) != cfg_role.get(cfg_attr):
-                        if cfg_attr == 'permissions':
-                            try:
-
-                                for cfg_permission in cfg_role['permissions']:
-                                    db_role.permissions.extend(Permission.query.filter_by(name=cfg_permission).all())
-                            except NoResultFound as e:
-                                current_app.logger.exception('Failed on permission {} '.format(cfg_permission))
-                                raise
-                        else:
-                            setattr(db_role, cfg_attr, cfg_role.get(cfg_attr))
-            db.session.merge(db_role)
-        db.session.commit()
+        '''
+        Sync PERMISSIONS and ROLES of the config to the database, see config_sync.sync_config
+        '''
+        from .config_sync import sync_config
+        sync_config(until='roles')
 
     def __repr__(self):
         return '<Role %r>' % self.name
+
+
+
+@event.listens_for(Session, 'before_flush')
+def increment_versions(session, flush_context, instances):
+    '''
+    Increment row version of every modified User, Role and Permission before it is flushed
+
+    Change of many-to-many Role<->Permission changes representation of both sides,
+    so versions of objects added to / removed from the relationship are incremented as well
+    '''
+    changed = set()
+    for obj in session.dirty:
+        if isinstance(obj, (User, Role, Permission)) and session.is_modified(obj):
+            changed.add(obj)
+            for key in ('permissions', 'roles'):
+                if hasattr(obj, key):
+                    history = get_history(obj, key)
+                    changed.update(history.added)
+                    changed.update(history.deleted)
+    for obj in changed:
+        if obj not in session.new:
+            obj.version = (obj.version or 0) + 1
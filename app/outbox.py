@@ -0,0 +1,218 @@
+import errno
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_FILE = 'outbox.jsonl'
+
+
+class _OutboxState(object):
+    '''
+    Spool directory shared by all the processes of the host
+
+    Records are appended (one JSON line by single write) to ACTIVE_FILE, every process keeps it open.
+    Writers hold shared flock while writing, drainer renames the file to *.draining and takes exclusive
+    flock on it - after that no writer can append to it, writers notice the rename and open new file.
+    '''
+
+    def __init__(self, directory, fsync):
+        self.directory = directory
+        self.path = os.path.join(directory, ACTIVE_FILE)
+        self.fsync = fsync
+        self.lock = threading.Lock()  # guards fd and written
+        self.sync_lock = threading.Lock()  # single thread fsyncs for all the waiting writers
+        self.fd = None
+        self.pid = None
+        self.written = 0
+        self.synced = 0
+        self.broker_retry_at = 0  # celery emails are spooled without trying the broker until then
+
+    def ensure_directory(self):
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def _open(self):
+        if self.pid != os.getpid():
+            # descriptor inherited from parent - its locks and counters belong to the parent
+            self.fd, self.pid = None, os.getpid()
+        while True:
+            if self.fd is None:
+                self.ensure_directory()
+                self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            fcntl.flock(self.fd, fcntl.LOCK_SH)
+            try:
+                current = os.stat(self.path).st_ino
+            except OSError:
+                current = None
+            if current == os.fstat(self.fd).st_ino:
+                return self.fd
+            # file was taken by drainer - records appended to it are synced before it is closed
+            # (once per drain, so fsync under the lock doesn't hold the writers for long)
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            if self.fsync:
+                os.fsync(self.fd)
+            os.close(self.fd)
+            self.fd = None
+
+    def append(self, line):
+        with self.lock:
+            fd = self._open()
+            try:
+                os.write(fd, line)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            self.written += 1
+            sequence = self.written
+        if self.fsync:
+            self._sync(sequence)
+
+    def _sync(self, sequence):
+        # group commit - writers that appended while other thread was in fsync are covered by one next fsync
+        with self.sync_lock:
+            if self.synced >= sequence:
+                return
+            with self.lock:
+                # duplicate - rotation can close the descriptor while the other writers append
+                target, fd = self.written, os.dup(self.fd) if self.fd is not None else None
+            if fd is not None:
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            self.synced = target
+
+    def take(self):
+        '''
+        :return: paths of files to drain - the active file (renamed) and files left by failed drains
+        '''
+        try:
+            os.rename(self.path, os.path.join(
+                self.directory, 'outbox-{:.6f}-{}.draining'.format(time.time(), os.getpid())))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        return sorted(glob.glob(os.path.join(self.directory, '*.draining')))
+
+
+def _read_records(f):
+    records = []
+    for line in f:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            # line cut by crash during write
+            logger.warning('Skipping corrupted outbox record: %r', line)
+    return records
+
+
+class Outbox(object):
+    '''
+    Durable local spool of outgoing emails
+
+    append() is O(1) - single write to append-only file in MAIL_OUTBOX_DIR, with MAIL_OUTBOX_FSYNC
+    the record is on disk when it returns, concurrent writers share fsync calls (group commit).
+    drain() passes spooled records in batches of MAIL_OUTBOX_DRAIN_BATCH to delivery function,
+    records that were not delivered stay in the spool for next drain. Delivery is at least once.
+    The directory is local - it must be drained on every host that writes to it.
+
+    After failed publish to the broker (broker_failed) the emails are spooled without trying the broker
+    for MAIL_OUTBOX_BROKER_RETRY_SECONDS, so requests don't wait for the connect timeout one by one.
+    '''
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MAIL_OUTBOX_DIR', os.path.join(os.getcwd(), 'tmp', 'outbox'))
+        app.config.setdefault('MAIL_OUTBOX_FSYNC', True)
+        app.config.setdefault('MAIL_OUTBOX_DRAIN_BATCH', 100)
+        app.config.setdefault('MAIL_OUTBOX_FALLBACK', True)
+        app.config.setdefault('MAIL_OUTBOX_BROKER_RETRY_SECONDS', 30)
+        app.extensions['outbox'] = _OutboxState(app.config['MAIL_OUTBOX_DIR'], app.config['MAIL_OUTBOX_FSYNC'])
+
+    def _state(self):
+        return current_app.extensions['outbox']
+
+    def append(self, record):
+        '''
+        :param record: JSON serializable dict
+        '''
+        self._state().append(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def broker_available(self):
+        '''
+        :return: False for MAIL_OUTBOX_BROKER_RETRY_SECONDS after broker_failed
+        '''
+        return time.time() >= self._state().broker_retry_at
+
+    def broker_failed(self):
+        self._state().broker_retry_at = time.time() + current_app.config['MAIL_OUTBOX_BROKER_RETRY_SECONDS']
+
+    def drain(self, deliver):
+        '''
+        Deliver all the spooled records
+
+        :param deliver: function that gets list of records and returns number of delivered ones
+            (records are delivered in order, so the rest are kept in the spool)
+        :return: number of delivered records
+        '''
+        state = self._state()
+        batch_size = current_app.config['MAIL_OUTBOX_DRAIN_BATCH']
+        delivered = 0
+        state.ensure_directory()
+        with open(os.path.join(state.directory, 'drain.lock'), 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                logger.info('Outbox is being drained by other process')
+                return 0
+            for path in state.take():
+                with open(path) as f:
+                    # waits for writers that still append to the file
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                    records = _read_records(f)
+                for start in range(0, len(records), batch_size):
+                    batch = records[start:start + batch_size]
+                    count = deliver(batch)
+                    delivered += count
+                    if count < len(batch):
+                        # keep the rest for next drain
+                        _rewrite(path, records[start + count:])
+                        return delivered
+                os.remove(path)
+        return delivered
+
+    def pending(self):
+        '''
+        :return: number of spooled records
+        '''
+        count = 0
+        directory = self._state().directory
+        for path in glob.glob(os.path.join(directory, '*.jsonl')) + glob.glob(os.path.join(directory, '*.draining')):
+            with open(path) as f:
+                count += sum(1 for line in f)
+        return count
+
+
+def _rewrite(path, records):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        for record in records:
+            f.write(json.dumps(record, separators=(',', ':')) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp_path, path)
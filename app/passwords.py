@@ -0,0 +1,143 @@
+import atexit
+import multiprocessing
+import os
+import threading
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class _PasswordHasherState(object):
+    '''
+    Hashing parameters and process pool of single application
+    '''
+
+    def __init__(self, method, salt_length, pool_size, max_pending, timeout):
+        self.method = method
+        self.salt_length = salt_length
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        self.pool = None
+        self.pool_pid = None
+        self.hash_prefix = None
+
+    def get_pool(self):
+        # pool can't be shared with forked worker processes - create one per process
+        if self.pool is None or self.pool_pid != os.getpid():
+            with self.lock:
+                if self.pool is None or self.pool_pid != os.getpid():
+                    self.pool = multiprocessing.Pool(processes=self.pool_size)
+                    self.pool_pid = os.getpid()
+                    atexit.register(self.pool.terminate)
+        return self.pool
+
+
+class PasswordHasher(object):
+    '''
+    Password hashing service
+
+    Hashing algorithm and cost are set by PASSWORD_HASH_METHOD (werkzeug method string,
+    e.g 'pbkdf2:sha256:50000') and PASSWORD_HASH_SALT_LENGTH.
+    Hashes are computed in a bounded process pool of PASSWORD_HASH_POOL_SIZE processes
+    (None - one per CPU, 0 - on the calling thread), so PBKDF2 doesn't saturate request workers,
+    at most PASSWORD_HASH_MAX_PENDING hashes (or batches of hash_many/verify_many) are queued,
+    callers above this limit wait. Every hash or batch waits at most PASSWORD_HASH_TIMEOUT_SECONDS.
+    '''
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:50000')
+        app.config.setdefault('PASSWORD_HASH_SALT_LENGTH', 8)
+        app.config.setdefault('PASSWORD_HASH_POOL_SIZE', None)
+        app.config.setdefault('PASSWORD_HASH_MAX_PENDING', 64)
+        app.config.setdefault('PASSWORD_HASH_TIMEOUT_SECONDS', 30)
+        pool_size = app.config['PASSWORD_HASH_POOL_SIZE']
+        if pool_size is None:
+            pool_size = multiprocessing.cpu_count()
+        app.extensions['password_hasher'] = _PasswordHasherState(
+            method=app.config['PASSWORD_HASH_METHOD'],
+            salt_length=app.config['PASSWORD_HASH_SALT_LENGTH'],
+            pool_size=pool_size,
+            max_pending=app.config['PASSWORD_HASH_MAX_PENDING'],
+            timeout=app.config['PASSWORD_HASH_TIMEOUT_SECONDS'])
+
+    def _state(self):
+        return current_app.extensions['password_hasher']
+
+    def _run(self, func, *args):
+        state = self._state()
+        if not state.pool_size:
+            return func(*args)
+        with state.pending:
+            return state.get_pool().apply_async(func, args).get(state.timeout)
+
+    def _map(self, func, args_list):
+        state = self._state()
+        if not state.pool_size:
+            return [func(*args) for args in args_list]
+        # batches of pool size, each takes a pending slot - hashes of logins are queued between the batches,
+        # not behind all the hashes of large import/sync
+        results = []
+        for start in range(0, len(args_list), state.pool_size):
+            batch = [(func, args) for args in args_list[start:start + state.pool_size]]
+            with state.pending:
+                results.extend(state.get_pool().map_async(_star_call, batch).get(state.timeout))
+        return results
+
+    def hash(self, password):
+        '''
+        :param password: plain text password
+        :return: password hash with current method and cost
+        '''
+        state = self._state()
+        return self._run(generate_password_hash, password, state.method, state.salt_length)
+
+    def hash_many(self, passwords):
+        '''
+        Hash list of passwords, spreads the work across all processes of the pool
+
+        :return: list of hashes in the same order
+        '''
+        state = self._state()
+        return self._map(generate_password_hash,
+                         [(password, state.method, state.salt_length) for password in passwords])
+
+    def verify(self, pwhash, password):
+        '''
+        :return: Boolean status - whether password matches the hash
+        '''
+        return self._run(check_password_hash, pwhash, password)
+
+    def verify_many(self, pairs):
+        '''
+        :param pairs: list of (pwhash, password)
+        :return: list of Boolean statuses in the same order
+        '''
+        return self._map(check_password_hash, pairs)
+
+    def needs_rehash(self, pwhash):
+        '''
+        Check whether the hash was generated with other method or cost than currently configured
+
+        :param pwhash: password hash
+        :return: Boolean status
+        '''
+        return pwhash.split('$', 1)[0] != self.current_method()
+
+    def current_method(self):
+        '''
+        :return: full method string (including iterations) as it is stored in hashes
+        '''
+        state = self._state()
+        if state.hash_prefix is None:
+            state.hash_prefix = generate_password_hash('', state.method, 1).split('$', 1)[0]
+        return state.hash_prefix
+
+
+def _star_call(func_and_args):
+    func, args = func_and_args
+    return func(*args)
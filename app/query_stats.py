@@ -0,0 +1,189 @@
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+
+
+class QueryStats(object):
+    '''
+    SQL statements executed during single request (or recording block)
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()  # (statement, parameters) -> number of executions
+        self.by_bind = Counter()  # database URL -> number of statements
+
+    def add(self, bind, statement, parameters, duration):
+        self.count += 1
+        self.duration += duration
+        self.statements[(statement, repr(parameters))] += 1
+        self.by_bind[bind] += 1
+
+    @property
+    def duplicates(self):
+        '''
+        Number of executions of statements already executed with the same parameters
+        '''
+        return sum(n - 1 for n in self.statements.values() if n > 1)
+
+    @property
+    def repeated_statements(self):
+        '''
+        :return: dict {statement: executions} of statements executed more than once
+            (with any parameters) - typical symptom of N+1 lazy loads
+        '''
+        executions = Counter()
+        for (statement, parameters), n in self.statements.items():
+            executions[statement] += n
+        return dict((statement, n) for statement, n in executions.items() if n > 1)
+
+    def report(self):
+        '''
+        :return: human readable list of executed statements
+        '''
+        return '\n'.join('{} x {} {}'.format(n, statement, parameters)
+                         for (statement, parameters), n in self.statements.most_common())
+
+
+class _QueryCounterState(object):
+    def __init__(self, app):
+        self.headers = app.config['SQL_QUERY_STATS_HEADERS']
+        self.duplicates_warning = app.config['SQL_QUERY_STATS_DUPLICATES_WARNING']
+        self.recorders = []
+        self.lock = threading.Lock()
+        # database URL -> bind name (default for SQLALCHEMY_DATABASE_URI, otherwise SQLALCHEMY_BINDS key)
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        binds['default'] = app.config.get('SQLALCHEMY_DATABASE_URI') or 'sqlite://'
+        self.bind_names = dict((repr(make_url(uri)), name) for name, uri in binds.items())
+
+    def by_bind_name(self, stats):
+        '''
+        :return: dict {bind name: number of statements}
+        '''
+        return dict((self.bind_names.get(bind, bind), n) for bind, n in stats.by_bind.items())
+
+
+class QueryCounter(object):
+    '''
+    Counts SQL statements (per bind), DB time and repeated identical statements of every request
+
+    Enabled by SQL_QUERY_STATS_ENABLED, results are logged with request and sent in X-DB-Queries,
+    X-DB-Queries-By-Bind, X-DB-Time-Ms and X-DB-Duplicate-Queries response headers (SQL_QUERY_STATS_HEADERS).
+    Requests that repeat the same statement SQL_QUERY_STATS_DUPLICATES_WARNING times or more
+    are logged as warning (possible N+1).
+    '''
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SQL_QUERY_STATS_ENABLED', app.debug or app.testing)
+        app.config.setdefault('SQL_QUERY_STATS_HEADERS', app.debug or app.testing)
+        app.config.setdefault('SQL_QUERY_STATS_DUPLICATES_WARNING', 3)
+        app.extensions['query_counter'] = _QueryCounterState(app)
+        # request metrics report DB time of every request
+        if app.config['SQL_QUERY_STATS_ENABLED'] or app.config.get('METRICS_ENABLED'):
+            app.before_request(_start_request_stats)
+        if app.config['SQL_QUERY_STATS_ENABLED']:
+            app.after_request(_finish_request_stats)
+
+    def _state(self):
+        return current_app.extensions['query_counter']
+
+    @contextmanager
+    def recording(self):
+        '''
+        Collect statements executed inside the block (in any request or outside of requests),
+        e.g in tests:
+
+            with query_counter.recording() as stats:
+                client.get(url)
+            assert stats.count <= 5
+        '''
+        stats = QueryStats()
+        state = self._state()
+        with state.lock:
+            state.recorders.append(stats)
+        try:
+            yield stats
+        finally:
+            with state.lock:
+                state.recorders.remove(stats)
+
+    @staticmethod
+    def current():
+        '''
+        :return: QueryStats of current request or None when stats are not collected
+        '''
+        if not has_request_context():
+            return None
+        return g.get('query_stats')
+
+
+def _start_request_stats():
+    g.query_stats = QueryStats()
+
+
+def _finish_request_stats(response):
+    stats = g.get('query_stats')
+    if stats is None:
+        return response
+    state = current_app.extensions['query_counter']
+    duration_ms = stats.duration * 1000
+    by_bind = ', '.join('{}={}'.format(name, n) for name, n in sorted(state.by_bind_name(stats).items()))
+    current_app.logger.debug('%s %s: %d queries (%s) in %.1f ms, %d duplicates',
+                             request.method, request.path, stats.count, by_bind, duration_ms, stats.duplicates)
+    repeated = dict((statement, n) for statement, n in stats.repeated_statements.items()
+                    if n >= state.duplicates_warning)
+    if repeated:
+        current_app.logger.warning('%s %s: possible N+1 - repeated statements %s',
+                                   request.method, request.path, repeated)
+    if state.headers:
+        response.headers['X-DB-Queries'] = str(stats.count)
+        response.headers['X-DB-Queries-By-Bind'] = by_bind
+        response.headers['X-DB-Time-Ms'] = '{:.1f}'.format(duration_ms)
+        response.headers['X-DB-Duplicate-Queries'] = str(stats.duplicates)
+    return response
+
+
+def _active_stats():
+    if not has_app_context():
+        return []
+    state = current_app.extensions.get('query_counter')
+    if state is None:
+        return []
+    active = list(state.recorders)
+    if has_request_context():
+        stats = g.get('query_stats')
+        if stats is not None:
+            active.append(stats)
+    return active
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.time())
+
+
+@event.listens_for(Engine, 'handle_error')
+def _forget_failed_execute(exception_context):
+    started = exception_context.connection.info.get('query_started') if exception_context.connection else None
+    if started:
+        started.pop()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.time() - conn.info['query_started'].pop()
+    active = _active_stats()
+    if active:
+        bind = repr(conn.engine.url)
+        for stats in active:
+            stats.add(bind, statement, parameters, duration)
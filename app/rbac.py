@@ -0,0 +1,150 @@
+import threading
+import time
+import zlib
+from itertools import chain
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+class RbacCatalog(object):
+    '''
+    Immutable snapshot of the RBAC catalog (Permission, Role and permissions_in_role)
+
+    Every permission gets a bit, every role is compiled into a bitset of its permissions,
+    so checking permissions of a role is a pure in-memory operation.
+    Fingerprint identifies the content of the catalog - it is the same in all processes.
+    '''
+
+    __slots__ = ('version', 'loaded_at', 'permission_bits', 'role_masks', 'role_names', 'fingerprint')
+
+    def __init__(self, version, permission_bits, role_masks, role_names):
+        self.version = version
+        self.loaded_at = time.time()
+        self.permission_bits = permission_bits
+        self.role_masks = role_masks
+        self.role_names = role_names
+        self.fingerprint = zlib.crc32(repr((sorted(permission_bits.items()), sorted(role_masks.items())))) \
+            & 0xffffffff
+
+    def mask_for(self, permissions):
+        '''
+        Compile list of permissions into bitmask
+
+        :param permissions: List of permission names or Permission objects
+        :return: int bitmask or None if one of the permissions does not exist
+        '''
+        mask = 0
+        for permission in permissions:
+            bit = self.permission_bits.get(getattr(permission, 'name', permission))
+            if bit is None:
+                return None
+            mask |= bit
+        return mask
+
+    def role_mask(self, role_id):
+        return self.role_masks.get(role_id, 0)
+
+    def role_has(self, role_id, mask):
+        return self.role_mask(role_id) & mask == mask
+
+    def role_name(self, role_id):
+        return self.role_names.get(role_id)
+
+
+class RbacCache(object):
+    '''
+    Keeps compiled RbacCatalog per application
+
+    The snapshot is rebuilt lazily (3 queries) when its version was bumped by a committed
+    write to roles/permissions, or when it is older than RBAC_CACHE_TTL_SECONDS,
+    the TTL makes sure changes committed by other worker processes are picked up as well.
+    '''
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RBAC_CACHE_TTL_SECONDS', 60)
+        app.extensions['rbac'] = {'version': 0, 'catalog': None, 'lock': threading.Lock()}
+
+    def _state(self):
+        return current_app.extensions['rbac']
+
+    def catalog(self):
+        '''
+        Returns up to date catalog snapshot, rebuilds it if needed
+
+        :return: RbacCatalog
+        '''
+        state = self._state()
+        catalog = state['catalog']
+        if self._is_fresh(state, catalog):
+            return catalog
+        with state['lock']:
+            catalog = state['catalog']
+            if not self._is_fresh(state, catalog):
+                catalog = self._load(state['version'])
+                state['catalog'] = catalog
+        return catalog
+
+    def _is_fresh(self, state, catalog):
+        return catalog is not None \
+            and catalog.version == state['version'] \
+            and time.time() - catalog.loaded_at < current_app.config['RBAC_CACHE_TTL_SECONDS']
+
+    def invalidate(self):
+        '''
+        Bump catalog version so next permission check rebuilds the snapshot
+        '''
+        state = self._state()
+        with state['lock']:
+            state['version'] += 1
+
+    @staticmethod
+    def _load(version):
+        from . import db
+        from .models import Permission, Role, permissions_in_role
+
+        permission_ids = {}
+        permission_bits = {}
+        # sorted by name so bits are the same in all processes for the same catalog
+        for index, (permission_id, name) in enumerate(
+                db.session.query(Permission.id, Permission.name).order_by(Permission.name)):
+            permission_ids[permission_id] = name
+            permission_bits[name] = 1 << index
+
+        role_names = dict(db.session.query(Role.id, Role.name))
+        role_masks = dict.fromkeys(role_names, 0)
+        for role_id, permission_id in db.session.query(
+                permissions_in_role.c.role_id, permissions_in_role.c.permission_id):
+            role_masks[role_id] = role_masks.get(role_id, 0) | permission_bits[permission_ids[permission_id]]
+
+        return RbacCatalog(version, permission_bits, role_masks, role_names)
+
+
+def _is_rbac_object(obj):
+    from .models import Permission, Role
+    return isinstance(obj, (Permission, Role))
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_rbac_changes(session, flush_context):
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if _is_rbac_object(obj):
+            session.info['rbac_changed'] = True
+            return
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_on_commit(session):
+    if session.info.pop('rbac_changed', False) and has_app_context() \
+            and 'rbac' in current_app.extensions:
+        from . import rbac_cache
+        rbac_cache.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back_changes(session):
+    session.info.pop('rbac_changed', None)
@@ -0,0 +1,108 @@
+import base64
+import binascii
+import hashlib
+import os
+import time
+from flask import current_app
+from . import db
+from .models import RefreshToken, User
+
+
+def _digest(token):
+    # tokens are 256 random bits - fast hash is enough, no password hashing
+    if not isinstance(token, bytes):
+        token = token.encode('utf-8')
+    return hashlib.sha256(token).hexdigest()
+
+
+def issue_refresh_token(user, family_id=None):
+    '''
+    Create refresh token of the user (added to the session, committed by caller)
+
+    :param user: User
+    :param family_id: family of rotated token, new family by default
+    :return: (token, expiration in seconds) - only digest of the token is stored
+    '''
+    expiration = current_app.config['API_REFRESH_TOKEN_EXPIRATION_SECONDS']
+    token = base64.urlsafe_b64encode(os.urandom(32)).rstrip(b'=').decode('ascii')
+    now = int(time.time())
+    db.session.add(RefreshToken(
+        user_id=user.id, token_hash=_digest(token), family_id=family_id or binascii.hexlify(os.urandom(16)),
+        created_at=now, expires_at=now + expiration))
+    return token, expiration
+
+
+def rotate_refresh_token(token):
+    '''
+    Exchange refresh token for new one of the same family
+
+    Every token can be used once. Use of token that was already rotated means it was copied,
+    so the whole family (including the token issued instead of it) is revoked.
+
+    :param token: refresh token sent by client
+    :return: (User, new token, expiration in seconds) or None when the token is invalid,
+        expired, revoked or the user doesn't exist any more; (User, None, None) when the user
+        is not confirmed - the token is not rotated and stays valid
+    '''
+    now = int(time.time())
+    row = RefreshToken.query.filter_by(token_hash=_digest(token)).first()
+    if row is None or row.expires_at <= now:
+        return None
+    if row.revoked_at is not None:
+        return _reused(row)
+    user = User.query.get(row.user_id)
+    if user is None:
+        return None
+    if not user.confirmed:
+        return user, None, None
+    # conditional update - only one of concurrent requests with the same token rotates it
+    if not RefreshToken.query.filter_by(id=row.id, revoked_at=None).update(
+            {RefreshToken.revoked_at: now}, synchronize_session=False):
+        return _reused(row)
+    new_token, expiration = issue_refresh_token(user, row.family_id)
+    db.session.commit()
+    return user, new_token, expiration
+
+
+def _reused(row):
+    current_app.logger.warning('Reuse of refresh token of user %s, revoking token family', row.user_id)
+    revoke_refresh_tokens(family_id=row.family_id)
+    db.session.commit()
+    return None
+
+
+def revoke_refresh_tokens(token=None, family_id=None, user_id=None, user_ids=None):
+    '''
+    Revoke refresh token (with the rest of its family), family or all refresh tokens of user(s)
+    (committed by caller)
+
+    :return: number of revoked tokens
+    '''
+    if token is not None:
+        family_id = db.session.query(RefreshToken.family_id).filter_by(token_hash=_digest(token)).scalar()
+        if family_id is None:
+            return 0
+    query = RefreshToken.query.filter(RefreshToken.revoked_at.is_(None))
+    if family_id is not None:
+        query = query.filter(RefreshToken.family_id == family_id)
+    elif user_id is not None:
+        query = query.filter(RefreshToken.user_id == user_id)
+    elif user_ids is not None:
+        if not user_ids:
+            return 0
+        query = query.filter(RefreshToken.user_id.in_(user_ids))
+    else:
+        raise ValueError('token, family_id, user_id or user_ids is required')
+    return query.update({RefreshToken.revoked_at: int(time.time())}, synchronize_session=False)
+
+
+def purge_refresh_tokens():
+    '''
+    Delete expired refresh tokens - rotated tokens are kept until they expire to detect their reuse
+
+    :return: number of deleted tokens
+    '''
+    deleted = RefreshToken.query.filter(RefreshToken.expires_at <= int(time.time())).delete(
+        synchronize_session=False)
+    db.session.commit()
+    return deleted
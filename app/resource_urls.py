@@ -0,0 +1,135 @@
+import re
+from flask import current_app, url_for
+from .utils import get_url_adapter, split_url
+
+# API resources addressed by single integer id
+RESOURCE_ENDPOINTS = ('api_bp.get_user', 'api_bp.get_role', 'api_bp.get_permission')
+
+_ID_RE = re.compile(r'[0-9]+\Z')
+
+# id used to build URL templates with url_for - it is replaced by actual id of each object
+_TEMPLATE_ID = 918273645
+# max number of (scheme, server name, script root) combinations to keep templates for
+_MAX_TEMPLATE_SETS = 64
+
+
+class ResourceUrlResolver(object):
+    '''
+    Fast path for reversing URLs of API resources (see RESOURCE_ENDPOINTS) to (endpoint, args)
+
+    Rules of the resources are precompiled into dictionary {path prefix: endpoint},
+    so resolving URL like http://host/api/v1/role/2 is a string split and dictionary lookup
+    instead of full werkzeug route matching. Results are memoized (up to memo_size URLs),
+    URLs of other shapes are resolved by split_url.
+
+    :param url_map: werkzeug Map of the application
+    :param endpoints: endpoints to precompile
+    :param memo_size: max number of memoized URLs
+    '''
+
+    def __init__(self, url_map, endpoints=RESOURCE_ENDPOINTS, memo_size=10000):
+        self.prefixes = {}
+        for rule in url_map.iter_rules():
+            if rule.endpoint not in endpoints or rule.arguments != set(['id']):
+                continue
+            prefix, converter = rule.rule.split('<', 1)
+            if converter == 'int:id>' and ('GET' in rule.methods):
+                self.prefixes[prefix] = rule.endpoint
+        self.memo_size = memo_size
+        self.memo = {}
+
+    def resolve(self, url, server_name):
+        '''
+        :param url: absolute or relative URL
+        :param server_name: expected host (netloc) of absolute URLs
+        :return: (endpoint, args) or None if URL is not URL of precompiled resource
+        '''
+        key = (server_name, url)
+        result = self.memo.get(key)
+        if result is not None:
+            return result
+
+        if '://' in url:
+            netloc, slash, path = url.split('://', 1)[1].partition('/')
+            if netloc != server_name:
+                return None
+            path = slash + path
+        else:
+            path = url
+        prefix, slash, resource_id = path.rpartition('/')
+        endpoint = self.prefixes.get(prefix + slash)
+        if endpoint is None or not _ID_RE.match(resource_id):
+            return None
+
+        result = (endpoint, {'id': int(resource_id)})
+        if len(self.memo) >= self.memo_size:
+            self.memo.clear()
+        self.memo[key] = result
+        return result
+
+
+def _resolver():
+    resolver = current_app.extensions.get('resource_url_resolver')
+    if resolver is None:
+        resolver = ResourceUrlResolver(current_app.url_map)
+        current_app.extensions['resource_url_resolver'] = resolver
+    return resolver
+
+
+def resolve_url(url):
+    '''
+    Returns the endpoint name and arguments that match a given URL, like split_url,
+    but URLs of API resources are resolved by precompiled ResourceUrlResolver
+
+    Raises ValidationError for invalid URL
+    '''
+    result = _resolver().resolve(url, get_url_adapter().server_name)
+    if result is None:
+        return split_url(url)
+    return result
+
+
+def url_templates():
+    '''
+    External URL templates of current url adapter (scheme, server name and script root)
+
+    Each template is built with url_for only once, so URLs of many objects can be formatted
+    by plain string concatenation instead of rebuilding the route for every object
+
+    :return: dict {endpoint: (head, tail)} - URL of object is head + str(id) + tail,
+        it is populated lazily by url_template()
+    '''
+    url_adapter = get_url_adapter()
+    key = (url_adapter.url_scheme, url_adapter.server_name, url_adapter.script_name)
+    template_sets = current_app.extensions.setdefault('resource_url_templates', {})
+    templates = template_sets.get(key)
+    if templates is None:
+        if len(template_sets) >= _MAX_TEMPLATE_SETS:
+            template_sets.clear()
+        templates = template_sets[key] = {}
+    return templates
+
+
+def url_template(endpoint, templates=None):
+    '''
+    :param endpoint: endpoint with single "id" argument
+    :param templates: result of url_templates(), current templates by default
+    :return: (head, tail) of external URL of the endpoint
+    '''
+    if templates is None:
+        templates = url_templates()
+    template = templates.get(endpoint)
+    if template is None:
+        head, tail = url_for(endpoint, id=_TEMPLATE_ID, _external=True).split(str(_TEMPLATE_ID))
+        template = templates[endpoint] = (head, tail)
+    return template
+
+
+def resource_url(endpoint, id):
+    '''
+    External URL of resource, same as url_for(endpoint, id=id, _external=True)
+    '''
+    if id is None:
+        return None
+    head, tail = url_template(endpoint)
+    return head + str(id) + tail
@@ -0,0 +1,315 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, request, g, make_response
+
+
+class MemoryStore(object):
+    '''
+    In-process stand-in of the shared tier (same interface as RedisStore), used for tests
+    and single process deployments
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}  # key -> (value, expires_at)
+        self.tags = {}  # tag -> set of keys
+
+    def get(self, key):
+        item = self.values.get(key)
+        if item is None or item[1] <= time.time():
+            return None
+        return item[0]
+
+    def set(self, key, value, ttl, tags=()):
+        with self.lock:
+            self.values[key] = (value, time.time() + ttl)
+            for tag in tags:
+                self.tags.setdefault(tag, set()).add(key)
+
+    def add(self, key, value, ttl):
+        '''
+        Set the key only if it does not exist (SETNX)
+
+        :return: Boolean status - whether the key was set
+        '''
+        with self.lock:
+            if self.get(key) is not None:
+                return False
+            self.values[key] = (value, time.time() + ttl)
+            return True
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.values.pop(key, None)
+
+    def invalidate_tags(self, tags):
+        with self.lock:
+            for tag in tags:
+                for key in self.tags.pop(tag, ()):
+                    self.values.pop(key, None)
+
+
+class RedisStore(object):
+    '''
+    Shared tier in Redis, requires redis package
+    '''
+
+    def __init__(self, url):
+        import redis
+        self.redis = redis.StrictRedis.from_url(url)
+
+    def get(self, key):
+        value = self.redis.get(key)
+        return value.decode('utf-8') if value is not None else None
+
+    def set(self, key, value, ttl, tags=()):
+        ttl = int(ttl) or 1
+        pipe = self.redis.pipeline()
+        pipe.set(key, value, ex=ttl)
+        for tag in tags:
+            pipe.sadd('tag:' + tag, key)
+            # tag set lives as long as its newest entry - keys of expired entries don't pile up in it
+            pipe.expire('tag:' + tag, ttl)
+        pipe.execute()
+
+    def add(self, key, value, ttl):
+        return bool(self.redis.set(key, value, ex=int(ttl) or 1, nx=True))
+
+    def delete(self, *keys):
+        if keys:
+            self.redis.delete(*keys)
+
+    def invalidate_tags(self, tags):
+        for tag in tags:
+            keys = self.redis.smembers('tag:' + tag)
+            self.redis.delete('tag:' + tag, *keys)
+
+
+class _LocalTier(object):
+    '''
+    Per process LRU tier, entries live at most API_RESPONSE_CACHE_LOCAL_TTL seconds,
+    which bounds staleness of other processes after invalidation
+    '''
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (entry, expires_at, tags)
+
+    def get(self, key):
+        with self.lock:
+            item = self.entries.pop(key, None)
+            if item is None or item[1] <= time.time():
+                return None
+            self.entries[key] = item
+            return item[0]
+
+    def set(self, key, entry, tags):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (entry, time.time() + min(self.ttl, entry['stale_until'] - time.time()), tags)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate_tags(self, tags):
+        tags = set(tags)
+        with self.lock:
+            for key in [key for key, item in self.entries.items() if tags.intersection(item[2])]:
+                del self.entries[key]
+
+
+class _EndpointStats(object):
+    def __init__(self):
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def as_dict(self):
+        requests = self.hits + self.stale_hits + self.misses
+        return {
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'hit_ratio': float(self.hits + self.stale_hits) / requests if requests else None,
+            'saved_seconds': round(self.saved_seconds, 6)
+        }
+
+
+class _ResponseCacheState(object):
+    def __init__(self, app):
+        self.local = _LocalTier(app.config['API_RESPONSE_CACHE_LOCAL_SIZE'],
+                                app.config['API_RESPONSE_CACHE_LOCAL_TTL'])
+        self.shared = None
+        url = app.config['API_RESPONSE_CACHE_SHARED_URL']
+        if url == 'memory://':
+            self.shared = MemoryStore()
+        elif url:
+            try:
+                self.shared = RedisStore(url)
+            except ImportError:
+                app.logger.warning('redis package is not installed - response cache runs without shared tier')
+        self.stats = {}  # endpoint -> _EndpointStats
+        self.revalidating = set()
+        self.lock = threading.Lock()
+
+
+class ResponseCache(object):
+    '''
+    Two tier server side cache of API GET responses
+
+    First tier is per process LRU, second (optional) tier is shared by all the processes
+    (API_RESPONSE_CACHE_SHARED_URL - redis:// URL, or memory:// for in process stand-in).
+    Responses are keyed by endpoint, view/query arguments and authorization scope (role permissions bitset),
+    they are fresh for API_RESPONSE_CACHE_TTL seconds and then served stale for up to
+    API_RESPONSE_CACHE_STALE_TTL seconds while single request revalidates them.
+    Entries are tagged (e.g 'user:5'), write views invalidate affected tags.
+    '''
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('API_RESPONSE_CACHE_ENABLED', True)
+        app.config.setdefault('API_RESPONSE_CACHE_TTL', 60)
+        app.config.setdefault('API_RESPONSE_CACHE_STALE_TTL', 30)
+        app.config.setdefault('API_RESPONSE_CACHE_LOCAL_SIZE', 1024)
+        app.config.setdefault('API_RESPONSE_CACHE_LOCAL_TTL', 5)
+        app.config.setdefault('API_RESPONSE_CACHE_SHARED_URL', None)
+        app.extensions['response_cache'] = _ResponseCacheState(app)
+
+    def _state(self):
+        return current_app.extensions['response_cache']
+
+    @staticmethod
+    def _scope():
+        '''
+        Authorization scope of current request - responses are shared only by users with the same permissions
+        '''
+        from . import rbac_cache
+        user = g.get('current_user')
+        if user is None or user.is_anonymous:
+            return 'anonymous'
+        return str(rbac_cache.catalog().role_mask(user.rbac_role_id()))
+
+    def _key(self):
+        args = sorted(request.args.items(multi=True))
+        return 'response:{}:{}:{}:{}'.format(
+            request.endpoint, sorted((request.view_args or {}).items()), args, self._scope())
+
+    def cached(self, tags):
+        '''
+        Decorator that caches successful (200) responses of GET view
+
+        :param tags: function of view arguments that returns list of tags of the response,
+            e.g lambda id: ['user:{}'.format(id)]
+        '''
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                if not current_app.config['API_RESPONSE_CACHE_ENABLED'] or request.method != 'GET':
+                    return f(*args, **kwargs)
+                return self._get_or_compute(f, args, kwargs, tags(**kwargs))
+            return decorated_function
+        return decorator
+
+    def _get_or_compute(self, f, args, kwargs, tags):
+        state = self._state()
+        key = self._key()
+        stats = state.stats.get(request.endpoint)
+        if stats is None:
+            stats = state.stats.setdefault(request.endpoint, _EndpointStats())
+
+        entry = state.local.get(key)
+        if entry is None and state.shared is not None:
+            value = state.shared.get(key)
+            if value is not None:
+                entry = json.loads(value)
+                state.local.set(key, entry, tags)
+
+        now = time.time()
+        if entry is not None:
+            if now < entry['fresh_until']:
+                stats.hits += 1
+                stats.saved_seconds += entry['cost']
+                return self._response(entry)
+            if now < entry['stale_until'] and not self._start_revalidation(state, key):
+                # other request is revalidating - serve stale
+                stats.stale_hits += 1
+                stats.saved_seconds += entry['cost']
+                return self._response(entry)
+
+        stats.misses += 1
+        try:
+            started = time.time()
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                self._store(state, key, response, time.time() - started, tags)
+            return response
+        finally:
+            self._finish_revalidation(state, key)
+
+    @staticmethod
+    def _start_revalidation(state, key):
+        with state.lock:
+            if key in state.revalidating:
+                return False
+            state.revalidating.add(key)
+        if state.shared is not None and not state.shared.add('revalidating:' + key, '1', 10):
+            with state.lock:
+                state.revalidating.discard(key)
+            return False
+        return True
+
+    @staticmethod
+    def _finish_revalidation(state, key):
+        with state.lock:
+            if key not in state.revalidating:
+                return
+            state.revalidating.discard(key)
+        if state.shared is not None:
+            state.shared.delete('revalidating:' + key)
+
+    @staticmethod
+    def _store(state, key, response, cost, tags):
+        now = time.time()
+        ttl = current_app.config['API_RESPONSE_CACHE_TTL']
+        stale_ttl = current_app.config['API_RESPONSE_CACHE_STALE_TTL']
+        entry = {
+            'body': response.get_data(as_text=True),
+            'headers': [(name, value) for name, value in response.headers if name != 'Content-Length'],
+            'cost': cost,
+            'fresh_until': now + ttl,
+            'stale_until': now + ttl + stale_ttl
+        }
+        state.local.set(key, entry, tags)
+        if state.shared is not None:
+            state.shared.set(key, json.dumps(entry), ttl + stale_ttl, tags)
+
+    @staticmethod
+    def _response(entry):
+        response = current_app.response_class(entry['body'], headers=entry['headers'])
+        return response.make_conditional(request)
+
+    def invalidate(self, *tags):
+        '''
+        Drop all cached responses with any of the tags (local and shared tier)
+
+        :param tags: tags, e.g 'user:5'
+        '''
+        state = self._state()
+        state.local.invalidate_tags(tags)
+        if state.shared is not None:
+            state.shared.invalidate_tags(tags)
+
+    def stats(self):
+        '''
+        :return: dict {endpoint: {hits, stale_hits, misses, hit_ratio, saved_seconds}}
+        '''
+        return dict((endpoint, stats.as_dict()) for endpoint, stats in self._state().stats.items())
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+from flask import current_app
+from jinja2 import ChoiceLoader, FileSystemBytecodeCache, ModuleLoader, TemplateNotFound, TemplateSyntaxError
+
+
+def is_email_template(name):
+    return '/email/' in name
+
+
+# checksums of sources of the templates compiled to MAIL_TEMPLATES_COMPILED_DIR
+CHECKSUMS_FILE = 'checksums.json'
+
+
+def _checksum(source):
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+
+class _CompiledTemplateLoader(ModuleLoader):
+    '''
+    ModuleLoader that lets ChoiceLoader fall back to the source loaders (ModuleLoader has no sources
+    and can't list templates)
+
+    Compiled module is used only when the source of the template is the one it was compiled from,
+    otherwise (template changed since precompile() or compiled without checksum) the template
+    is loaded from source.
+    '''
+
+    def __init__(self, path, source_loader):
+        super(_CompiledTemplateLoader, self).__init__(path)
+        self.path = path
+        self.source_loader = source_loader
+
+    def get_source(self, environment, template):
+        raise TemplateNotFound(template)
+
+    def load(self, environment, name, globals=None):
+        try:
+            with open(os.path.join(self.path, CHECKSUMS_FILE)) as f:
+                checksum = json.load(f).get(name)
+        except (IOError, ValueError):
+            checksum = None
+        source = self.source_loader.get_source(environment, name)[0]
+        if checksum != _checksum(source):
+            current_app.logger.warning('Compiled template %s is outdated, loading it from source', name)
+            raise TemplateNotFound(name)
+        return super(_CompiledTemplateLoader, self).load(environment, name, globals)
+
+    def list_templates(self):
+        return []
+
+
+class TemplateCache(object):
+    '''
+    Compiled templates shared by the worker processes and kept between restarts
+
+    JINJA_BYTECODE_CACHE_DIR - compiled templates (of the app, blueprints and Flask-Bootstrap) are stored
+    in this directory, so they are compiled once - by precompile() at build time or by first worker
+    that renders them, not on first request of every worker. Cache entries are checked against
+    the template source, changed templates are compiled again.
+    MAIL_TEMPLATES_COMPILED_DIR - email templates are loaded from python modules compiled to this directory
+    by precompile(). Modules are checked against checksum of the template source stored by precompile(),
+    outdated modules are not used (templates changed after precompile() are rendered from source).
+
+    Must be initialized before any other extension uses app.jinja_env.
+    '''
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('JINJA_BYTECODE_CACHE_DIR', None)
+        app.config.setdefault('MAIL_TEMPLATES_COMPILED_DIR', None)
+        options = dict(app.jinja_options)
+        cache_dir = app.config['JINJA_BYTECODE_CACHE_DIR']
+        if cache_dir:
+            _makedirs(cache_dir)
+            options['bytecode_cache'] = FileSystemBytecodeCache(cache_dir)
+        compiled_dir = app.config['MAIL_TEMPLATES_COMPILED_DIR']
+        if compiled_dir:
+            _makedirs(compiled_dir)
+            source_loader = app.create_global_jinja_loader()
+            options['loader'] = ChoiceLoader([_CompiledTemplateLoader(compiled_dir, source_loader), source_loader])
+        # options are used when app.jinja_env is created (on first access)
+        app.jinja_options = options
+
+    def precompile(self):
+        '''
+        Compile all the templates into the bytecode cache and email templates into MAIL_TEMPLATES_COMPILED_DIR
+
+        :return: tuple (list of compiled template names, dict {template name: error})
+        '''
+        env = current_app.jinja_env
+        compiled, errors = [], {}
+        for name in env.list_templates():
+            try:
+                env.get_template(name)
+            except TemplateSyntaxError as e:
+                errors[name] = e
+            else:
+                compiled.append(name)
+        compiled_dir = current_app.config['MAIL_TEMPLATES_COMPILED_DIR']
+        if compiled_dir:
+            env.compile_templates(compiled_dir, filter_func=is_email_template, zip=None,
+                                  ignore_errors=False, py_compile=True)
+            checksums = dict((name, _checksum(env.loader.get_source(env, name)[0]))
+                             for name in env.list_templates(filter_func=is_email_template))
+            with open(os.path.join(compiled_dir, CHECKSUMS_FILE), 'w') as f:
+                json.dump(checksums, f, sort_keys=True)
+        return compiled, errors
+
+
+def _makedirs(path):
+    if not os.path.isdir(path):
+        os.makedirs(path)
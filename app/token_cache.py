@@ -0,0 +1,171 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from itertools import chain
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+
+class _TokenCacheState(object):
+    '''
+    LRU of verified tokens of single application
+    '''
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # token digest -> (claims, user snapshot, expires_at)
+        self.keys_by_user = {}  # user id -> set of token digests
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def discard(self, key):
+        claims, snapshot, expires_at = self.entries.pop(key)
+        keys = self.keys_by_user.get(snapshot.id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.keys_by_user[snapshot.id]
+
+
+class TokenCache(object):
+    '''
+    Bounded LRU cache of verified auth tokens
+
+    Holds decoded claims and detached snapshot of the user for each token, so repeated
+    requests with the same token skip both signature verification and user lookup.
+    Entries never outlive the token expiration (and API_TOKEN_CACHE_TTL_SECONDS),
+    committed updates/deletes of the user evict all the cached tokens of the user.
+    '''
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('API_TOKEN_CACHE_SIZE', 1024)
+        app.config.setdefault('API_TOKEN_CACHE_TTL_SECONDS', 60)
+        app.extensions['token_cache'] = _TokenCacheState(
+            app.config['API_TOKEN_CACHE_SIZE'], app.config['API_TOKEN_CACHE_TTL_SECONDS'])
+
+    def _state(self):
+        return current_app.extensions['token_cache']
+
+    @staticmethod
+    def _key(token):
+        if not isinstance(token, bytes):
+            token = token.encode('utf-8')
+        return hashlib.sha256(token).digest()
+
+    def get(self, token):
+        '''
+        Look up verified token
+
+        :param token: auth token as sent by client
+        :return: (claims, detached user snapshot) or None if the token is not cached
+        '''
+        state = self._state()
+        key = self._key(token)
+        with state.lock:
+            entry = state.entries.get(key)
+            if entry is not None and entry[2] <= time.time():
+                state.discard(key)
+                entry = None
+            if entry is None:
+                state.misses += 1
+                return None
+            # move to the end - most recently used
+            del state.entries[key]
+            state.entries[key] = entry
+            state.hits += 1
+        return entry[0], entry[1]
+
+    def put(self, token, claims, user, expires_at):
+        '''
+        Cache verified token
+
+        :param token: auth token as sent by client
+        :param claims: decoded token payload
+        :param user: User the token belongs to
+        :param expires_at: token expiration time (seconds since epoch)
+        '''
+        state = self._state()
+        if state.max_size <= 0:
+            return
+        key = self._key(token)
+        entry = (claims, _detached_copy(user), min(expires_at, time.time() + state.ttl))
+        with state.lock:
+            if key in state.entries:
+                state.discard(key)
+            state.entries[key] = entry
+            state.keys_by_user.setdefault(user.id, set()).add(key)
+            while len(state.entries) > state.max_size:
+                state.discard(next(iter(state.entries)))
+                state.evictions += 1
+
+    def evict_user(self, user_id):
+        '''
+        Drop all cached tokens of the user
+        '''
+        state = self._state()
+        with state.lock:
+            for key in list(state.keys_by_user.get(user_id, ())):
+                state.discard(key)
+
+    def clear(self):
+        state = self._state()
+        with state.lock:
+            state.entries.clear()
+            state.keys_by_user.clear()
+
+    def stats(self):
+        '''
+        :return: dict with hits, misses, evictions and current size of the cache
+        '''
+        state = self._state()
+        return {
+            'hits': state.hits,
+            'misses': state.misses,
+            'evictions': state.evictions,
+            'size': len(state.entries)
+        }
+
+
+def _detached_copy(obj):
+    '''
+    Copy column attributes of mapped object into new detached instance,
+    the copy can be attached to any session with session.merge(copy, load=False) without queries
+    '''
+    mapper = inspect(type(obj))
+    copy = mapper.class_manager.new_instance()
+    for column_attr in mapper.column_attrs:
+        set_committed_value(copy, column_attr.key, getattr(obj, column_attr.key))
+    make_transient_to_detached(copy)
+    return copy
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_user_changes(session, flush_context):
+    from .models import User
+    for obj in chain(session.dirty, session.deleted):
+        if isinstance(obj, User) and obj.id is not None:
+            session.info.setdefault('token_cache_evict', set()).add(obj.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _evict_on_commit(session):
+    user_ids = session.info.pop('token_cache_evict', None)
+    if user_ids and has_app_context() and 'token_cache' in current_app.extensions:
+        from . import token_cache
+        for user_id in user_ids:
+            token_cache.evict_user(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back_changes(session):
+    session.info.pop('token_cache_evict', None)
@@ -12,9 +12,9 @@ class ValidationError(ValueError):
     '''
     pass
 
-def split_url(url, method='GET'):
-    """Returns the endpoint name and arguments that match a given URL. In
-    other words, this is the reverse of Flask's url_for()."""
+def get_url_adapter():
+    """Returns URL adapter of current request, or of application context
+    if there is no request."""
     appctx = _app_ctx_stack.top
     reqctx = _request_ctx_stack.top
     if appctx is None:
@@ -23,14 +23,21 @@ def split_url(url, method='GET'):
                            'executed when application context is available.')
 
     if reqctx is not None:
-        url_adapter = reqctx.url_adapter
-    else:
-        url_adapter = appctx.url_adapter
-        if url_adapter is None:
-            raise RuntimeError('Application was not able to create a URL '
-                               'adapter for request independent URL matching. '
-                               'You might be able to fix this by setting '
-                               'the SERVER_NAME config variable.')
+        return reqctx.url_adapter
+
+    url_adapter = appctx.url_adapter
+    if url_adapter is None:
+        raise RuntimeError('Application was not able to create a URL '
+                           'adapter for request independent URL matching. '
+                           'You might be able to fix this by setting '
+                           'the SERVER_NAME config variable.')
+    return url_adapter
+
+
+def split_url(url, method='GET'):
+    """Returns the endpoint name and arguments that match a given URL. In
+    other words, this is the reverse of Flask's url_for()."""
+    url_adapter = get_url_adapter()
     parsed_url = url_parse(url)
     if parsed_url.netloc is not '' and \
             parsed_url.netloc != url_adapter.server_name:
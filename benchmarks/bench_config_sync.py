@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+"""
+Benchmark of config sync (manage.py sync_config) with many config-defined users
+
+Measures initial sync (all rows inserted, all passwords hashed), sync without changes
+(passwords only verified) and sync with 1% of passwords changed, with number of SQL statements.
+
+    python -m benchmarks.bench_config_sync
+"""
+import os
+import time
+from app import create_app, db, query_counter
+from app.config_sync import sync_config
+
+NUMBER = 2000
+
+
+def main():
+    app = create_app(os.getenv('FLASK_CONFIG') or 'default')
+    app.config['USERS'] = [
+        {'username': 'user{}'.format(i), 'email': 'user{}@example.com'.format(i), 'role': 'User',
+         'confirmed': True, 'password': 'password{}'.format(i)} for i in range(NUMBER)]
+    with app.app_context():
+        db.create_all()
+        print('{:<24} {:>10} {:>10} {:>10}'.format('sync ({} users)'.format(NUMBER), 'seconds', 'queries', 'hashed'))
+        try:
+            for name in ('initial', 'unchanged', '1% changed'):
+                if name == '1% changed':
+                    for cfg_user in app.config['USERS'][::100]:
+                        cfg_user['password'] += 'x'
+                started = time.time()
+                with query_counter.recording() as stats:
+                    plan = sync_config()
+                print('{:<24} {:>10.2f} {:>10} {:>10}'.format(
+                    name, time.time() - started, stats.count, plan.changed_passwords))
+        finally:
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
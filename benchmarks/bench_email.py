@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+Throughput benchmark of email delivery against in-process SMTP server (tests.helpers.SmtpSink)
+
+Compares thread per message with own SMTP connection (mail.send) and mail_pool
+(bounded workers with persistent connections).
+Also compares celery payload and request thread time of pickled rendered message
+and of template task (send_templated_email).
+
+    python -m benchmarks.bench_email
+"""
+import os
+import pickle
+import threading
+import time
+from flask_mail import Message
+from kombu.serialization import dumps
+from app import create_app, db, mail, mail_pool
+from app.email import render_email, _dump_context
+from app.models import User
+from tests.helpers import SmtpSink
+
+NUMBER = 500
+
+
+def messages():
+    return [Message('Message {}'.format(i), sender='admin@example.com',
+                    recipients=['user{}@example.com'.format(i)], body='Hello') for i in range(NUMBER)]
+
+
+def thread_per_message(app):
+    def send(msg):
+        with app.app_context():
+            mail.send(msg)
+
+    threads = [threading.Thread(target=send, args=[msg]) for msg in messages()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def pool(app):
+    for msg in messages():
+        mail_pool.send(msg)
+    mail_pool.wait()
+
+
+def celery_payload(app):
+    db.create_all()
+    user = User(username='john', email='john@example.com')
+    db.session.add(user)
+    db.session.commit()
+    context = {'user': user, 'token': user.generate_confirmation_token()}
+    print('{:<24} {:>12} {:>12}'.format('celery task', 'bytes', 'us/call'))
+    with app.test_request_context():
+        for name, make_payload in [
+                ('rendered message', lambda: pickle.dumps(render_email(
+                    [user.email], 'Confirm', 'auth_bp/email/confirm', **context), pickle.HIGHEST_PROTOCOL)),
+                ('template task', lambda: dumps(
+                    [user.email, 'Confirm', 'auth_bp/email/confirm', _dump_context(context), 'http://localhost/'],
+                    serializer='json')[2])]:
+            started = time.time()
+            for i in range(NUMBER):
+                payload = make_payload()
+            elapsed = time.time() - started
+            print('{:<24} {:>12} {:>12.1f}'.format(name, len(payload), elapsed / NUMBER * 1e6))
+    db.session.remove()
+    db.drop_all()
+
+
+def main():
+    app = create_app(os.getenv('FLASK_CONFIG') or 'default')
+    print('{:<24} {:>12} {:>12}'.format('delivery', 'msgs/sec', 'connections'))
+    with app.app_context():
+        for name, func in [('thread per message', thread_per_message), ('mail_pool', pool)]:
+            sink = SmtpSink()
+            sink.configure(app)
+            started = time.time()
+            func(app)
+            elapsed = time.time() - started
+            assert len(sink.messages) == NUMBER
+            print('{:<24} {:>12.1f} {:>12}'.format(name, NUMBER / elapsed, sink.connections))
+            sink.stop()
+        mail_pool.shutdown()
+        print('')
+        celery_payload(app)
+
+
+if __name__ == '__main__':
+    main()
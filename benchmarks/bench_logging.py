@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of logging cost on request thread
+
+Compares eager str.format() messages with lazy %-style arguments when the level is disabled,
+and synchronous file handler with QueueHandler. The listener is started only after the measurement,
+so the numbers are the cost paid by the request thread (listener competes for GIL, not for request time,
+as long as it keeps up with the rate of records).
+
+    python -m benchmarks.bench_logging
+"""
+import logging
+import os
+import tempfile
+import timeit
+from collections import deque
+from app.logs import QueueHandler, QueueListener, JsonFormatter
+
+NUMBER = 20000
+
+
+def make_logger(name, handler):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    del logger.handlers[:]
+    logger.addHandler(handler)
+    return logger
+
+
+def main():
+    path = tempfile.mktemp()
+    file_handler = logging.FileHandler(path)
+    file_handler.setFormatter(JsonFormatter())
+    sync_logger = make_logger('bench.sync', file_handler)
+
+    queue = deque()
+    listener = QueueListener(queue, file_handler)
+    async_logger = make_logger('bench.async', QueueHandler(queue, NUMBER * 10))
+
+    user, status = 'user@example.com', True
+    cases = [
+        ('disabled debug, eager format', lambda: sync_logger.debug('User {} status {}'.format(user, status))),
+        ('disabled debug, lazy args', lambda: sync_logger.debug('User %s status %s', user, status)),
+        ('info, synchronous file', lambda: sync_logger.info('User %s status %s', user, status)),
+        ('info, queue handler', lambda: async_logger.info('User %s status %s', user, status)),
+    ]
+    print('{:<32} {:>16}'.format('case', 'usec/record'))
+    for name, func in cases:
+        best = min(timeit.repeat(func, number=NUMBER, repeat=3))
+        print('{:<32} {:>16.2f}'.format(name, best / NUMBER * 1e6))
+    listener.start()
+    listener.stop()
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
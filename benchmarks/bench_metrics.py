@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of per request cost of request metrics
+
+Measures recording of single request into the histogram (Metrics state) and the complete
+before/after/teardown hooks run for every request.
+
+    python -m benchmarks.bench_metrics
+"""
+import os
+import timeit
+from app import create_app
+from app.metrics import _start_request, _record_response, _finish_request
+
+NUMBER = 100000
+
+
+def main():
+    app = create_app(os.getenv('FLASK_CONFIG') or 'default')
+    state = app.extensions['metrics']
+    with app.test_request_context('/api/v1/users/1'):
+        response = app.response_class('')
+        endpoint = ('api_bp', 'get_user')
+
+        def record():
+            for i in range(NUMBER):
+                state.record(endpoint, 200, 0.012, 0.003)
+
+        def hooks():
+            for i in range(NUMBER):
+                _start_request()
+                _record_response(response)
+                _finish_request(None)
+
+        def empty():
+            for i in range(NUMBER):
+                pass
+
+        baseline = min(timeit.repeat(empty, number=1, repeat=5))
+        print('{:<28} {:>16}'.format('operation', 'usec/request'))
+        for name, func in [('record', record), ('request hooks', hooks)]:
+            best = min(timeit.repeat(func, number=1, repeat=5)) - baseline
+            print('{:<28} {:>16.3f}'.format(name, best / NUMBER * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of password hashing schemes
+
+Reports hashes/sec per core for each scheme in PASSWORD_HASH_BENCHMARK_METHODS (and PASSWORD_HASH_METHOD),
+both on calling thread and through the process pool of PasswordHasher.
+
+    python -m benchmarks.bench_password_hashing [method ...]
+"""
+import multiprocessing
+import os
+import sys
+import time
+from app import create_app, password_hasher
+
+ROUNDS = 64
+
+
+def measure(app, method, pool_size):
+    app.config['PASSWORD_HASH_METHOD'] = method
+    app.config['PASSWORD_HASH_POOL_SIZE'] = pool_size
+    password_hasher.init_app(app)
+    # warm up - starts the pool
+    password_hasher.hash_many(['warmup'] * max(pool_size, 1))
+
+    started = time.time()
+    password_hasher.hash_many(['password-{}'.format(i) for i in range(ROUNDS)])
+    return ROUNDS / (time.time() - started)
+
+
+def main(methods):
+    app = create_app(os.getenv('FLASK_CONFIG') or 'default')
+    cores = multiprocessing.cpu_count()
+    methods = methods or sorted(set(
+        app.config['PASSWORD_HASH_BENCHMARK_METHODS'] + [app.config['PASSWORD_HASH_METHOD']]))
+
+    with app.app_context():
+        print('{:<28} {:>16} {:>16} {:>16}'.format(
+            'method', 'inline h/s', 'pool h/s', 'pool h/s/core'))
+        for method in methods:
+            inline = measure(app, method, 0)
+            pooled = measure(app, method, cores)
+            print('{:<28} {:>16.1f} {:>16.1f} {:>16.1f}'.format(method, inline, pooled, pooled / cores))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+Benchmark of GET requests of the API with and without read-only request mode
+
+Every request runs in its own application context (like in production), so without read-only mode
+SQLALCHEMY_COMMIT_ON_TEARDOWN flushes and commits after every GET. Reports time per request and
+transaction commits/rollbacks per request (with SQLALCHEMY_READ_ONLY_ISOLATION_LEVEL AUTOCOMMIT,
+e.g on PostgreSQL, BEGIN of the read-only requests is saved too).
+
+    python -m benchmarks.bench_read_only
+"""
+import os
+import time
+from collections import Counter
+from sqlalchemy import event
+from app import create_app, db
+from app.models import User, Role
+from config import config
+
+NUMBER = 1000
+
+
+def run(config_name, read_only_methods):
+    config_class = config[config_name]
+    config_class.SQLALCHEMY_READ_ONLY_METHODS = read_only_methods
+    config_class.API_RESPONSE_CACHE_ENABLED = False
+    config_class.SQL_QUERY_STATS_ENABLED = config_class.METRICS_ENABLED = False
+    app = create_app(config_name)
+    with app.app_context():
+        db.create_all()
+        Role.insert_cfg_roles()
+        user = User(username='bench', email='bench@example.com', password='cat', confirmed=True)
+        db.session.add(user)
+        db.session.commit()
+        url = '/api/v1/users/{}'.format(user.id)
+        token = user.generate_auth_token(expiration=3600)
+        engine = db.engine
+
+    client = app.test_client()
+    headers = {'Authorization': 'Basic ' + '{}:'.format(token).encode('base64').replace('\n', '')}
+    events = Counter()
+
+    def count(name):
+        def listener(*args):
+            events[name] += 1
+        return listener
+
+    listeners = [(name, count(name)) for name in ('commit', 'rollback')]
+    for name, listener in listeners:
+        event.listen(engine, name, listener)
+    try:
+        client.get(url, headers=headers)  # warm up
+        events.clear()
+        started = time.time()
+        for i in range(NUMBER):
+            assert client.get(url, headers=headers).status_code == 200
+        elapsed = time.time() - started
+    finally:
+        for name, listener in listeners:
+            event.remove(engine, name, listener)
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+    return elapsed / NUMBER * 1e3, float(events['commit']) / NUMBER, float(events['rollback']) / NUMBER
+
+
+def main():
+    config_name = os.getenv('FLASK_CONFIG') or 'default'
+    print('{:<24} {:>12} {:>16} {:>16}'.format('GET /users/<id>', 'ms/request', 'commits/request',
+                                               'rollbacks/request'))
+    for name, methods in (('read-write', []), ('read-only', ['GET', 'HEAD', 'OPTIONS'])):
+        print('{:<24} {:>12.3f} {:>16.2f} {:>16.2f}'.format(name, *run(config_name, methods)))
+
+
+if __name__ == '__main__':
+    main()
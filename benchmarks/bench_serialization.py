@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of user serialization
+
+Compares per object cost of building resource URLs with url_for (previous implementation)
+against precompiled URL templates (User.export_to_dict) and batch serialization (User.export_many).
+
+    python -m benchmarks.bench_serialization
+"""
+import os
+import timeit
+from flask import url_for
+from app import create_app
+from app.models import User, Role
+
+NUMBER = 5000
+
+
+def export_with_url_for(user):
+    return {
+        'id': user.id,
+        'self_url': url_for('api_bp.get_user', id=user.id, _external=True),
+        'username': user.username,
+        'email': user.email,
+        'confirmed': user.confirmed,
+        'role': url_for('api_bp.get_role', id=user.role.id, _external=True)
+    }
+
+
+def main():
+    app = create_app(os.getenv('FLASK_CONFIG') or 'default')
+    with app.test_request_context():
+        roles = [Role(id=i, name='role{}'.format(i)) for i in range(1, 4)]
+        users = [User(id=i, username='user{}'.format(i), email='user{}@example.com'.format(i),
+                      role=roles[i % 3], confirmed=True) for i in range(NUMBER)]
+        assert [export_with_url_for(u) for u in users[:10]] == User.export_many(users[:10])
+
+        cases = [
+            ('url_for per object', lambda: [export_with_url_for(u) for u in users]),
+            ('export_to_dict', lambda: [u.export_to_dict() for u in users]),
+            ('export_many', lambda: User.export_many(users)),
+        ]
+        print('{:<28} {:>16}'.format('serializer', 'usec/object'))
+        for name, func in cases:
+            best = min(timeit.repeat(func, number=1, repeat=5))
+            print('{:<28} {:>16.2f}'.format(name, best / NUMBER * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Startup profile - import time of the app package (with breakdown by module) and create_app time
+
+Import hook measures every import statement (python 2 has no -X importtime), times are cumulative
+(including nested imports) and self (without them). Must run in new interpreter - modules imported
+before the hook is installed are not measured.
+
+    python -m benchmarks.bench_startup [--top 25] [--max-ms 500]
+
+With --max-ms exits with status 1 when import + create_app takes longer (regression guard for CI).
+"""
+import __builtin__
+import argparse
+import os
+import sys
+import time
+
+_original_import = __builtin__.__import__
+_stack = []
+_timings = {}  # module name -> [cumulative, self]
+
+
+def _module_name(name, globals, level):
+    '''
+    Absolute name of imported module (resolves explicit and implicit relative imports)
+    '''
+    if level == 0 or not globals or '__name__' not in globals:
+        return name
+    package = globals['__name__'] if '__path__' in globals else globals['__name__'].rpartition('.')[0]
+    if level > 0:
+        package = package.rsplit('.', level - 1)[0] if level > 1 else package
+        return '{}.{}'.format(package, name) if name else package
+    relative = '{}.{}'.format(package, name)
+    return relative if package and sys.modules.get(relative) is not None else name
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=None, level=-1):
+    if name in sys.modules:
+        return _original_import(name, globals, locals, fromlist, level)
+    started = time.time()
+    _stack.append(0.0)
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        nested = _stack.pop()
+        elapsed = time.time() - started
+        if _stack:
+            _stack[-1] += elapsed
+        timing = _timings.setdefault(_module_name(name, globals, level), [0.0, 0.0])
+        timing[0] += elapsed
+        timing[1] += elapsed - nested
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--top', type=int, default=25)
+    parser.add_argument('--max-ms', type=float)
+    args = parser.parse_args()
+    config_name = os.getenv('FLASK_CONFIG') or 'default'
+
+    __builtin__.__import__ = _timed_import
+    started = time.time()
+    import app
+    imported = time.time()
+    __builtin__.__import__ = _original_import
+    app.create_app(config_name)
+    created = time.time()
+
+    print('{:<48} {:>10} {:>10}'.format('import', 'cumul ms', 'self ms'))
+    for name, (cumulative, self_time) in sorted(_timings.items(), key=lambda item: -item[1][0])[:args.top]:
+        print('{:<48} {:>10.1f} {:>10.1f}'.format(name[:48], cumulative * 1e3, self_time * 1e3))
+    total_ms = (created - started) * 1e3
+    print('')
+    print('import app   {:>8.1f} ms'.format((imported - started) * 1e3))
+    print('create_app   {:>8.1f} ms'.format((created - imported) * 1e3))
+    print('total        {:>8.1f} ms'.format(total_ms))
+    if args.max_ms is not None and total_ms > args.max_ms:
+        print('Startup takes {:.1f} ms, more than {:.1f} ms'.format(total_ms, args.max_ms))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""
+Cold start cost of templates in new worker (new application, empty jinja_env)
+
+Measures loading of all the templates (what first requests of the worker pay) and first rendered
+confirmation email, without cache, with JINJA_BYTECODE_CACHE_DIR and with email templates
+compiled to MAIL_TEMPLATES_COMPILED_DIR (both filled by template_cache.precompile()).
+
+    python -m benchmarks.bench_templates
+"""
+import os
+import shutil
+import tempfile
+import timeit
+from app import create_app, template_cache
+from app.email import render_email
+from config import config
+
+REPEAT = 5
+
+
+def make_app(config_name, cache_dir, compiled_dir):
+    config_class = config[config_name]
+    config_class.JINJA_BYTECODE_CACHE_DIR = cache_dir
+    config_class.MAIL_TEMPLATES_COMPILED_DIR = compiled_dir
+    return create_app(config_name)
+
+
+def main():
+    config_name = os.getenv('FLASK_CONFIG') or 'default'
+    cache_dir, compiled_dir = tempfile.mkdtemp(), tempfile.mkdtemp()
+    try:
+        app = make_app(config_name, cache_dir, compiled_dir)
+        with app.app_context():
+            names = template_cache.precompile()[0]
+
+        def load_templates(app):
+            for name in names:
+                app.jinja_env.get_template(name)
+
+        def render_first_email(app):
+            with app.test_request_context():
+                render_email(['john@example.com'], 'Confirm', 'auth_bp/email/confirm',
+                             user={'username': 'john'}, token='token')
+
+        print('{:<24} {:>18} {:>18}'.format('templates', 'all templates ms', 'first email ms'))
+        for name, dirs in [('source', (None, None)),
+                           ('bytecode cache', (cache_dir, None)),
+                           ('compiled emails', (cache_dir, compiled_dir))]:
+            results = []
+            for func in (load_templates, render_first_email):
+                # every run gets new application - nothing is compiled in its jinja_env yet
+                apps = [make_app(config_name, *dirs) for i in range(REPEAT)]
+                results.append(min(timeit.repeat(lambda: func(apps.pop()), number=1, repeat=REPEAT)))
+            print('{:<24} {:>18.2f} {:>18.2f}'.format(name, results[0] * 1e3, results[1] * 1e3))
+    finally:
+        shutil.rmtree(cache_dir)
+        shutil.rmtree(compiled_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""
+Renewal of expired access token - GET /get_token with password against POST /refresh_token
+
+Password is hashed by PASSWORD_HASH_METHOD of the config (production strength by default),
+refresh token is checked by SHA-256 digest lookup and rotated.
+
+    python -m benchmarks.bench_token_renewal
+"""
+import json
+import os
+import time
+from base64 import b64encode
+from app import create_app, db
+from app.models import User, Role
+from config import config
+
+NUMBER = 50
+
+
+def main():
+    config_name = os.getenv('FLASK_CONFIG') or 'default'
+    config_class = config[config_name]
+    config_class.PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD') or config['production'].PASSWORD_HASH_METHOD
+    config_class.PASSWORD_HASH_POOL_SIZE = 0
+    config_class.API_RESPONSE_CACHE_ENABLED = False
+    config_class.SQL_QUERY_STATS_ENABLED = config_class.METRICS_ENABLED = False
+    app = create_app(config_name)
+    with app.app_context():
+        db.create_all()
+        Role.insert_cfg_roles()
+        db.session.add(User(username='bench', email='bench@example.com', password='cat', confirmed=True))
+        db.session.commit()
+
+    client = app.test_client()
+    headers = {'Authorization': 'Basic ' + b64encode('bench@example.com:cat')}
+    try:
+        started = time.time()
+        for i in range(NUMBER):
+            response = client.get('/api/v1/get_token', headers=headers)
+            assert response.status_code == 200
+        password_ms = (time.time() - started) / NUMBER * 1e3
+
+        refresh_token = json.loads(response.data.decode('utf-8'))['refresh_token']
+        started = time.time()
+        for i in range(NUMBER):
+            response = client.post('/api/v1/refresh_token', data=json.dumps({'refresh_token': refresh_token}),
+                                   content_type='application/json')
+            assert response.status_code == 200
+            refresh_token = json.loads(response.data.decode('utf-8'))['refresh_token']
+        refresh_ms = (time.time() - started) / NUMBER * 1e3
+    finally:
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+    print('password hash method: {}'.format(config_class.PASSWORD_HASH_METHOD))
+    print('{:<24} {:>12}'.format('renewal', 'ms/request'))
+    print('{:<24} {:>12.3f}'.format('GET /get_token', password_ms))
+    print('{:<24} {:>12.3f}'.format('POST /refresh_token', refresh_ms))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+Access tokens - size and verification cost of signed {'id': ...} tokens (User.generate_auth_token)
+against claims tokens (claims_tokens.issue)
+
+Verification of the old token is signature check only, authorization needs the user loaded
+as well (token cache disabled), claims token is authorized from its claims.
+
+    python -m benchmarks.bench_tokens
+"""
+import os
+import timeit
+from itsdangerous import TimedJSONWebSignatureSerializer
+from flask import current_app
+from app import create_app, db, claims_tokens, token_cache
+from app.models import User, Role
+
+NUMBER = 2000
+
+
+def main():
+    app = create_app(os.getenv('FLASK_CONFIG') or 'default')
+    with app.app_context():
+        db.create_all()
+        try:
+            Role.insert_cfg_roles()
+            user = User(username='bench', email='bench@example.com', confirmed=True,
+                        role=Role.query.filter_by(name='Admin').one())
+            db.session.add(user)
+            db.session.commit()
+            signed_token = user.generate_auth_token(expiration=3600)
+            claims_token = claims_tokens.issue(user, 3600)
+            serializer = TimedJSONWebSignatureSerializer(current_app.config['SECRET_KEY'])
+            claims_tokens.verify(claims_token)  # loads revocations
+
+            def authorize_signed():
+                token_cache.clear()
+                db.session.expunge_all()
+                assert User.verify_auth_token(signed_token).can(['admin'])
+
+            cases = [
+                ('signed {id}', signed_token, lambda: serializer.loads(signed_token), authorize_signed),
+                ('claims', claims_token, lambda: claims_tokens.verify(claims_token),
+                 lambda: claims_tokens.verify(claims_token).can(['admin'])),
+            ]
+            print('{:<16} {:>12} {:>16} {:>18}'.format('token', 'size bytes', 'verify usec', 'authorize usec'))
+            for name, token, verify, authorize in cases:
+                results = [min(timeit.repeat(func, number=NUMBER, repeat=3)) / NUMBER * 1e6
+                           for func in (verify, authorize)]
+                print('{:<16} {:>12} {:>16.1f} {:>18.1f}'.format(name, len(token), *results))
+        finally:
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
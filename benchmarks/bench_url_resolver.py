@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of resolving role URLs (as done by User.import_from_dict and bulk imports)
+
+Compares werkzeug route matching (split_url) with precompiled ResourceUrlResolver,
+both with distinct URLs (cold memo) and repeated URLs (warm memo).
+
+    python -m benchmarks.bench_url_resolver
+"""
+import os
+import timeit
+from app import create_app
+from app.resource_urls import ResourceUrlResolver, resolve_url
+from app.utils import split_url
+
+NUMBER = 20000
+
+
+def main():
+    app = create_app(os.getenv('FLASK_CONFIG') or 'default')
+    with app.test_request_context():
+        urls = ['http://localhost/api/v1/role/{}'.format(i) for i in range(NUMBER)]
+        # results must be identical
+        assert [resolve_url(url) for url in urls[:100]] == [split_url(url) for url in urls[:100]]
+
+        def cold():
+            app.extensions['resource_url_resolver'] = ResourceUrlResolver(app.url_map)
+            for url in urls:
+                resolve_url(url)
+
+        cases = [
+            ('split_url', lambda: [split_url(url) for url in urls]),
+            ('resolve_url (cold memo)', cold),
+            ('resolve_url (warm memo)', lambda: [resolve_url(url) for url in urls]),
+        ]
+        print('{:<28} {:>16}'.format('resolver', 'usec/url'))
+        for name, func in cases:
+            best = min(timeit.repeat(func, number=1, repeat=5))
+            print('{:<28} {:>16.2f}'.format(name, best / NUMBER * 1e6))
+
+
+if __name__ == '__main__':
+    main()
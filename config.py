@@ -36,15 +36,86 @@ class Config(object):
     USERS = []
     CELERY_BROKER_URL = 'redis://10.0.99.10:6379/0'
     CELERY_RESULT_BACKEND = 'redis://10.0.99.10:6379/0'
+    # unreachable broker fails fast (and emails go to the outbox) instead of blocking the request
+    BROKER_TRANSPORT_OPTIONS = {'socket_connect_timeout': 2}
+    CELERYBEAT_SCHEDULE = {
+        'drain-outbox': {'task': 'app.email.drain_outbox', 'schedule': 60.0}
+    }
 
     API_TOKEN_EXPIRATION_SECONDS = 3600
+    API_REFRESH_TOKEN_EXPIRATION_SECONDS = 30 * 24 * 3600
+    API_TOKEN_CACHE_SIZE = 1024
+    API_TOKEN_CACHE_TTL_SECONDS = 60
+    # revocations of claims tokens are reloaded by every process after this time
+    API_TOKEN_REVOCATION_REFRESH_SECONDS = 5
+    API_TOKEN_REVOCATION_BLOOM_BITS = 1 << 16  # 0.5% false positives with 5000 revocations (4 hashes)
+    API_TOKEN_REVOCATION_BLOOM_HASHES = 4
     API_USERS_PER_PAGE = 5
+    API_MAX_PER_PAGE = 100
+    API_EXPORT_BATCH_SIZE = 1000
+    API_BATCH_MAX_ITEMS = 50000
+    API_BATCH_CHUNK_SIZE = 1000
+    RBAC_CACHE_TTL_SECONDS = 60
+    API_RESPONSE_CACHE_ENABLED = True
+    API_RESPONSE_CACHE_TTL = 60
+    API_RESPONSE_CACHE_STALE_TTL = 30
+    API_RESPONSE_CACHE_LOCAL_SIZE = 1024
+    API_RESPONSE_CACHE_LOCAL_TTL = 5
+    # shared tier - redis:// URL (own DB, not the one of CELERY_BROKER_URL), memory:// or None for local tier only
+    API_RESPONSE_CACHE_SHARED_URL = None
+    # SQLALCHEMY_BINDS keys of read replicas - GET requests of these blueprints read from replica
+    SQLALCHEMY_READ_REPLICAS = []
+    SQLALCHEMY_READ_REPLICA_BLUEPRINTS = ['api_bp', 'main_bp']
+    # requests with these methods don't flush nor commit (see app/db_routing.py ReadOnlyRequests)
+    SQLALCHEMY_READ_ONLY_METHODS = ['GET', 'HEAD', 'OPTIONS']
+    # e.g AUTOCOMMIT (PostgreSQL, MySQL) - reads of read-only requests without BEGIN/COMMIT
+    SQLALCHEMY_READ_ONLY_ISOLATION_LEVEL = None
+    SQL_QUERY_STATS_ENABLED = False
+    SQL_QUERY_STATS_HEADERS = False
+    SQL_QUERY_STATS_DUPLICATES_WARNING = 3
+    METRICS_ENABLED = True
+    # directory shared by worker processes (e.g of gunicorn/uwsgi), None for single process
+    METRICS_MULTIPROC_DIR = os.environ.get('METRICS_MULTIPROC_DIR')
+    METRICS_FLUSH_INTERVAL = 5
+    LOG_ASYNC = True
+    LOG_LEVEL = None  # DEBUG in debug mode, INFO otherwise
+    LOG_JSON = False
+    # {logger name: fraction of DEBUG/INFO records to keep}, e.g {'app.api_v1_bp.authentication_views': 0.01}
+    LOG_SAMPLING_RATES = {}
+    LOG_QUEUE_SIZE = 10000
+    MAIL_POOL_WORKERS = 2
+    MAIL_POOL_QUEUE_SIZE = 1000
+    MAIL_POOL_BATCH_SIZE = 50
+    MAIL_POOL_ENQUEUE_TIMEOUT = 5  # seconds send_email waits for free space in full queue
+    MAIL_POOL_MAX_RETRIES = 3
+    MAIL_POOL_RETRY_BACKOFF = 1.0  # seconds, doubled after every retry
+    MAIL_POOL_IDLE_TIMEOUT = 30  # seconds before idle worker closes its SMTP connection
+    MAIL_POOL_SHUTDOWN_TIMEOUT = 10  # seconds to deliver queued messages on exit
+    MAIL_OUTBOX_DIR = os.path.join(basedir, 'tmp', 'outbox')  # local spool of emails, drained by drain_outbox
+    MAIL_OUTBOX_FSYNC = True
+    MAIL_OUTBOX_DRAIN_BATCH = 100  # emails sent over one SMTP connection
+    MAIL_OUTBOX_FALLBACK = True  # spool celery emails when the broker is unavailable
+    MAIL_OUTBOX_BROKER_RETRY_SECONDS = 30  # after broker failure emails are spooled without trying it
+    # compiled templates shared by all workers, filled by manage.py precompile_templates or on first use
+    JINJA_BYTECODE_CACHE_DIR = os.path.join(basedir, 'tmp', 'jinja_cache')
+    # email templates compiled to python modules by manage.py precompile_templates, None renders from source
+    MAIL_TEMPLATES_COMPILED_DIR = None
+
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:50000'
+    PASSWORD_HASH_SALT_LENGTH = 8
+    PASSWORD_HASH_POOL_SIZE = None  # None - process per CPU, 0 - hash on request thread
+    PASSWORD_HASH_MAX_PENDING = 64
+    PASSWORD_HASH_TIMEOUT_SECONDS = 30
+    # schemes reported by benchmarks/bench_password_hashing.py
+    PASSWORD_HASH_BENCHMARK_METHODS = ['pbkdf2:sha1:1000', 'pbkdf2:sha256:50000', 'pbkdf2:sha256:100000']
     @staticmethod
     def init_app(app):
         pass
 
 class DevelopmentConfig(Config):
     DEBUG = True
+    SQL_QUERY_STATS_ENABLED = True
+    SQL_QUERY_STATS_HEADERS = True
     MAIL_SERVER = 'smtp.googlemail.com'
     MAIL_PORT = 587
     MAIL_USE_TLS = True
@@ -75,12 +146,28 @@ class DevelopmentConfig(Config):
 class TestingConfig(Config):
     TESTING = True  # Disable the error catching during request handling so that you get better error reports when performing test requests against the application.
     DEBUG = False
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+    PASSWORD_HASH_POOL_SIZE = 0
+    API_RESPONSE_CACHE_ENABLED = False
+    LOG_ASYNC = False
+    JINJA_BYTECODE_CACHE_DIR = None
+    SQL_QUERY_STATS_ENABLED = True
+    SQL_QUERY_STATS_HEADERS = True
 
     SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or \
                               'sqlite:///' + os.path.join(basedir, 'data-test.sqlite')
 class ProductionConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
             'sqlite:///' + os.path.join(basedir, 'data.sqlite')
+    # space separated URLs of read replicas
+    SQLALCHEMY_BINDS = dict(('replica{}'.format(i), url) for i, url in
+                            enumerate(os.environ.get('DATABASE_REPLICA_URLS', '').split(), 1))
+    SQLALCHEMY_READ_REPLICAS = sorted(SQLALCHEMY_BINDS)
+    # DB 0 is the celery queue
+    API_RESPONSE_CACHE_SHARED_URL = os.environ.get('API_RESPONSE_CACHE_URL') or 'redis://10.0.99.10:6379/1'
+    LOG_JSON = True
+    # rebuilt by manage.py precompile_templates on deploy, templates changed since then are rendered from source
+    MAIL_TEMPLATES_COMPILED_DIR = os.path.join(basedir, 'tmp', 'email_templates')
 
 config = {
     'development': DevelopmentConfig,
@@ -1,14 +1,13 @@
 
 #!/usr/bin/env python
 import os
+import sys
 from app import create_app, db
 from app.models import User, Role, Permission
 from flask_script import Manager, Shell
-from flask_migrate import Migrate, MigrateCommand
 
 app = create_app(os.getenv('FLASK_CONFIG') or 'default')
 manager = Manager(app)
-migrate = Migrate(app, db)
 
 COV = None
 if os.environ.get('FLASK_COVERAGE'):
@@ -43,7 +42,6 @@ def test(coverage=False):
     # .In the second run, the top of the script finds that the
     # environment variable is set and turns  on coverage from the start.
     if coverage and not os.environ.get('FLASK_COVERAGE'):
-        import sys
         os.environ['FLASK_COVERAGE'] = '1'
         os.execvp(sys.executable, [sys.executable] + sys.argv)
     import unittest
@@ -61,14 +59,102 @@ def test(coverage=False):
         COV.erase()
 
 
+@manager.command
+def drain_outbox():
+    """
+    Sends emails spooled to the outbox (MAIL_OUTBOX_DIR) - e.g from cron, when celery beat is not used
+    """
+    from app.email import drain_outbox as drain
+    print('Sent {} emails'.format(drain()))
+
+
+@manager.command
+def purge_revoked_tokens():
+    """
+    Deletes revocations of access tokens that are expired anyway and expired refresh tokens - e.g daily from cron
+    """
+    from app import claims_tokens
+    from app.refresh_tokens import purge_refresh_tokens
+    print('Deleted {} revocations'.format(claims_tokens.purge()))
+    print('Deleted {} refresh tokens'.format(purge_refresh_tokens()))
+
+
+@manager.command
+def precompile_templates():
+    """
+    Compiles all the templates into JINJA_BYTECODE_CACHE_DIR (and email templates into
+    MAIL_TEMPLATES_COMPILED_DIR) - run at build/deploy time, so workers don't compile them on first requests
+    """
+    from app import template_cache
+    compiled, errors = template_cache.precompile()
+    for name, error in sorted(errors.items()):
+        print('{}: {}'.format(name, error))
+    print('Compiled {} templates, {} errors'.format(len(compiled), len(errors)))
+
+
+@manager.option('path', help='CSV (with header) or JSONL file with username, email, password, role, confirmed')
+@manager.option('--format', dest='file_format', choices=['csv', 'jsonl'], help='file format (by extension by default)')
+@manager.option('--offset', dest='offset', type=int, default=0, help='skip rows imported by interrupted import')
+@manager.option('--chunk-size', dest='chunk_size', type=int, default=1000, help='rows per transaction')
+def import_users(path, file_format, offset, chunk_size):
+    """
+    Import users from CSV/JSONL file in bulk transactions (passwords are hashed by PASSWORD_HASH_POOL_SIZE processes)
+    """
+    from app.bulk import import_users as import_rows, read_user_rows
+
+    def report(stats):
+        print('{offset} rows: {imported} imported, {skipped} skipped, {rows_per_second} rows/sec'.format(**stats))
+
+    stats = import_rows(read_user_rows(path, file_format), chunk_size=chunk_size, offset=offset, progress=report)
+    if stats['error']:
+        print('Stopped: {error} (resume from --offset {offset})'.format(**stats))
+        sys.exit(1)
+    print('Done: {imported} imported, {skipped} skipped, {rows_per_second} rows/sec '
+          '(resume from --offset {offset})'.format(**stats))
+
+
+@manager.option('--dry-run', dest='dry_run', action='store_true', help='only show the changes')
+def sync_config(dry_run):
+    """
+    Sync PERMISSIONS, ROLES and USERS of the config to the database (bulk, single transaction)
+    """
+    from app.config_sync import sync_config as sync, ConfigSyncError
+    try:
+        plan = sync(dry_run=dry_run)
+    except ConfigSyncError as e:
+        print('Invalid config: {}'.format(e))
+        sys.exit(1)
+    print(plan.report() or 'No changes')
+    print('{} passwords {}, {} unchanged'.format(
+        plan.changed_passwords, 'to hash' if dry_run else 'hashed', plan.unchanged_passwords))
+
+
+@manager.option('--top', dest='top', type=int, default=25, help='number of slowest imports to show')
+@manager.option('--max-ms', dest='max_ms', type=float, help='fail when startup takes longer')
+def startup_profile(top, max_ms):
+    """
+    Reports import time of the app package (by module) and create_app time, measured in new interpreter
+    (see benchmarks/bench_startup.py)
+    """
+    import subprocess
+    command = [sys.executable, '-m', 'benchmarks.bench_startup', '--top', str(top)]
+    if max_ms is not None:
+        command += ['--max-ms', str(max_ms)]
+    sys.exit(subprocess.call(command, cwd=os.path.dirname(os.path.abspath(__file__))))
+
+
 def make_shell_context():
     return dict(app=app, db=db, User=User, Role=Role, Permission=Permission)
 
 manager.add_command(
     "shell", Shell(make_context=make_shell_context))
 
-manager.add_command(
-    'db', MigrateCommand)
+# flask_migrate (alembic) takes longer to import than the whole app - only for db command (and help)
+if sys.argv[1:2] in ([], ['db'], ['-?'], ['--help']):
+    from flask_migrate import Migrate, MigrateCommand
+    migrate = Migrate(app, db)
+    manager.add_command(
+        'db', MigrateCommand)
 
 if __name__ == '__main__':
     manager.run()
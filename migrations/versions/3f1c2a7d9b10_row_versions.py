@@ -0,0 +1,28 @@
+"""Row versions of users, roles and permissions
+
+Revision ID: 3f1c2a7d9b10
+Revises: ebdd953eca23
+Create Date: 2026-10-18 10:12:41.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a7d9b10'
+down_revision = 'ebdd953eca23'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('permissions', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('roles', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('users', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    op.drop_column('users', 'version')
+    op.drop_column('roles', 'version')
+    op.drop_column('permissions', 'version')
@@ -0,0 +1,37 @@
+"""Revoked access tokens
+
+Revision ID: 8c4e1f2b7a31
+Revises: 3f1c2a7d9b10
+Create Date: 2026-10-18 16:40:12.503117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4e1f2b7a31'
+down_revision = '3f1c2a7d9b10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('revoked_tokens',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('token_id', sa.String(length=16), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('revoked_at', sa.BigInteger(), nullable=False),
+    sa.Column('expires_at', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_revoked_tokens_expires_at'), 'revoked_tokens', ['expires_at'], unique=False)
+    op.create_index(op.f('ix_revoked_tokens_token_id'), 'revoked_tokens', ['token_id'], unique=False)
+    op.create_index(op.f('ix_revoked_tokens_user_id'), 'revoked_tokens', ['user_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_revoked_tokens_user_id'), table_name='revoked_tokens')
+    op.drop_index(op.f('ix_revoked_tokens_token_id'), table_name='revoked_tokens')
+    op.drop_index(op.f('ix_revoked_tokens_expires_at'), table_name='revoked_tokens')
+    op.drop_table('revoked_tokens')
@@ -0,0 +1,108 @@
+import SocketServer
+import threading
+from contextlib import contextmanager
+from app import query_counter
+
+
+class QueryBudgetMixin(object):
+    '''
+    unittest.TestCase mixin to pin number of SQL statements of code under test
+    '''
+
+    @contextmanager
+    def assertMaxQueries(self, max_queries):
+        '''
+        Fail when the block executes more than max_queries SQL statements, e.g:
+
+            with self.assertMaxQueries(3):
+                self.client.get('/api/v1/users/1', headers=headers)
+        '''
+        with query_counter.recording() as stats:
+            yield stats
+        self.assertLessEqual(
+            stats.count, max_queries,
+            '{} queries executed, expected at most {}:\n{}'.format(stats.count, max_queries, stats.report()))
+
+
+class _SmtpHandler(SocketServer.StreamRequestHandler):
+    '''
+    Minimal SMTP dialog - accepts everything, keeps the messages in the server
+    '''
+
+    def reply(self, line):
+        self.wfile.write(line + '\r\n')
+        self.wfile.flush()
+
+    def handle(self):
+        sink = self.server.sink
+        with sink.lock:
+            sink.connections += 1
+        self.reply('220 localhost SMTP sink')
+        mailfrom, rcpttos = None, []
+        for line in iter(self.rfile.readline, ''):
+            command = line.strip().split(' ', 1)[0].upper()
+            if command in ('HELO', 'EHLO'):
+                self.reply('250 localhost')
+            elif command == 'MAIL':
+                mailfrom, rcpttos = line.strip()[10:], []
+                self.reply('250 OK')
+            elif command == 'RCPT':
+                rcpttos.append(line.strip()[8:])
+                self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = ''.join(iter(self.rfile.readline, '.\r\n'))
+                with sink.lock:
+                    rejected = sink.fail_first > 0
+                    if rejected:
+                        sink.fail_first -= 1
+                    else:
+                        sink.messages.append((mailfrom, rcpttos, data))
+                self.reply('451 Try again later' if rejected else '250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+class _SmtpServer(SocketServer.ThreadingTCPServer):
+    daemon_threads = True
+    # connections opened at once by many sending threads must not overflow listen backlog
+    request_queue_size = 1024
+
+
+class SmtpSink(object):
+    '''
+    In-process SMTP server (thread per connection) that keeps received messages
+
+    :param fail_first: number of messages to reject with temporary error (451) before accepting
+    '''
+
+    def __init__(self, fail_first=0):
+        self.fail_first = fail_first
+        self.messages = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        self.server = _SmtpServer(('127.0.0.1', 0), _SmtpHandler)
+        self.server.sink = self
+        self.port = self.server.server_address[1]
+        self._thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05})
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()
+
+    def configure(self, app):
+        '''
+        Point Flask-Mail of the app to this server
+        '''
+        state = app.extensions['mail']
+        state.server = '127.0.0.1'
+        state.port = self.port
+        state.use_tls = state.use_ssl = False
+        state.username = state.password = None
+        state.suppress = False
@@ -0,0 +1,209 @@
+import unittest
+import json
+from base64 import b64encode
+from app import create_app, db, response_cache
+from app.models import User, Role, Permission
+from helpers import QueryBudgetMixin
+
+
+class UsersApiTestCase(QueryBudgetMixin, unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_cfg_roles()
+        self.admin = User(username='admin', email='admin@example.com', password='cat', confirmed=True,
+                          role=Role.query.filter_by(name='Admin').one())
+        db.session.add(self.admin)
+        for i in range(11):
+            db.session.add(User(username='user{}'.format(i), email='user{}@example.com'.format(i)))
+        db.session.commit()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get_api_headers(self, email='admin@example.com', password='cat'):
+        return {
+            'Authorization': 'Basic ' + b64encode('{}:{}'.format(email, password)),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+
+    def get_json(self, url):
+        response = self.client.get(url, headers=self.get_api_headers())
+        self.assertEqual(response.status_code, 200)
+        return response, json.loads(response.data.decode('utf-8'))
+
+    def test_users_are_paginated(self):
+        response, page = self.get_json('/api/v1/users/?limit=5')
+        self.assertEqual(len(page['customers']), 5)
+        self.assertIsNone(page['prev'])
+        self.assertIn('rel="next"', response.headers['Link'])
+
+        urls = list(page['customers'])
+        while page['next']:
+            response, page = self.get_json(page['next'])
+            urls.extend(page['customers'])
+        self.assertEqual(len(urls), User.query.count())
+        self.assertEqual(len(set(urls)), len(urls))
+
+        response, prev_page = self.get_json(page['prev'])
+        self.assertEqual(prev_page['customers'], urls[-len(page['customers']) - 5:-len(page['customers'])])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/v1/users/?cursor=garbage', headers=self.get_api_headers())
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_ndjson(self):
+        response = self.client.get('/api/v1/users/export', headers=self.get_api_headers())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        users = [json.loads(line) for line in response.data.decode('utf-8').splitlines()]
+        self.assertEqual([u['id'] for u in users], [u.id for u in User.query.order_by(User.id)])
+
+    def test_export_json(self):
+        response = self.client.get('/api/v1/users/export?format=json', headers=self.get_api_headers())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.data.decode('utf-8'))), User.query.count())
+
+    def test_batch_create_and_update(self):
+        role_url = 'http://localhost/api/v1/role/{}'.format(Role.query.filter_by(name='User').one().id)
+        users = [{'username': 'batch{}'.format(i), 'email': 'batch{}@example.com'.format(i), 'role': role_url}
+                 for i in range(3)]
+        users.append({'username': 'user0', 'email': 'new@example.com'})
+        users.append({'username': 'invalid', 'email': 'invalid@example.com', 'role': 'http://localhost/nowhere'})
+        response = self.client.post('/api/v1/users/batch', headers=self.get_api_headers(),
+                                    data=json.dumps({'users': users}))
+        self.assertEqual(response.status_code, 200)
+        body = json.loads(response.data.decode('utf-8'))
+        self.assertEqual([r['status'] for r in body['results']], [201, 201, 201, 409, 400])
+        self.assertEqual(body['stats']['succeeded'], 3)
+
+        created = body['results'][0]
+        response = self.client.put('/api/v1/users/batch', headers=self.get_api_headers(), data=json.dumps(
+            {'users': [{'id': created['id'], 'username': 'renamed', 'email': 'renamed@example.com',
+                        'confirmed': 'true'}]}))
+        self.assertEqual(response.status_code, 200)
+        db.session.expire_all()
+        user = User.query.get(created['id'])
+        self.assertEqual(user.username, 'renamed')
+        self.assertTrue(user.confirmed)
+
+    def test_admin_endpoints_forbid_users(self):
+        db.session.add(User(username='john', email='john@example.com', password='dog', confirmed=True))
+        db.session.commit()
+        headers = self.get_api_headers('john@example.com', 'dog')
+        role = Role.query.filter_by(name='User').one()
+        requests = [
+            ('get', '/api/v1/users/export'),
+            ('post', '/api/v1/users/batch'),
+            ('put', '/api/v1/users/batch'),
+            ('get', '/api/v1/role/{}/users'.format(role.id)),
+            ('get', '/api/v1/cache/stats')
+        ]
+        for method, url in requests:
+            response = getattr(self.client, method)(url, headers=headers, data=json.dumps({'users': []}))
+            self.assertEqual(response.status_code, 403, '{} {}'.format(method, url))
+
+    def test_role_members_are_paginated(self):
+        role = Role.query.filter_by(name='User').one()
+        response, body = self.get_json('/api/v1/role/{}'.format(role.id))
+        self.assertEqual(body['user_count'], 11)
+        self.assertNotIn('users', body)
+
+        response, page = self.get_json(body['users_url'] + '?limit=10')
+        self.assertEqual(len(page['users']), 10)
+        response, page = self.get_json(page['next'])
+        self.assertEqual(len(page['users']), 1)
+        self.assertIsNone(page['next'])
+
+    def test_conditional_get(self):
+        url = '/api/v1/users/{}'.format(self.admin.id)
+        response, body = self.get_json(url)
+        etag = response.headers['ETag']
+
+        headers = self.get_api_headers()
+        headers['If-None-Match'] = etag
+        response = self.client.get(url, headers=headers)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+        self.admin.username = 'renamed'
+        db.session.commit()
+        response = self.client.get(url, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_conditional_get_collection(self):
+        response, body = self.get_json('/api/v1/users/')
+        headers = self.get_api_headers()
+        headers['If-None-Match'] = response.headers['ETag']
+        self.assertEqual(self.client.get('/api/v1/users/', headers=headers).status_code, 304)
+
+    def test_conditional_get_last_page_gets_next_link(self):
+        url = '/api/v1/users/?limit={}'.format(User.query.count())
+        response, body = self.get_json(url)
+        self.assertIsNone(body['next'])
+        db.session.add(User(username='late', email='late@example.com'))
+        db.session.commit()
+        headers = self.get_api_headers()
+        headers['If-None-Match'] = response.headers['ETag']
+        response = self.client.get(url, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(json.loads(response.data.decode('utf-8'))['next'])
+
+    def test_response_cache(self):
+        self.app.config['API_RESPONSE_CACHE_ENABLED'] = True
+        self.app.config['API_RESPONSE_CACHE_SHARED_URL'] = 'memory://'
+        response_cache.init_app(self.app)
+        url = '/api/v1/users/{}'.format(self.admin.id)
+        response, body = self.get_json(url)
+        response, cached = self.get_json(url)
+        self.assertEqual(cached, body)
+
+        headers = self.get_api_headers()
+        headers['If-None-Match'] = response.headers['ETag']
+        self.assertEqual(self.client.get(url, headers=headers).status_code, 304)
+
+        response = self.client.put(url, headers=self.get_api_headers(),
+                                   data=json.dumps({'username': 'renamed', 'email': 'admin@example.com'}))
+        self.assertEqual(response.status_code, 200)
+        response, body = self.get_json(url)
+        self.assertEqual(body['username'], 'renamed')
+
+        response, stats = self.get_json('/api/v1/cache/stats')
+        self.assertEqual(stats['endpoints']['api_bp.get_user']['hits'], 2)
+        self.assertEqual(stats['endpoints']['api_bp.get_user']['misses'], 2)
+
+    def test_response_cache_with_token(self):
+        self.app.config['API_RESPONSE_CACHE_ENABLED'] = True
+        self.app.config['API_RESPONSE_CACHE_SHARED_URL'] = 'memory://'
+        response_cache.init_app(self.app)
+        response, body = self.get_json('/api/v1/get_token')
+        headers = self.get_api_headers(body['token'], '')
+        url = '/api/v1/users/{}'.format(self.admin.id)
+        for i in range(2):
+            response = self.client.get(url, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.data.decode('utf-8'))['id'], self.admin.id)
+        response, stats = self.get_json('/api/v1/cache/stats')
+        self.assertEqual(stats['endpoints']['api_bp.get_user']['hits'], 1)
+
+    def test_query_budgets(self):
+        role = Role.query.filter_by(name='Admin').one()
+        budgets = [
+            ('/api/v1/users/{}'.format(self.admin.id), 2),  # auth user lookup, user
+            ('/api/v1/users/', 2),  # auth user lookup, page
+            ('/api/v1/role/{}'.format(role.id), 4),  # auth user lookup, role, permissions, user count
+            ('/api/v1/permission/{}'.format(Permission.query.first().id), 3),  # auth user lookup, permission, roles
+            ('/api/v1/role/{}/users'.format(role.id), 3)  # auth user lookup, role existence, page
+        ]
+        self.get_json(budgets[0][0])  # warm up RBAC catalog
+        for url, max_queries in budgets:
+            with self.assertMaxQueries(max_queries):
+                response, body = self.get_json(url)
+            self.assertLessEqual(int(response.headers['X-DB-Queries']), max_queries)
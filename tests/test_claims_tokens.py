@@ -0,0 +1,84 @@
+import json
+import unittest
+from base64 import b64encode
+from app import create_app, db, claims_tokens, query_counter
+from app.models import User, Role
+from app.bulk import bulk_update_users
+
+
+class ClaimsTokensTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_cfg_roles()
+        self.admin = User(username='admin', email='admin@example.com', password='cat', confirmed=True,
+                          role=Role.query.filter_by(name='Admin').one())
+        self.user = User(username='john', email='john@example.com', password='dog', confirmed=True,
+                         role=Role.query.filter_by(name='User').one())
+        db.session.add_all([self.admin, self.user])
+        db.session.commit()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get(self, url, email_or_token, password=''):
+        return self.client.get(url, headers={
+            'Authorization': 'Basic ' + b64encode('{}:{}'.format(email_or_token, password)),
+            'Accept': 'application/json'})
+
+    def get_token(self, email, password):
+        response = self.get('/api/v1/get_token', email, password)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data.decode('utf-8'))['token']
+
+    def test_token_is_authorized_without_queries(self):
+        token = self.get_token('admin@example.com', 'cat')
+        self.assertLess(len(token), 80)
+        principal = claims_tokens.verify(token)
+        self.assertEqual((principal.id, principal.confirmed, principal.is_admin()), (self.admin.id, True, True))
+        self.assertEqual(self.get('/api/v1/cache/stats', token).status_code, 200)
+        with query_counter.recording() as stats:
+            self.assertEqual(self.get('/api/v1/cache/stats', token).status_code, 200)
+        self.assertEqual(stats.count, 0)
+
+        user_token = self.get_token('john@example.com', 'dog')
+        self.assertEqual(self.get('/api/v1/cache/stats', user_token).status_code, 403)
+
+    def test_invalid_tokens(self):
+        token = claims_tokens.issue(self.admin, 60)
+        self.assertIsNone(claims_tokens.verify(token[:-2] + ('AA' if token[-2:] != 'AA' else 'BB')))
+        self.assertIsNone(claims_tokens.verify('garbage'))
+        self.assertIsNone(claims_tokens.verify(claims_tokens.issue(self.admin, -1)))
+
+    def test_revocation(self):
+        token, other_token = claims_tokens.issue(self.admin, 60), claims_tokens.issue(self.admin, 60)
+        claims_tokens.revoke(claims_tokens.verify(token))
+        db.session.commit()
+        self.assertEqual(self.get('/api/v1/cache/stats', token).status_code, 401)
+        self.assertEqual(self.get('/api/v1/cache/stats', other_token).status_code, 200)
+
+        # change of role revokes all tokens of the user issued so far
+        self.admin.role = Role.query.filter_by(name='User').one()
+        db.session.commit()
+        self.assertIsNone(claims_tokens.verify(other_token))
+        self.assertEqual(self.get('/api/v1/cache/stats', self.get_token('admin@example.com', 'cat')).status_code,
+                         403)
+
+        # other processes load revocations from the database
+        self.app.extensions['claims_tokens'].bloom = None
+        self.assertIsNone(claims_tokens.verify(token))
+
+    def test_bulk_update_revokes_changed_claims(self):
+        token, admin_token = claims_tokens.issue(self.user, 60), claims_tokens.issue(self.admin, 60)
+        with self.app.test_request_context():
+            results, stats = bulk_update_users([
+                {'id': self.user.id, 'username': 'john', 'email': 'john@example.com', 'confirmed': 'false'},
+                {'id': self.admin.id, 'username': 'root', 'email': 'admin@example.com', 'confirmed': 'true'}])
+        self.assertEqual(stats['succeeded'], 2)
+        self.assertIsNone(claims_tokens.verify(token))
+        self.assertIsNotNone(claims_tokens.verify(admin_token))
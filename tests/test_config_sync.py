@@ -0,0 +1,87 @@
+import unittest
+from app import create_app, db, query_counter
+from app.config_sync import sync_config, ConfigSyncError
+from app.models import User, Role, Permission, RefreshToken
+from app.refresh_tokens import issue_refresh_token
+
+USERS = [
+    {'username': 'user{}'.format(i), 'email': 'user{}@example.com'.format(i), 'role': 'User',
+     'confirmed': True, 'password': 'password{}'.format(i)} for i in range(20)]
+
+
+class ConfigSyncTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['USERS'] = [dict(cfg_user) for cfg_user in USERS]
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_initial_sync(self):
+        plan = sync_config()
+        self.assertEqual((len(plan.permissions['insert']), len(plan.roles['insert']), len(plan.users['insert'])),
+                         (2, 2, 20))
+        self.assertEqual(plan.changed_passwords, 20)
+        admin = Role.query.filter_by(name='Admin').one()
+        self.assertEqual(sorted(p.name for p in admin.permissions), ['admin', 'read'])
+        user = User.query.filter_by(username='user3').one()
+        self.assertEqual(user.role.name, 'User')
+        self.assertTrue(user.password_is_correct('password3'))
+
+    def test_second_sync_changes_nothing(self):
+        sync_config()
+        hashes = dict(db.session.query(User.username, User.password_hash))
+        with query_counter.recording() as stats:
+            plan = sync_config()
+        self.assertTrue(plan.is_empty)
+        self.assertEqual(plan.unchanged_passwords, 20)
+        # permissions, roles, role permissions, users
+        self.assertEqual(stats.count, 4)
+        self.assertEqual(dict(db.session.query(User.username, User.password_hash)), hashes)
+
+    def test_only_changes_are_written(self):
+        sync_config()
+        hashes = dict(db.session.query(User.username, User.password_hash))
+        self.app.config['USERS'][1]['password'] = 'changed'
+        self.app.config['USERS'][2]['role'] = 'Admin'
+        self.app.config['ROLES'] = [dict(cfg_role) for cfg_role in self.app.config['ROLES']]
+        self.app.config['ROLES'][1]['permissions'] = []
+
+        dry_plan = sync_config(dry_run=True)
+        self.assertEqual(dry_plan.report().splitlines(), [
+            '~ user user1: password', '~ user user2: role', '- role User permission read'])
+        self.assertEqual(dict(db.session.query(User.username, User.password_hash)), hashes)
+
+        plan = sync_config()
+        self.assertEqual((plan.changed_passwords, plan.unchanged_passwords), (1, 19))
+        changed = [username for username, pwhash in db.session.query(User.username, User.password_hash)
+                   if hashes[username] != pwhash]
+        self.assertEqual(changed, ['user1'])
+        user1, user2 = User.query.get(2), User.query.get(3)
+        self.assertTrue(user1.password_is_correct('changed'))
+        self.assertEqual((user1.version, user2.version), (2, 2))
+        self.assertEqual(user2.role.name, 'Admin')
+        self.assertEqual(Role.query.filter_by(name='User').one().permissions, [])
+        self.assertEqual(Permission.query.filter_by(name='read').one().version, 2)
+
+    def test_password_change_revokes_refresh_tokens(self):
+        sync_config()
+        for username in ('user1', 'user2'):
+            issue_refresh_token(User.query.filter_by(username=username).one())
+        db.session.commit()
+        self.app.config['USERS'][1]['password'] = 'changed'
+        self.app.config['USERS'][2]['email'] = 'changed@example.com'
+        sync_config()
+        self.assertEqual(sorted(user_id for user_id, in db.session.query(RefreshToken.user_id).filter(
+            RefreshToken.revoked_at.is_(None))), [User.query.filter_by(username='user2').one().id])
+
+    def test_unknown_role(self):
+        self.app.config['USERS'][0]['role'] = 'Nobody'
+        with self.assertRaises(ConfigSyncError):
+            sync_config()
+        self.assertEqual(User.query.count(), 0)
@@ -0,0 +1,144 @@
+import email
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from flask_login import login_user, current_user
+from app import create_app, db, outbox, celery
+from app.email import _dump_context, send_templated_email, send_templated_email_to_many, send_email, drain_outbox
+from app.models import User
+from helpers import SmtpSink
+
+
+class EmailTasksTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(username='john', email='john@example.com')
+        db.session.add(self.user)
+        db.session.commit()
+        self.sink = SmtpSink()
+        self.sink.configure(self.app)
+
+    def tearDown(self):
+        self.sink.stop()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_template_is_rendered_by_task(self):
+        context = _dump_context({'user': self.user, 'token': 'abc'})
+        # task arguments are small and JSON serializable - models are passed by id
+        self.assertEqual(json.loads(json.dumps(context))['user'], {'__model__': 'User', 'id': self.user.id})
+        send_templated_email('john@example.com', 'Confirm', 'auth_bp/email/confirm', context, 'http://example.com/')
+        self.assertEqual(len(self.sink.messages), 1)
+        data = self.sink.messages[0][2]
+        self.assertIn('Dear john', data)
+        self.assertIn('http://example.com/auth/confirm/abc', data)
+
+    def test_current_user_is_passed_by_id(self):
+        with self.app.test_request_context():
+            login_user(self.user)
+            context = json.loads(json.dumps(_dump_context({'user': current_user, 'token': 'abc'})))
+        self.assertEqual(context['user'], {'__model__': 'User', 'id': self.user.id})
+
+    def test_fan_out_uses_single_connection(self):
+        recipients = ['user{}@example.com'.format(i) for i in range(5)]
+        send_templated_email_to_many(recipients, 'Confirm', 'auth_bp/email/confirm',
+                                     _dump_context({'user': self.user, 'token': 'abc'}))
+        self.assertEqual(len(self.sink.messages), 5)
+        self.assertEqual([rcpttos for mailfrom, rcpttos, data in self.sink.messages],
+                         [['<{}>'.format(recipient)] for recipient in recipients])
+        self.assertEqual(self.sink.connections, 1)
+        # every recipient gets own message
+        message_ids = set(email.message_from_string(data)['Message-ID']
+                          for mailfrom, rcpttos, data in self.sink.messages)
+        self.assertEqual(len(message_ids), 5)
+
+
+class OutboxTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.directory = tempfile.mkdtemp()
+        self.app.config['MAIL_OUTBOX_DIR'] = self.directory
+        outbox.init_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(username='john', email='john@example.com')
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        self.sink.stop()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.directory)
+
+    def spool(self, count):
+        with self.app.test_request_context():
+            for i in range(count):
+                send_email('user{}@example.com'.format(i), 'Confirm', 'auth_bp/email/confirm',
+                           token='abc', user=self.user, use_outbox=True)
+        self.assertEqual(outbox.pending(), count)
+
+    def test_drain_sends_spooled_emails(self):
+        self.sink = SmtpSink()
+        self.sink.configure(self.app)
+        self.spool(5)
+        self.assertEqual(drain_outbox(), 5)
+        self.assertEqual(outbox.pending(), 0)
+        self.assertEqual(len(self.sink.messages), 5)
+        self.assertEqual(self.sink.connections, 1)
+        self.assertIn('http://localhost/auth/confirm/abc', self.sink.messages[0][2])
+
+    def test_failed_delivery_keeps_emails(self):
+        self.sink = SmtpSink(fail_first=1)
+        self.sink.configure(self.app)
+        self.spool(3)
+        self.assertEqual(drain_outbox(), 0)
+        self.assertEqual(outbox.pending(), 3)
+        # new emails are spooled while previous ones wait
+        with self.app.test_request_context():
+            send_email('late@example.com', 'Confirm', 'auth_bp/email/confirm',
+                       token='abc', user=self.user, use_outbox=True)
+        self.assertEqual(drain_outbox(), 4)
+        self.assertEqual(outbox.pending(), 0)
+        self.assertEqual(len(self.sink.messages), 4)
+
+    def test_unavailable_broker_spools_email(self):
+        self.sink = SmtpSink()
+        broker_url, result_backend = celery.conf.broker_url, celery.conf.result_backend
+        celery.conf.update(broker_url='amqp://guest@127.0.0.1:1//', result_backend=None)
+        try:
+            with self.app.test_request_context():
+                send_email('john@example.com', 'Confirm', 'auth_bp/email/confirm',
+                           token='abc', user=self.user, use_celery=True)
+        finally:
+            celery.conf.update(broker_url=broker_url, result_backend=result_backend)
+        self.assertEqual(outbox.pending(), 1)
+        # the broker is not tried again for a while - the email is spooled at once
+        self.assertFalse(outbox.broker_available())
+        with self.app.test_request_context():
+            send_email('john@example.com', 'Confirm', 'auth_bp/email/confirm',
+                       token='abc', user=self.user, use_celery=True)
+        self.assertEqual(outbox.pending(), 2)
+
+    def test_rotated_files_are_closed(self):
+        self.sink = SmtpSink()
+        self.sink.configure(self.app)
+        state = self.app.extensions['outbox']
+        state.fsync = False
+        self.spool(1)
+        self.assertEqual(drain_outbox(), 1)
+        self.spool(1)
+        open_files = len(os.listdir('/proc/self/fd'))
+        for i in range(3):
+            self.assertEqual(drain_outbox(), 1)
+            self.spool(1)
+        # descriptor of every drained file is closed once new file is opened
+        self.assertEqual(len(os.listdir('/proc/self/fd')), open_files)
@@ -0,0 +1,59 @@
+import json
+import logging
+import unittest
+from collections import deque
+from StringIO import StringIO
+from app import create_app
+from app.logs import QueueHandler, QueueListener, SamplingFilter, RequestIdFilter, JsonFormatter
+
+
+class StructuredLoggingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.stream = StringIO()
+        output = logging.StreamHandler(self.stream)
+        output.setFormatter(JsonFormatter())
+        self.queue = deque()
+        self.handler = QueueHandler(self.queue, 10)
+        self.handler.addFilter(RequestIdFilter())
+        self.listener = QueueListener(self.queue, output)
+        self.logger = logging.getLogger('test_logs')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+
+    def records(self):
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_records_are_written_by_listener(self):
+        class Model(object):
+            def __repr__(self):
+                return '<Model>'
+
+        with self.app.test_request_context(headers={'X-Request-Id': 'abc-1'}):
+            self.app.preprocess_request()
+            self.logger.debug('plain %s %d', 'argument', 1)
+            self.logger.info('object %r', Model())
+        self.assertEqual(len(self.queue), 2)
+        self.listener.start()
+        self.listener.stop()
+        records = self.records()
+        self.assertEqual([r['message'] for r in records], ['plain argument 1', 'object <Model>'])
+        self.assertEqual([r['request_id'] for r in records], ['abc-1', 'abc-1'])
+
+    def test_full_queue_drops_records(self):
+        for i in range(12):
+            self.logger.debug('record %d', i)
+        self.assertEqual(self.handler.dropped, 2)
+
+    def test_sampling(self):
+        sampling = SamplingFilter({'app': 0.0, 'app.api_v1_bp': 1.0})
+        record = logging.LogRecord('app.api_v1_bp.authentication_views', logging.DEBUG, '', 0, 'x', None, None)
+        self.assertTrue(sampling.filter(record))
+        record.name = 'app.models'
+        self.assertFalse(sampling.filter(record))
+        record.levelno = logging.WARNING
+        self.assertTrue(sampling.filter(record))
@@ -0,0 +1,40 @@
+import unittest
+from flask_mail import Message
+from app import create_app, mail_pool
+from helpers import SmtpSink
+
+
+class MailPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config.update(MAIL_POOL_WORKERS=1, MAIL_POOL_QUEUE_SIZE=100, MAIL_POOL_RETRY_BACKOFF=0.01)
+        mail_pool.init_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        mail_pool.shutdown(timeout=10)
+        self.sink.stop()
+        self.app_context.pop()
+
+    def send(self, count):
+        for i in range(count):
+            mail_pool.send(Message('Message {}'.format(i), sender='admin@example.com',
+                                   recipients=['user{}@example.com'.format(i)], body='Hello'))
+        self.assertTrue(mail_pool.wait(timeout=10))
+
+    def test_messages_share_connection(self):
+        self.sink = SmtpSink()
+        self.sink.configure(self.app)
+        self.send(20)
+        self.assertEqual(len(self.sink.messages), 20)
+        self.assertEqual(self.sink.connections, 1)
+        self.assertEqual(mail_pool.stats()['sent'], 20)
+
+    def test_temporary_failures_are_retried(self):
+        self.sink = SmtpSink(fail_first=2)
+        self.sink.configure(self.app)
+        self.send(3)
+        self.assertEqual(len(self.sink.messages), 3)
+        stats = mail_pool.stats()
+        self.assertEqual((stats['sent'], stats['failed'], stats['retries']), (3, 0, 2))
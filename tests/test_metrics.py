@@ -0,0 +1,47 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from app import create_app, db
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.multiproc_dir = tempfile.mkdtemp()
+        self.app = create_app('testing')
+        self.app.extensions['metrics'].multiproc_dir = self.multiproc_dir
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.multiproc_dir)
+
+    def test_metrics(self):
+        for i in range(3):
+            self.assertEqual(self.client.get('/api/v1/users/').status_code, 401)
+        body = self.client.get('/metrics').data.decode('utf-8')
+        self.assertIn('http_requests_total{blueprint="api_bp",view="get_users",status="401"} 3', body)
+        self.assertIn('http_request_duration_seconds_count{blueprint="api_bp",view="get_users"} 3', body)
+        self.assertIn('http_request_duration_seconds_bucket{blueprint="api_bp",view="get_users",le="+Inf"} 3', body)
+        self.assertIn('http_requests_in_flight 1', body)
+
+    def test_metrics_of_worker_processes_are_summed(self):
+        self.client.get('/api/v1/users/')
+        worker = {
+            'pid': 2 ** 22 + 1,  # not running process
+            'in_flight': 5,
+            'endpoints': [['api_bp', 'get_users', {
+                'buckets': [2] + [0] * len(self.app.config['METRICS_BUCKETS']),
+                'latency_sum': 0.002, 'db_time_sum': 0.001, 'statuses': {'401': 2}}]]
+        }
+        with open(os.path.join(self.multiproc_dir, 'metrics-{}-0.json'.format(worker['pid'])), 'w') as f:
+            json.dump(worker, f)
+        body = self.client.get('/metrics').data.decode('utf-8')
+        self.assertIn('http_requests_total{blueprint="api_bp",view="get_users",status="401"} 3', body)
+        self.assertIn('http_requests_in_flight 1', body)
@@ -0,0 +1,72 @@
+import unittest
+from base64 import b64encode
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+from app import create_app, db
+from app.db_routing import ReadOnlyRequestError, read_write
+from app.models import User, Role
+
+
+class ReadOnlyRequestsTestCase(unittest.TestCase):
+    '''
+    Requests run without pushed application context (like in production), so
+    SQLALCHEMY_COMMIT_ON_TEARDOWN applies to every request
+    '''
+
+    def setUp(self):
+        self.app = create_app('testing')
+
+        def write_on_get():
+            db.session.add(User(username='susan', email='susan@example.com'))
+            return 'written'
+
+        self.app.add_url_rule('/write_on_get', 'write_on_get', write_on_get)
+        self.app.add_url_rule('/write_on_get_allowed', 'write_on_get_allowed',
+                              read_write(lambda: write_on_get()))
+
+        with self.app.app_context():
+            db.create_all()
+            Role.insert_cfg_roles()
+            admin = User(username='admin', email='admin@example.com', confirmed=True,
+                         role=Role.query.filter_by(name='Admin').one())
+            # hash of outdated method is replaced on login
+            admin.password_hash = generate_password_hash('cat', 'pbkdf2:sha256:500')
+            db.session.add(admin)
+            db.session.commit()
+            self.admin_id = admin.id
+            self.engine = db.engine
+        self.commits = []
+        event.listen(self.engine, 'commit', self.count_commit)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        event.remove(self.engine, 'commit', self.count_commit)
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def count_commit(self, conn):
+        self.commits.append(conn)
+
+    def get_api_headers(self):
+        return {'Authorization': 'Basic ' + b64encode('admin@example.com:cat'), 'Accept': 'application/json'}
+
+    def test_get_is_not_committed_unless_it_writes(self):
+        # first login rehashes the password - the request escalates to read-write
+        response = self.client.get('/api/v1/users/{}'.format(self.admin_id), headers=self.get_api_headers())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.commits), 1)
+        with self.app.app_context():
+            self.assertFalse(User.query.get(self.admin_id).password_hash.startswith('pbkdf2:sha256:500$'))
+
+        del self.commits[:]
+        response = self.client.get('/api/v1/users/{}'.format(self.admin_id), headers=self.get_api_headers())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.commits, [])
+
+    def test_write_in_read_only_request(self):
+        with self.assertRaises(ReadOnlyRequestError):
+            self.client.get('/write_on_get')
+        self.assertEqual(self.client.get('/write_on_get_allowed').status_code, 200)
+        with self.app.app_context():
+            self.assertEqual(User.query.filter_by(username='susan').count(), 1)
@@ -0,0 +1,81 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from base64 import b64encode
+from app import create_app, db, read_replicas
+from app.models import User, Role
+from config import TestingConfig
+
+
+class ReadReplicasTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        replica_path = os.path.join(self.directory, 'replica.sqlite')
+        TestingConfig.SQLALCHEMY_BINDS = {'replica': 'sqlite:///' + replica_path}
+        TestingConfig.SQLALCHEMY_READ_REPLICAS = ['replica']
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_cfg_roles()
+        db.session.add(User(username='admin', email='admin@example.com', password='cat', confirmed=True,
+                            role=Role.query.filter_by(name='Admin').one()))
+        db.session.add(User(username='john', email='john@example.com'))
+        db.session.commit()
+        # replica is copy of the primary that lags behind
+        shutil.copy(db.engine.url.database, replica_path)
+        db.get_engine(self.app, 'replica').execute(
+            User.__table__.update().where(User.username == 'john').values(username='john-replica'))
+        self.john_id = User.query.filter_by(username='john').one().id
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        TestingConfig.SQLALCHEMY_BINDS = None
+        TestingConfig.SQLALCHEMY_READ_REPLICAS = []
+        shutil.rmtree(self.directory)
+
+    def get_api_headers(self):
+        return {
+            'Authorization': 'Basic ' + b64encode('admin@example.com:cat'),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+
+    def test_get_reads_from_replica(self):
+        response = self.client.get('/api/v1/users/{}'.format(self.john_id), headers=self.get_api_headers())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data.decode('utf-8'))['username'], 'john-replica')
+        # credentials are checked on the primary
+        self.assertIn('default=', response.headers['X-DB-Queries-By-Bind'])
+        self.assertIn('replica=', response.headers['X-DB-Queries-By-Bind'])
+
+    def test_writes_go_to_primary(self):
+        response = self.client.put('/api/v1/users/{}'.format(self.john_id), headers=self.get_api_headers(),
+                                   data=json.dumps({'username': 'johnny', 'email': 'john@example.com'}))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('replica=', response.headers['X-DB-Queries-By-Bind'])
+        self.assertEqual(User.query.get(self.john_id).username, 'johnny')
+
+    def test_reads_stick_to_primary_after_write(self):
+        read_replicas.route_to_replica()
+        self.assertEqual(User.query.filter_by(id=self.john_id).one().username, 'john-replica')
+        db.session.add(User(username='susan', email='susan@example.com'))
+        db.session.commit()
+        self.assertEqual(db.session.query(User.username).filter_by(id=self.john_id).scalar(), 'john')
+        read_replicas.reset()
+
+    def test_statement_routing(self):
+        read_replicas.route_to_replica()
+        names = db.session.query(User.username)
+        self.assertIn('john-replica', [name for name, in names.union(names)])
+        self.assertEqual(names.filter_by(id=self.john_id).with_for_update().scalar(), 'john')
+        read_replicas.route_to_replica()
+        # textual statements go to the primary
+        self.assertEqual(db.session.execute(db.text('SELECT username FROM users WHERE id = :id'),
+                                            {'id': self.john_id}).scalar(), 'john')
+        read_replicas.reset()
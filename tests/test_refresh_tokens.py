@@ -0,0 +1,88 @@
+import json
+import unittest
+from base64 import b64encode
+from werkzeug.security import generate_password_hash
+from app import create_app, db, claims_tokens
+from app.models import User, Role, RefreshToken
+
+
+class RefreshTokensTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_cfg_roles()
+        self.user = User(username='john', email='john@example.com', password='dog', confirmed=True)
+        db.session.add(self.user)
+        db.session.commit()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get_tokens(self):
+        response = self.client.get('/api/v1/get_token', headers={
+            'Authorization': 'Basic ' + b64encode('john@example.com:dog'), 'Accept': 'application/json'})
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data.decode('utf-8'))
+
+    def post(self, url, refresh_token):
+        return self.client.post(url, data=json.dumps({'refresh_token': refresh_token}),
+                                content_type='application/json', headers={'Accept': 'application/json'})
+
+    def test_refresh_rotates_token(self):
+        tokens = self.get_tokens()
+        self.assertEqual(RefreshToken.query.count(), 1)
+        self.assertNotIn(tokens['refresh_token'], [row.token_hash for row in RefreshToken.query])
+
+        response = self.post('/api/v1/refresh_token', tokens['refresh_token'])
+        self.assertEqual(response.status_code, 200)
+        refreshed = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(claims_tokens.verify(refreshed['token']).id, self.user.id)
+        self.assertNotEqual(refreshed['refresh_token'], tokens['refresh_token'])
+        self.assertEqual(self.post('/api/v1/refresh_token', refreshed['refresh_token']).status_code, 200)
+
+        self.assertEqual(self.post('/api/v1/refresh_token', 'unknown').status_code, 401)
+        self.assertEqual(self.client.post('/api/v1/refresh_token', data='{}',
+                                          content_type='application/json').status_code, 400)
+
+    def test_reuse_revokes_family(self):
+        tokens = self.get_tokens()
+        other = self.get_tokens()
+        refreshed = json.loads(self.post('/api/v1/refresh_token', tokens['refresh_token']).data.decode('utf-8'))
+        # old token used again (stolen) - the token issued instead of it is revoked too
+        self.assertEqual(self.post('/api/v1/refresh_token', tokens['refresh_token']).status_code, 401)
+        self.assertEqual(self.post('/api/v1/refresh_token', refreshed['refresh_token']).status_code, 401)
+        # other logins are not affected
+        self.assertEqual(self.post('/api/v1/refresh_token', other['refresh_token']).status_code, 200)
+
+    def test_revoke(self):
+        tokens = self.get_tokens()
+        self.assertEqual(self.post('/api/v1/revoke_token', tokens['refresh_token']).status_code, 204)
+        self.assertEqual(self.post('/api/v1/refresh_token', tokens['refresh_token']).status_code, 401)
+
+        tokens = self.get_tokens()
+        self.user.confirmed = False
+        db.session.commit()
+        self.assertEqual(self.post('/api/v1/refresh_token', tokens['refresh_token']).status_code, 403)
+        # the token is not rotated for unconfirmed user - it works once the account is confirmed
+        self.user.confirmed = True
+        db.session.commit()
+        self.assertEqual(self.post('/api/v1/refresh_token', tokens['refresh_token']).status_code, 200)
+
+    def test_password_change_revokes_tokens(self):
+        tokens = self.get_tokens()
+        # rehash of the same password on login keeps them
+        self.user.password_hash = generate_password_hash('dog', 'pbkdf2:sha1:500')
+        db.session.commit()
+        self.assertTrue(self.user.password_is_correct('dog'))
+        self.assertFalse(self.user.password_hash.startswith('pbkdf2:sha1:500$'))
+        db.session.commit()
+        self.assertEqual(RefreshToken.query.filter_by(revoked_at=None).count(), 1)
+
+        self.user.password = 'cat'
+        db.session.commit()
+        self.assertEqual(self.post('/api/v1/refresh_token', tokens['refresh_token']).status_code, 401)
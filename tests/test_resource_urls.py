@@ -0,0 +1,61 @@
+import unittest
+from app import create_app
+from app.resource_urls import ResourceUrlResolver, resolve_url
+from app.utils import ValidationError, split_url
+
+
+class ResourceUrlsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.request_context = self.app.test_request_context()
+        self.request_context.push()
+
+    def tearDown(self):
+        self.request_context.pop()
+
+    def assertResolvesLikeSplitUrl(self, url):
+        try:
+            expected = split_url(url)
+        except ValidationError:
+            with self.assertRaises(ValidationError):
+                resolve_url(url)
+        else:
+            self.assertEqual(resolve_url(url), expected)
+            # memoized result is the same
+            self.assertEqual(resolve_url(url), expected)
+
+    def test_resource_urls(self):
+        for url in ('http://localhost/api/v1/role/2', '/api/v1/role/2',
+                    'http://localhost/api/v1/users/5', '/api/v1/permission/3'):
+            self.assertResolvesLikeSplitUrl(url)
+        self.assertEqual(resolve_url('/api/v1/role/2'), ('api_bp.get_role', {'id': 2}))
+
+    def test_foreign_host(self):
+        self.assertResolvesLikeSplitUrl('http://example.com/api/v1/role/2')
+        with self.assertRaises(ValidationError):
+            resolve_url('http://example.com/api/v1/role/2')
+
+    def test_trailing_slash_and_query_string(self):
+        for url in ('/api/v1/role/2/', 'http://localhost/api/v1/role/2/',
+                    '/api/v1/role/2?expand=users', 'http://localhost/api/v1/role/2?expand=users'):
+            self.assertResolvesLikeSplitUrl(url)
+
+    def test_non_numeric_id(self):
+        for url in ('/api/v1/role/admin', 'http://localhost/api/v1/role/-2', '/api/v1/role/'):
+            self.assertResolvesLikeSplitUrl(url)
+
+    def test_unknown_path_falls_back_to_split_url(self):
+        for url in ('/api/v1/users/', 'http://localhost/api/v1/role/2/users', '/nothing/here/2'):
+            self.assertResolvesLikeSplitUrl(url)
+        self.assertEqual(resolve_url('/api/v1/users/')[0], 'api_bp.get_users')
+
+    def test_memo_is_cleared_when_full(self):
+        resolver = ResourceUrlResolver(self.app.url_map, memo_size=2)
+        self.assertEqual(resolver.resolve('/api/v1/role/1', 'localhost'), ('api_bp.get_role', {'id': 1}))
+        resolver.resolve('/api/v1/role/2', 'localhost')
+        self.assertEqual(len(resolver.memo), 2)
+        self.assertEqual(resolver.resolve('/api/v1/role/3', 'localhost'), ('api_bp.get_role', {'id': 3}))
+        self.assertEqual(list(resolver.memo.values()), [('api_bp.get_role', {'id': 3})])
+        # URLs that are not resolved by the fast path are not memoized
+        self.assertIsNone(resolver.resolve('/api/v1/users/', 'localhost'))
+        self.assertEqual(len(resolver.memo), 1)
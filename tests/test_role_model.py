@@ -1,5 +1,6 @@
 
 import unittest
+from app import create_app, db, rbac_cache
 from app.models import Role, Permission, User, AnonymousUser
 
 
@@ -30,3 +31,36 @@ class UserModelTestCase(unittest.TestCase): # ...
         with self.assertRaises(AttributeError):
             self.role.url = 'some_url'
 
+
+class RbacCatalogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_cfg_roles()
+        self.user = User(email='user@example.com', password='cat')
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_user_permissions(self):
+        self.assertTrue(self.user.can(['read']))
+        self.assertFalse(self.user.can(['admin']))
+        self.assertFalse(self.user.can(['no_such_permission']))
+        self.assertFalse(self.user.is_admin())
+
+    def test_catalog_is_reused(self):
+        self.assertIs(rbac_cache.catalog(), rbac_cache.catalog())
+
+    def test_catalog_invalidated_on_commit(self):
+        self.assertFalse(self.user.can(['admin']))
+        version = rbac_cache.catalog().version
+        self.user.role.permissions.append(Permission.query.filter_by(name='admin').one())
+        db.session.commit()
+        self.assertNotEqual(version, rbac_cache.catalog().version)
+        self.assertTrue(self.user.can(['admin']))
@@ -0,0 +1,60 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from app import create_app, template_cache
+from app.template_cache import CHECKSUMS_FILE
+from app.email import render_email
+from config import TestingConfig
+
+
+class TemplateCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir, self.compiled_dir = tempfile.mkdtemp(), tempfile.mkdtemp()
+        TestingConfig.JINJA_BYTECODE_CACHE_DIR = self.cache_dir
+        TestingConfig.MAIL_TEMPLATES_COMPILED_DIR = self.compiled_dir
+
+    def tearDown(self):
+        TestingConfig.JINJA_BYTECODE_CACHE_DIR = TestingConfig.MAIL_TEMPLATES_COMPILED_DIR = None
+        shutil.rmtree(self.cache_dir)
+        shutil.rmtree(self.compiled_dir)
+
+    def test_precompiled_templates_are_used(self):
+        app = create_app('testing')
+        with app.app_context():
+            compiled, errors = template_cache.precompile()
+        self.assertEqual(errors, {})
+        self.assertIn('bootstrap/base.html', compiled)
+        self.assertEqual(len(os.listdir(self.cache_dir)), len(compiled))
+        # only email templates are compiled to modules
+        self.assertEqual(len(os.listdir(self.compiled_dir)), 2 + 1)
+        self.assertIn(CHECKSUMS_FILE, os.listdir(self.compiled_dir))
+
+        app = create_app('testing')
+        with app.test_request_context():
+            msg = render_email(['john@example.com'], 'Confirm', 'auth_bp/email/confirm',
+                               user={'username': 'john'}, token='abc')
+            self.assertIn('http://localhost/auth/confirm/abc', msg.body)
+            self.assertTrue(app.jinja_env.get_template('auth_bp/email/confirm.html').filename.startswith(
+                self.compiled_dir))
+            self.assertTrue(app.jinja_env.get_template('index.html').filename.endswith('index.html'))
+
+    def test_outdated_compiled_template_is_not_used(self):
+        app = create_app('testing')
+        with app.app_context():
+            template_cache.precompile()
+        # template changed after precompile
+        path = os.path.join(self.compiled_dir, CHECKSUMS_FILE)
+        with open(path) as f:
+            checksums = json.load(f)
+        checksums['auth_bp/email/confirm.html'] = 'outdated'
+        with open(path, 'w') as f:
+            json.dump(checksums, f)
+
+        app = create_app('testing')
+        with app.test_request_context():
+            self.assertTrue(app.jinja_env.get_template('auth_bp/email/confirm.txt').filename.startswith(
+                self.compiled_dir))
+            self.assertTrue(app.jinja_env.get_template('auth_bp/email/confirm.html').filename.endswith(
+                'confirm.html'))
@@ -1,5 +1,7 @@
 import unittest
-from app.models import User
+from werkzeug.security import generate_password_hash
+from app import create_app, db, token_cache, password_hasher
+from app.models import User, Role
 
 
 class UserModelTestCase(unittest.TestCase):
@@ -27,3 +29,73 @@ def test_password_salts_are_random(self):
 #     u.import_from_dict('')
 
 
+
+class AuthTokenCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_cfg_roles()
+        self.user = User(username='cat', email='cat@example.com', password='cat')
+        db.session.add(self.user)
+        db.session.commit()
+        self.token = self.user.generate_auth_token(expiration=60)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_verified_token_is_cached(self):
+        self.assertEqual(User.verify_auth_token(self.token).id, self.user.id)
+        self.assertEqual(User.verify_auth_token(self.token).id, self.user.id)
+        stats = token_cache.stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 1)
+
+    def test_invalid_token_is_not_cached(self):
+        self.assertIsNone(User.verify_auth_token('invalid'))
+        self.assertEqual(token_cache.stats()['size'], 0)
+
+    def test_user_update_evicts_tokens(self):
+        User.verify_auth_token(self.token)
+        self.user.confirmed = True
+        db.session.commit()
+        self.assertEqual(token_cache.stats()['size'], 0)
+        self.assertTrue(User.verify_auth_token(self.token).confirmed)
+
+
+class PasswordRehashTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        self.app_context.pop()
+
+    def test_outdated_hash_is_upgraded_on_login(self):
+        u = User(role=Role(name='test'))
+        u.password_hash = generate_password_hash('cat', 'pbkdf2:sha1:500')
+        self.assertFalse(u.password_is_correct('dog'))
+        self.assertTrue(u.password_hash.startswith('pbkdf2:sha1:500$'))
+        self.assertTrue(u.password_is_correct('cat'))
+        self.assertFalse(password_hasher.needs_rehash(u.password_hash))
+        self.assertTrue(u.password_is_correct('cat'))
+
+    def test_batches_take_pending_slots(self):
+        self.app.config.update(PASSWORD_HASH_POOL_SIZE=2, PASSWORD_HASH_MAX_PENDING=1)
+        password_hasher.init_app(self.app)
+        state = self.app.extensions['password_hasher']
+        try:
+            passwords = ['password{}'.format(i) for i in range(5)]
+            hashes = password_hasher.hash_many(passwords)
+            self.assertEqual(password_hasher.verify_many(list(zip(hashes, passwords))), [True] * 5)
+            self.assertEqual(password_hasher.verify_many(list(zip(hashes, reversed(passwords)))),
+                             [False, False, True, False, False])
+            # the only slot is free again
+            self.assertTrue(state.pending.acquire(False))
+            state.pending.release()
+        finally:
+            state.get_pool().terminate()